@@ -0,0 +1,195 @@
+"""
+Asyncio mode of the bot: the handlers of main2.py on AsyncTeleBot with the async database layer of async_db.py.
+While one user waits for the database, the updates of other users are processed, so the throughput is not limited
+to one interaction per database round trip.
+
+Started with `python3 main2.py --async`.
+"""
+import asyncio
+import random
+
+from telebot import asyncio_filters, types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_storage import StateMemoryStorage
+
+from async_db import build_card
+from async_db import if_users_not_exists
+from async_db import add_users
+from async_db import add_word_to_dictionary
+from async_db import delete_word_to_dictionary
+from async_db import adding_a_word_by_the_user
+from async_db import close_pool, get_pool, save_events
+
+from events import EventBuffer
+from logs import setup_logging
+
+from bot_common import Commands, States, card_keyboard, show_chat_hint, show_translation_process
+from card_queue import ChatCard
+
+from config import TOKEN
+
+State_Storage = StateMemoryStorage()  # Храним данные в словаре
+BOT = AsyncTeleBot(TOKEN, state_storage=State_Storage)
+
+user_status = {}  # Словарь с состоянием пользователя
+active_cards = {}  # Карточка, на которую сейчас отвечает пользователь (ChatCard)
+add_english_word = {}
+# Ответы записываются в БД пачками в фоновом потоке, обработчик их не ждёт. Создаётся в main()
+EVENTS = None
+# True - пользователь выбирает русский перевод английского слова, False - наоборот
+TO_RUSSIAN = True
+
+
+@BOT.message_handler(commands=['start'])
+async def start(message: types.Message):
+    """
+    See main2.start.
+    """
+    chat_id = message.chat.id
+    user_name = message.from_user.first_name
+    if not await if_users_not_exists(chat_id):
+        await add_users(chat_id, user_name)
+        user_status[chat_id] = 0
+        await BOT.send_message(chat_id, f"Привет {user_name} 👋 Давай попрактикуемся в английском языке. "
+                                        f"Тренировки можешь проходить в удобном для себя темпе. "
+                                        f"Используй команду /cards для того чтобы начать обучение.")
+
+
+@BOT.message_handler(commands=['cards'])
+async def create_cards(message: types.Message):
+    """
+    See main2.create_cards. The card is built with one async build_card query.
+    """
+    chat_id = message.chat.id
+    card = await build_card(chat_id, to_russian=TO_RUSSIAN)
+    if card is None:
+        await BOT.send_message(chat_id, "В словаре пока нет слов. Добавьте их командой " + Commands.ADD_WORD)
+        return
+    initial_word, translate_word, other_words = card
+
+    options = [initial_word] + list(other_words)
+    random.shuffle(options)
+    card = ChatCard(None, initial_word, translate_word, options)
+
+    first_message = f"Выберите перевод слова:\n {translate_word}"
+    await BOT.send_message(message.chat.id, first_message, reply_markup=card_keyboard(card))
+    await BOT.set_state(message.from_user.id, States.initial_word, message.chat.id)
+    active_cards[message.from_user.id] = card
+
+
+@BOT.message_handler(func=lambda message: message.text == Commands.NEXT)
+async def next_cards(message: types.Message):
+    """
+    See main2.next_cards.
+    """
+    await create_cards(message)
+
+
+@BOT.message_handler(func=lambda message: message.text == Commands.DELETE_WORD)
+async def delete_word(message: types.Message):
+    """
+    See main2.delete_word.
+    """
+    user_status[message.chat.id] = 3
+    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
+    await BOT.send_message(message.chat.id, "Напишите какое слово вы хотели бы удалить", reply_markup=keyboard_markup)
+
+
+@BOT.message_handler(func=lambda message: message.text == Commands.ADD_WORD)
+async def add_word(message: types.Message):
+    """
+    See main2.add_word.
+    """
+    user_status[message.chat.id] = 1
+    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
+    await BOT.send_message(message.chat.id, "Напишите новое английское слово", reply_markup=keyboard_markup)
+
+
+@BOT.message_handler(func=lambda message: True, content_types=['text'])
+async def message_processing(message: types.Message):
+    """
+    See main2.message_processing.
+    """
+    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
+    text = message.text
+    user_id = message.from_user.id
+    flag = False
+    user_hint = ""
+    # Новый пользователь (его ещё нет в user_status) отвечает на карточки
+    status = user_status.get(user_id, 0)
+    if status == 0:
+        card = active_cards.get(user_id)
+        if card is None:
+            # Карточка ещё не выдавалась: выдаём первую
+            await create_cards(message)
+            return
+        correct = card.check(text)
+        if correct is not None:
+            EVENTS.answer(user_id, card.word_id, correct)
+        if correct:
+            user_hint = show_chat_hint('Отлично!❤', show_translation_process(card))
+            flag = True
+        else:
+            keyboard_markup = card_keyboard(card)
+            user_hint = show_chat_hint("Допущена ошибка!",
+                                       f"Постарайтесь вспомнить слово {card.prompt} "
+                                       f"и попробовать заново!")
+    elif status == 1:
+        add_english_word[user_id] = text
+        user_hint = f"Отлично, слово {text} добавлено! Теперь введите его значение"
+        user_status[user_id] = 2
+    elif status == 2:
+        user_status[user_id] = 0
+        english_word = add_english_word.pop(user_id)
+        word_count = await add_word_to_dictionary(user_id, english_word, text)
+        if word_count == 'Duplicate':
+            user_hint = "Это слово уже добавлено в ваш словарь!"
+        elif word_count is None:
+            user_hint = "Не удалось добавить слово, попробуйте ещё раз"
+        else:
+            EVENTS.word_added(user_id, english_word)
+            user_hint = f"Отлично! Новое слово {text} добавлено в ваш словарь!\n\n"
+            user_hint += "Количество ваших слов ➝ " + str(word_count)
+    elif status == 3:
+        if not await delete_word_to_dictionary(user_id, text):
+            user_hint = "Данного слова нет в вашем словаре!"
+        else:
+            EVENTS.word_deleted(user_id, text)
+            user_hint = f"Слово {text} успешно удалено!\n"
+            user_words = await adding_a_word_by_the_user(user_id)
+            user_hint += "Теперь в вашем словаре количество слов составляет ➝ " + user_words
+        user_status[user_id] = 0
+
+    await BOT.send_message(message.chat.id, user_hint, reply_markup=keyboard_markup)
+    if flag:
+        await next_cards(message)
+
+
+async def main():
+    """
+    Opens the connection pool and the event buffer and runs the bot until it is stopped. The background thread of
+    the buffer writes the batches with async_db.save_events on the event loop of the bot.
+    """
+    global EVENTS
+    BOT.add_custom_filter(asyncio_filters.StateFilter(BOT))  # Фильтр состояния
+    await get_pool()
+    loop = asyncio.get_running_loop()
+
+    def write_batch(*batch):
+        return asyncio.run_coroutine_threadsafe(save_events(*batch), loop).result()
+
+    EVENTS = EventBuffer(write_batch)
+    try:
+        await BOT.infinity_polling(skip_pending=True)
+    finally:
+        # close() ждёт записи пачек, которые выполняются на этом же цикле событий, поэтому он вызывается в потоке
+        await loop.run_in_executor(None, EVENTS.close)
+        await close_pool()
+
+
+if __name__ == '__main__':
+    logs = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        logs.stop()
@@ -0,0 +1,259 @@
+"""
+Async equivalents of the database functions of main.py for the asyncio mode of the bot (async_bot.py).
+
+The functions run the same statements from queries.py on psycopg 3 with an AsyncConnectionPool, take the same
+arguments (without the cursor) and return the same values as their counterparts in main.py.
+"""
+import logging
+import time
+from functools import wraps
+
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+import queries
+from config import password, database, user
+from db_pool import POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_MAX_LIFETIME, POOL_MAX_IDLE
+from metrics import db_histograms
+from normalization import clean_word
+from prepared import PREPARED_STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+async def get_pool():
+    """
+    Returns the shared async connection pool, opening it on first use with the pool settings from config.py.
+    psycopg 3 prepares the statements itself: with prepare_threshold=0 every statement is prepared on the first
+    execution on a connection, like prepared.execute() does for the sync mode; with PREPARED_STATEMENTS = False
+    nothing is prepared.
+
+    :return: AsyncConnectionPool
+    """
+    global _pool
+    if _pool is None:
+        pool = AsyncConnectionPool(make_conninfo(dbname=database, user=user, password=password),
+                                   min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                                   max_lifetime=POOL_MAX_LIFETIME, max_idle=POOL_MAX_IDLE,
+                                   check=AsyncConnectionPool.check_connection, open=False,
+                                   kwargs={'prepare_threshold': 0 if PREPARED_STATEMENTS else None})
+        await pool.open()
+        _pool = pool
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def db_connection(func):
+    """
+    Async version of main.db_connection: takes a connection from the pool and passes a cursor to the coroutine as
+    the first argument. The pool commits the transaction if the coroutine completes without an exception.
+    The time of taking the connection and the time of the coroutine are recorded as in main.db_connection.
+    """
+    acquire_histogram, query_histogram = db_histograms(func.__name__)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        pool = await get_pool()
+        started = time.perf_counter()
+        async with pool.connection() as conn:
+            acquired = time.perf_counter()
+            acquire_histogram.observe(acquired - started)
+            try:
+                async with conn.cursor() as cur:
+                    return await func(cur, *args, **kwargs)
+            finally:
+                query_histogram.observe(time.perf_counter() - acquired)
+    return wrapper
+
+
+def _log_exception(ex):
+    # stacklevel=2: в записи указывается функция БД, а не _log_exception
+    logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args, stacklevel=2)
+
+
+@db_connection
+async def random_words_from_db(cur, user_id):
+    """
+    See main.random_words_from_db.
+    """
+    try:
+        await cur.execute(queries.RANDOM_WORDS, {'user_id': user_id})
+        return await cur.fetchone()
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def random_english_words(cur, word_to_avoid, user_id):
+    """
+    See main.random_english_words.
+    """
+    try:
+        await cur.execute(queries.RANDOM_ENGLISH_WORDS, {'user_id': user_id, 'word_to_avoid': word_to_avoid,
+                                                         'limit': 4, 'probes': 4 * queries.PROBES_PER_WORD})
+        return [row[0] for row in await cur.fetchall()]
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def random_russian_words(cur, word_to_avoid, user_id):
+    """
+    See main.random_russian_words.
+    """
+    try:
+        await cur.execute(queries.RANDOM_RUSSIAN_WORDS, {'user_id': user_id, 'word_to_avoid': word_to_avoid,
+                                                         'limit': 4, 'probes': 4 * queries.PROBES_PER_WORD})
+        return [row[0] for row in await cur.fetchall()]
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def build_card(cur, user_id, to_russian=True):
+    """
+    See main.build_card.
+    """
+    try:
+        sql = queries.BUILD_CARD_TO_RUSSIAN if to_russian else queries.BUILD_CARD_TO_ENGLISH
+        await cur.execute(sql, {'user_id': user_id, 'limit': 4, 'probes': 4 * queries.PROBES_PER_WORD})
+        return await cur.fetchone()
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def random_pairs_from_db(cur, user_id, count):
+    """
+    See main.random_pairs_from_db.
+    """
+    try:
+        await cur.execute(queries.RANDOM_PAIRS, {'user_id': user_id, 'count': count, 'probes': count * 2})
+        return await cur.fetchall()
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def if_users_not_exists(cur, user_id):
+    """
+    See main.if_users_not_exists.
+    """
+    try:
+        await cur.execute(queries.USER_EXISTS, (user_id,))
+        if await cur.fetchone() is None:
+            return True
+    except Exception as ex:
+        _log_exception(ex)
+        return False
+
+
+@db_connection
+async def add_users(cur, user_id, name):
+    """
+    See main.add_users.
+    """
+    try:
+        await cur.execute(queries.ADD_USER, (user_id, name))
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def add_word_to_dictionary(cur, user_id, english_word, russian_word):
+    """
+    See main.add_word_to_dictionary.
+    """
+    try:
+        await cur.execute(queries.ADD_USER_WORDS, {'user_id': user_id, 'english_words': [clean_word(english_word)],
+                                                   'russian_words': [clean_word(russian_word)]})
+        added, word_count = await cur.fetchone()
+        if added == 0:
+            return 'Duplicate'
+        return word_count
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def add_words_to_dictionary(cur, user_id, pairs):
+    """
+    See main.add_words_to_dictionary.
+    """
+    try:
+        english_words = [clean_word(english) for english, russian in pairs]
+        russian_words = [clean_word(russian) for english, russian in pairs]
+        await cur.execute(queries.ADD_USER_WORDS, {'user_id': user_id, 'english_words': english_words,
+                                                   'russian_words': russian_words})
+        return (await cur.fetchone())[0]
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def delete_word_to_dictionary(cur, user_id, english_word):
+    """
+    See main.delete_word_to_dictionary.
+    """
+    try:
+        await cur.execute(queries.DELETE_USER_WORDS, {'user_id': user_id, 'words': [english_word]})
+        return (await cur.fetchone())[0] > 0
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def delete_words_from_dictionary(cur, user_id, words):
+    """
+    See main.delete_words_from_dictionary.
+    """
+    try:
+        await cur.execute(queries.DELETE_USER_WORDS, {'user_id': user_id, 'words': list(words)})
+        return (await cur.fetchone())[0]
+    except Exception as ex:
+        _log_exception(ex)
+
+
+@db_connection
+async def adding_a_word_by_the_user(cur, user_id):
+    """
+    See main.adding_a_word_by_the_user.
+    """
+    try:
+        await cur.execute(queries.COUNT_USER_WORDS, (user_id,))
+        row = await cur.fetchone()
+        return str(row[0] if row is not None else 0)
+    except Exception as ex:
+        _log_exception(ex)
+
+
+def _values(sql, template, rows):
+    """
+    Counterpart of execute_values for psycopg 3: expands VALUES %s of the statement into one template per row.
+
+    :return: (statement, flat list of the parameters)
+    """
+    sql = sql.replace('VALUES %s', 'VALUES ' + ', '.join([template] * len(rows)), 1)
+    return sql, [value for row in rows for value in row]
+
+
+@db_connection
+async def save_events(cur, answers, reviews, stats, word_events):
+    """
+    See main.save_events. The exceptions are not caught: events.EventBuffer handles them itself. The statements are
+    not prepared, their text depends on the size of the batch.
+    """
+    for sql, template, rows in ((queries.ADD_ANSWERS, queries.ADD_ANSWERS_TEMPLATE, answers),
+                                (queries.SAVE_REVIEWS, queries.SAVE_REVIEWS_TEMPLATE, reviews),
+                                (queries.ADD_ANSWER_STATS, queries.ADD_ANSWER_STATS_TEMPLATE, stats),
+                                (queries.ADD_WORD_EVENTS, queries.ADD_WORD_EVENTS_TEMPLATE, word_events)):
+        if rows:
+            await cur.execute(*_values(sql, template, rows), prepare=False)
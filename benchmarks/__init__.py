@@ -0,0 +1,5 @@
+"""
+Benchmarks for the bot and its database layer. Every module is run from the root of the project, for example:
+
+    python3 -m benchmarks.bench_sampling --help
+"""
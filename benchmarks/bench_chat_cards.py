@@ -0,0 +1,56 @@
+"""
+Memory and answer-check time of the per-chat card state (card_queue.ChatCard).
+
+The benchmark creates a card for each of --chats chats, gives every chat a few wrong answers and reports the memory
+per chat measured with tracemalloc and the time of one ChatCard.check(). No database is needed.
+
+    python3 -m benchmarks.bench_chat_cards --chats 100000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from card_queue import ChatCard
+
+
+def make_words(count):
+    return [f'word{i:07d}' for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=100_000)
+    parser.add_argument('--options', type=int, default=5, help='number of options on a card')
+    parser.add_argument('--checks', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # Слова создаются до начала замера: в боте они уже лежат в памяти в CardQueue
+    words = make_words(args.chats * 2)
+    prompts = make_words(args.chats)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cards = {}
+    for chat_id in range(args.chats):
+        options = random.sample(words, args.options)
+        cards[chat_id] = ChatCard(chat_id, options[0], prompts[chat_id], options)
+    for card in cards.values():
+        for word in card.options[1:3]:
+            card.check(word)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    per_chat = (after - before) / args.chats
+    print(f"{args.chats} chats: {(after - before) / 2 ** 20:.1f} MiB, {per_chat:.0f} bytes per chat")
+
+    chat_ids = [random.randrange(args.chats) for _ in range(args.checks)]
+    answers = [random.choice(cards[chat_id].options) for chat_id in chat_ids]
+    started = time.perf_counter()
+    for chat_id, text in zip(chat_ids, answers):
+        cards[chat_id].check(text)
+    elapsed = time.perf_counter() - started
+    print(f"check(): {elapsed / args.checks * 1e9:.0f} ns per answer")
+
+
+if __name__ == '__main__':
+    main()
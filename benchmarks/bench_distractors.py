@@ -0,0 +1,70 @@
+"""
+Time of choosing the wrong options of a card (distractors.Distractors) on a large dictionary.
+
+The benchmark builds the index over --words synthetic English words made of random syllables, then measures
+Distractors.choose() for random answers and an incremental update after --added new words. No database is needed.
+
+    python3 -m benchmarks.bench_distractors --words 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from distractors import Distractors
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tor', 'sha', 'bel', 'vin', 'dra', 'pu', 'ge', 'nox', 'ly', 'ful', 'tion',
+             'ing', 'er', 'ous', 'ate', 'st']
+
+
+def make_words(count, rng):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 5))) + str(rng.randrange(100)))
+    return list(words)
+
+
+class _Shared:
+    def __init__(self, english_words):
+        self.russian_words = []
+        self.english_words = english_words
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * share))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=1_000_000)
+    parser.add_argument('--added', type=int, default=10_000, help='words added before the incremental update')
+    parser.add_argument('--cards', type=int, default=20_000)
+    parser.add_argument('--options', type=int, default=4, help='wrong options per card')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    words = make_words(args.words + args.added, rng)
+    distractors = Distractors()
+
+    started = time.perf_counter()
+    distractors.refresh(_Shared(words[:args.words]))
+    print(f"index of {args.words} words built in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    distractors.refresh(_Shared(words))
+    print(f"incremental update with {args.added} new words: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    answers = [rng.choice(words) for _ in range(args.cards)]
+    timings = []
+    for answer in answers:
+        t0 = time.perf_counter()
+        distractors.choose(answer, args.options, to_russian=False)
+        timings.append(time.perf_counter() - t0)
+    print(f"choose(): p50 {percentile(timings, 0.5):.0f} us   p99 {percentile(timings, 0.99):.0f} us   "
+          f"mean {statistics.fmean(timings) * 1e6:.0f} us")
+    for answer in answers[:3]:
+        print(f"  {answer}: {', '.join(distractors.choose(answer, args.options, to_russian=False))}")
+
+
+if __name__ == '__main__':
+    main()
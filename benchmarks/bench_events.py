@@ -0,0 +1,79 @@
+"""
+Cost of recording an answer through the write-behind buffer (events.EventBuffer) with a slow database.
+
+Several threads play the handlers of the bot and put --events answers into the buffer as fast as they can. The
+writer stands for main.save_events: it sleeps --write-ms milliseconds per batch plus --row-us microseconds per row.
+The benchmark reports the time of EventBuffer.answer() in the handler thread, how many events one write carried and
+how many were dropped because the queue was full. No database is needed.
+
+    python3 -m benchmarks.bench_events --events 200000 --write-ms 5
+"""
+import argparse
+import random
+import threading
+import time
+
+from events import EventBuffer
+
+
+class SlowWriter:
+    def __init__(self, write_ms, row_us):
+        self.write_ms = write_ms
+        self.row_us = row_us
+
+    def __call__(self, answers, reviews, stats, word_events):
+        rows = len(answers) + len(reviews) + len(stats) + len(word_events)
+        time.sleep(self.write_ms / 1000 + rows * self.row_us / 1e6)
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * share))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200_000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--write-ms', type=float, default=5.0, help='time of one write round trip')
+    parser.add_argument('--row-us', type=float, default=2.0, help='time of writing one row')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-events', type=int, default=10_000)
+    args = parser.parse_args()
+
+    events = EventBuffer(SlowWriter(args.write_ms, args.row_us), max_events=args.max_events,
+                         batch_size=args.batch_size)
+    timings = [[] for _ in range(args.threads)]
+
+    def handler(number):
+        rng = random.Random(number)
+        for _ in range(args.events // args.threads):
+            user_id = rng.randrange(args.users)
+            started = time.perf_counter()
+            events.answer(user_id, rng.randrange(10 ** 6), rng.random() < 0.85)
+            timings[number].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=handler, args=(number,)) for number in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    produced = time.perf_counter() - started
+    events.close()
+    elapsed = time.perf_counter() - started
+
+    stats = events.stats()
+    all_timings = [timing for thread_timings in timings for timing in thread_timings]
+    print(f"{len(all_timings)} answers from {args.threads} threads in {produced:.2f}s, written in {elapsed:.2f}s")
+    print(f"answer() p50 {percentile(all_timings, 0.5):.1f} us   p99 {percentile(all_timings, 0.99):.1f} us   "
+          f"max {max(all_timings) * 1e6:.0f} us")
+    print(f"written {stats['written']}, dropped {stats['dropped']}, batches {stats['batches']} "
+          f"({stats['written'] / max(stats['batches'], 1):.0f} events per batch)")
+    print(f"flush mean {stats['flush_seconds'] / max(stats['batches'], 1) * 1000:.1f} ms, "
+          f"max {stats['max_flush_seconds'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Cost of logging for the thread of a handler: print() and a synchronous logging handler against the queue of logs.py.
+
+Every variant logs the same record of an answer to a card (the chat, the handler, the time, the outcome) --calls
+times from --threads threads, to a stream that spends --write-us microseconds on every write, like a slow terminal or
+a pipe to a log collector. The benchmark reports the time per call in the threads of the handlers:
+- print: the dictionary of the card printed by the handler, as message_processing used to do;
+- sync handler: logging.StreamHandler formatting and writing in the thread of the handler;
+- queue, 100%: setup_logging() with every record written by the background thread;
+- queue, sampled: the handler event sampled to --sample of the records;
+- disabled: the level of the logger is above the level of the record, nothing is created.
+The queue variants also report how many records were dropped because the queue was full. No database is needed.
+
+    python3 -m benchmarks.bench_logging --calls 100000 --threads 4 --write-us 20
+"""
+import argparse
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+from logs import StructuredFormatter, handler_event, set_sampling, setup_logging
+
+MESSAGE = SimpleNamespace(chat=SimpleNamespace(id=123456789))
+CARD = {'target_word': 'cat', 'translate_word': 'кошка', 'other_words': ['dog', 'cow', 'fox', 'owl']}
+
+
+class SlowStream:
+    """
+    Stream that spends the given time on every write and discards the text.
+    """
+
+    def __init__(self, write_seconds):
+        self.write_seconds = write_seconds
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            deadline = time.perf_counter() + self.write_seconds
+            while time.perf_counter() < deadline:
+                pass
+
+    def flush(self):
+        pass
+
+
+def per_call(func, calls, threads):
+    """
+    Runs func(calls // threads) in every thread at once and returns the time per call of one thread in microseconds.
+    """
+    started = time.perf_counter()
+    workers = [threading.Thread(target=func, args=(calls // threads,)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (calls // threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100_000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--write-us', type=float, default=20, help='time of one write to the stream, microseconds')
+    parser.add_argument('--sample', type=float, default=0.01, help='share of the handler events that are written')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench_logging')
+    stream = SlowStream(args.write_us / 1e6)
+
+    def printed(calls):
+        for _ in range(calls):
+            print(CARD, CARD.keys(), file=stream)
+
+    def logged(calls):
+        for _ in range(calls):
+            handler_event(logger, 'answer_card', MESSAGE, 0.0012, 'ok')
+
+    def disabled(calls):
+        for _ in range(calls):
+            logger.debug("Card %s", CARD)
+
+    print(f"{'variant':<16} {'us per call':>11} {'dropped':>8}")
+    print(f"{'print':<16} {per_call(printed, args.calls, args.threads):>11.2f} {'':>8}")
+
+    synchronous = logging.StreamHandler(stream)
+    synchronous.setFormatter(StructuredFormatter())
+    root = logging.getLogger()
+    root.addHandler(synchronous)
+    root.setLevel(logging.INFO)
+    set_sampling({})
+    print(f"{'sync handler':<16} {per_call(logged, args.calls, args.threads):>11.2f} {'':>8}")
+    root.removeHandler(synchronous)
+
+    for name, sampling in (('queue, 100%', {}), (f'queue, {args.sample:.0%}', {'handler': args.sample})):
+        log_queue = setup_logging(levels={'': 'INFO'}, sampling=sampling, stream=stream)
+        try:
+            timing = per_call(logged, args.calls, args.threads)
+        finally:
+            log_queue.stop()
+        print(f"{name:<16} {timing:>11.2f} {log_queue.stats()['dropped']:>8}")
+
+    print(f"{'disabled':<16} {per_call(disabled, args.calls, args.threads):>11.2f} {'':>8}")
+
+
+if __name__ == '__main__':
+    main()
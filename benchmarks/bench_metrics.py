@@ -0,0 +1,89 @@
+"""
+Overhead of the instrumentation of metrics.py on the hot path.
+
+The benchmark measures a call of Histogram.observe(), the extra time a handler wrapped in metrics.timed() takes
+compared with the bare function, and the extra time of the instrumentation of db_connection (three clock reads and two
+histograms per call), from one and from several threads at once, and the time of rendering /metrics with many series.
+No database is needed.
+
+    python3 -m benchmarks.bench_metrics --calls 1000000 --threads 4
+"""
+import argparse
+import threading
+import time
+
+from metrics import Registry, Histogram, timed
+
+
+def handler(value):
+    return value
+
+
+def per_call(func, calls, threads):
+    """
+    Runs func(calls // threads) in every thread at once and returns the wall time per call of all threads together
+    in nanoseconds.
+    """
+    started = time.perf_counter()
+    workers = [threading.Thread(target=func, args=(calls // threads,)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--series', type=int, default=200, help='histograms rendered by /metrics')
+    args = parser.parse_args()
+
+    histogram = Histogram()
+    timed_handler = timed(handler)
+    acquire, query = Histogram(), Histogram()
+
+    def observe(calls):
+        for i in range(calls):
+            histogram.observe(0.0003)
+
+    def bare(calls):
+        for i in range(calls):
+            handler(i)
+
+    def wrapped(calls):
+        for i in range(calls):
+            timed_handler(i)
+
+    def database(calls):
+        # То же, что добавляет main.db_connection к каждому вызову
+        perf_counter = time.perf_counter
+        for i in range(calls):
+            started = perf_counter()
+            acquired = perf_counter()
+            acquire.observe(acquired - started)
+            try:
+                handler(i)
+            finally:
+                query.observe(perf_counter() - acquired)
+
+    for threads in sorted({1, args.threads}):
+        base = per_call(bare, args.calls, threads)
+        print(f"{threads} thread(s): observe() {per_call(observe, args.calls, threads):.0f} ns, "
+              f"timed handler +{per_call(wrapped, args.calls, threads) - base:.0f} ns, "
+              f"db_connection instrumentation +{per_call(database, args.calls, threads) - base:.0f} ns per call")
+
+    registry = Registry()
+    for i in range(args.series):
+        series = registry.histogram('bot_db_query_seconds', function=f'function_{i}')
+        for value in (0.0001, 0.002, 0.03):
+            series.observe(value)
+    started = time.perf_counter()
+    text = registry.render()
+    print(f"render of {args.series} histograms: {(time.perf_counter() - started) * 1000:.1f} ms, "
+          f"{len(text) // 1024} KiB")
+
+
+if __name__ == '__main__':
+    main()
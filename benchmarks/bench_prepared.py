@@ -0,0 +1,104 @@
+"""
+Time saved by running the queries of main.py as prepared statements (prepared.py) instead of sending their text.
+
+The benchmark creates a separate schema in the database from config.py with a synthetic dictionary of every size in
+--sizes and, for the join-heavy sampling queries and the queries of one user, measures:
+- the server-side planning time of the plain statement and of EXECUTE of the prepared one, from
+  EXPLAIN (ANALYZE, FORMAT JSON), after --repeat executions, so that the server has had the chance to switch the
+  prepared statement to a generic plan;
+- the round trip of the client, p50 and p99, for cur.execute() with the text and for EXECUTE.
+--plan-cache-mode sets plan_cache_mode of the session (auto, force_custom_plan, force_generic_plan).
+
+    python3 -m benchmarks.bench_prepared --sizes 10k 1m 10m --repeat 300
+"""
+import argparse
+import json
+import statistics
+import time
+
+import queries
+from benchmarks.fixtures import SIZES, drop_schema, generate, parse_size
+from prepared import Statement
+
+SCHEMA = 'bench_prepared'
+
+# Число пользователей, у которых есть собственные слова
+USERS = 100
+
+BENCHMARKS = {
+    'RANDOM_WORDS': lambda user_id: {'user_id': user_id},
+    'RANDOM_ENGLISH_WORDS': lambda user_id: {'user_id': user_id, 'word_to_avoid': 'en1', 'limit': 4,
+                                             'probes': 4 * queries.PROBES_PER_WORD},
+    'BUILD_CARD_TO_RUSSIAN': lambda user_id: {'user_id': user_id, 'limit': 4, 'probes': 4 * queries.PROBES_PER_WORD},
+    'RANDOM_PAIRS': lambda user_id: {'user_id': user_id, 'count': 50, 'probes': 100},
+    'USER_PAIRS': lambda user_id: {'user_id': user_id},
+    'LOAD_REVIEWS': lambda user_id: {'user_id': user_id, 'limit': 50},
+    'COUNT_USER_WORDS': lambda user_id: (user_id,),
+}
+
+
+def planning_time(cur, sql, params):
+    """
+    :return: (planning time, execution time) of the statement in milliseconds, as reported by EXPLAIN ANALYZE
+    """
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time'], plan[0]['Execution Time']
+
+
+def round_trips(cur, sql, make_params, repeat):
+    timings = []
+    for i in range(repeat):
+        params = make_params(i % USERS + 1)
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[SIZES['10k'], SIZES['1m']],
+                        help=f"{', '.join(SIZES)} or numbers of pairs")
+    parser.add_argument('--repeat', type=int, default=300)
+    parser.add_argument('--plan-cache-mode', default='auto',
+                        choices=['auto', 'force_custom_plan', 'force_generic_plan'])
+    parser.add_argument('--keep', action='store_true', help='do not drop the schema at the end')
+    args = parser.parse_args()
+
+    print(f"{'pairs':>10}  {'statement':<22} {'plan text':>10} {'plan prep':>10} {'exec':>8} "
+          f"{'text p50/p99':>15} {'prepared p50/p99':>17}   (ms)")
+    conn = None
+    try:
+        for size in sorted(args.sizes):
+            if conn is not None:
+                drop_schema(conn, SCHEMA)
+                conn.close()
+            conn = generate(SCHEMA, size, USERS)
+            cur = conn.cursor()
+            cur.execute("SET plan_cache_mode = %s", (args.plan_cache_mode,))
+            for name, make_params in BENCHMARKS.items():
+                sql = getattr(queries, name)
+                statement = Statement(name, sql)
+                cur.execute(f"DEALLOCATE ALL; {statement.prepare_sql}")
+                text = round_trips(cur, sql, make_params, args.repeat)
+                executed = round_trips(cur, statement.execute_sql,
+                                       lambda user_id: statement.values(make_params(user_id)), args.repeat)
+                params = make_params(1)
+                text_plan, execution = planning_time(cur, sql, params)
+                prepared_plan, _ = planning_time(cur, statement.execute_sql, statement.values(params))
+                print(f"{size:>10}  {name:<22} {text_plan:>10.3f} {prepared_plan:>10.3f} {execution:>8.3f} "
+                      f"{text[0]:>7.3f}/{text[1]:<7.3f} {executed[0]:>8.3f}/{executed[1]:<8.3f}")
+    finally:
+        if conn is not None:
+            if not args.keep:
+                drop_schema(conn, SCHEMA)
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Cost of dispatching a text message to its handler: a chain of telebot filters against router.Router.
+
+For every number of commands in --commands, two TeleBot instances get the same handlers: in the first every command is
+a handler with func=lambda message: message.text == ..., followed by a catch-all handler, as main2.py used to
+register them; in the second there is one message handler that calls Router.dispatch. The benchmark passes messages
+to bot.process_new_messages() and reports the time per message for a command and for an answer to a card, which
+goes through all filters of the chain. No network and no database are needed.
+
+    python3 -m benchmarks.bench_router --commands 4 16 64 256
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import telebot
+from telebot import types
+
+from bot_common import Status
+from router import Router
+
+# Состояние пользователя, отвечающего на карточки (state_store.UserState)
+STATE = SimpleNamespace(status=Status.CARDS, card=None)
+
+
+def message(text, message_id=1):
+    return types.Message.de_json({
+        'message_id': message_id,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'User'},
+        'text': text,
+    })
+
+
+def handler(message, state=None):
+    pass
+
+
+def filter_chain(commands):
+    bot = telebot.TeleBot('123:fake', threaded=False)
+    for text in commands:
+        bot.register_message_handler(handler, func=lambda message, text=text: message.text == text)
+    bot.register_message_handler(handler, func=lambda message: True, content_types=['text'])
+    return bot
+
+
+def routed(commands):
+    bot = telebot.TeleBot('123:fake', threaded=False)
+    router = Router(lambda message: STATE)
+    router.command(*commands)(handler)
+    router.step(Status.CARDS)(handler)
+    bot.register_message_handler(router.dispatch, content_types=['text'])
+    return bot, router
+
+
+def measure(bot, messages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        bot.process_new_messages(messages)
+    return (time.perf_counter() - started) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--commands', type=int, nargs='+', default=[4, 16, 64, 256])
+    parser.add_argument('--messages', type=int, default=20_000)
+    args = parser.parse_args()
+
+    batch = 100
+    repeat = max(1, args.messages // batch)
+    print(f"{'commands':>8} {'chain: command':>15} {'chain: answer':>14} {'router: command':>16} "
+          f"{'router: answer':>15}   (us per message)")
+    for count in args.commands:
+        commands = [f'Команда {i}' for i in range(count)]
+        # Команда из середины списка и ответ на карточку, который не совпадает ни с одной командой
+        command_messages = [message(commands[count // 2], i) for i in range(batch)]
+        answer_messages = [message('кот', i) for i in range(batch)]
+        chain = filter_chain(commands)
+        bot, router = routed(commands)
+        print(f"{count:>8} {measure(chain, command_messages, repeat):>15.1f} "
+              f"{measure(chain, answer_messages, repeat):>14.1f} {measure(bot, command_messages, repeat):>16.1f} "
+              f"{measure(bot, answer_messages, repeat):>15.1f}")
+    for name, route in router.stats().items():
+        print(f"route {name}: {route['count']} messages, mean {route['mean_seconds'] * 1e6:.1f} us, "
+              f"max {route['max_seconds'] * 1e6:.0f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Latency of random card sampling depending on the size of the dictionary.
+
+The benchmark creates a separate schema in the database from config.py, fills it with synthetic word pairs step by step
+(10k, 100k, 1M, 10M by default) and measures random_words_from_db, random_english_words, random_russian_words and
+build_card at every size. With --legacy the old ORDER BY random() query is measured as well for comparison.
+
+    python3 -m benchmarks.bench_sampling --sizes 10000 100000 1000000 10000000 --repeat 200 --legacy
+"""
+import argparse
+import os
+import statistics
+import time
+
+SCHEMA = 'bench_sampling'
+
+# Пул соединений создаётся при первом запросе, поэтому search_path нужно задать до импорта функций из main.py
+os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+from benchmarks.fixtures import add_pairs, add_users, create_schema, drop_schema  # noqa: E402
+from main import db_connection, build_card, random_words_from_db  # noqa: E402
+from main import random_english_words, random_russian_words  # noqa: E402
+from main import random_pairs_from_db  # noqa: E402
+
+LEGACY_QUERY = """
+    SELECT rus_w.word AS rw, en_w.word AS ew
+    FROM russian_words rus_w
+    JOIN all_words all_w ON all_w.russian_words_id = rus_w.id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    FULL OUTER JOIN user_words u_w ON u_w.all_words_id = all_w.id
+    WHERE u_w.user_id = %s OR u_w.user_id is NULL
+    ORDER BY random()
+    LIMIT 1;
+"""
+
+# Число пользователей, у которых есть собственные слова
+USERS = 100
+
+
+def measure(func, repeat):
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        func(i % USERS + 1)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+@db_connection
+def legacy_query(cur, user_id):
+    cur.execute(LEGACY_QUERY, (user_id,))
+    return cur.fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--legacy', action='store_true', help='also measure the old ORDER BY random() query')
+    parser.add_argument('--keep', action='store_true', help='do not drop the schema at the end')
+    args = parser.parse_args()
+
+    conn = create_schema(SCHEMA)
+    cur = conn.cursor()
+    add_users(cur, USERS)
+
+    benchmarks = {
+        'random_words_from_db': random_words_from_db,
+        'random_english_words': lambda user_id: random_english_words('en1', user_id),
+        'random_russian_words': lambda user_id: random_russian_words('ru1', user_id),
+        'build_card': build_card,
+        'random_pairs_from_db x50': lambda user_id: random_pairs_from_db(user_id, 50),
+    }
+    if args.legacy:
+        benchmarks['legacy ORDER BY random()'] = legacy_query
+
+    print(f"{'pairs':>10}  {'function':<26} {'p50, ms':>9} {'p99, ms':>9}")
+    size = 0
+    try:
+        for target in sorted(args.sizes):
+            add_pairs(cur, size, target, users=USERS)
+            size = target
+            for name, func in benchmarks.items():
+                # Легаси-запрос на больших словарях идёт секундами, для него хватит нескольких повторов
+                repeat = args.repeat if not name.startswith('legacy') else max(args.repeat // 20, 3)
+                func(1)
+                p50, p99 = measure(func, repeat)
+                print(f"{size:>10}  {name:<26} {p50:>9.3f} {p99:>9.3f}")
+    finally:
+        if not args.keep:
+            drop_schema(conn, SCHEMA)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
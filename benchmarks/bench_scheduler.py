@@ -0,0 +1,111 @@
+"""
+Simulator of the spaced-repetition scheduler (scheduler.py) over many synthetic users.
+
+Every user starts with --reviews words already answered, due at random times around the start. The simulation then
+runs --steps answers of random users on a virtual clock: the user asks for the next card, gets the most overdue word
+(or a new word if nothing is due) and answers it, right with probability --accuracy. The benchmark reports the
+latency of Scheduler.next_due and Scheduler.answer and the write amplification of the event buffer: how many rows and
+index entries are written to the database per answer and how many answers one round trip carries. No database is
+needed, the batches are only counted.
+
+    python3 -m benchmarks.bench_scheduler --users 100000 --steps 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from events import EventBuffer
+from scheduler import DAY, Scheduler
+
+# Индексы word_reviews: первичный ключ, (user_id, due_at) и all_words_id. due_at меняется при каждом ответе, поэтому
+# HOT-обновление невозможно и новая версия строки попадает во все индексы. У answer_log только BRIN-индекс, который
+# обновляется при суммаризации страниц, а не при каждой вставке
+WORD_REVIEWS_INDEXES = 3
+
+
+class CountingWriter:
+    def __init__(self):
+        self.calls = 0
+        self.answer_rows = 0
+        self.review_rows = 0
+        self.stats_rows = 0
+
+    def __call__(self, answers, reviews, stats, word_events):
+        self.calls += 1
+        self.answer_rows += len(answers)
+        self.review_rows += len(reviews)
+        self.stats_rows += len(stats)
+
+
+def synthetic_reviews(reviews, start):
+    def load_reviews(user_id, limit):
+        rng = random.Random(user_id)
+        rows = [(user_id * 1000 + i, f'ru{i}', f'en{i}', start + rng.uniform(-7, 7) * DAY, DAY, 2.5, 1)
+                for i in range(reviews)]
+        rows.sort(key=lambda row: row[3])
+        return rows[:limit]
+    return load_reviews
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * share))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--reviews', type=int, default=20, help='answered words per user at the start')
+    parser.add_argument('--steps', type=int, default=1_000_000)
+    parser.add_argument('--accuracy', type=float, default=0.85)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    now = time.time()
+    writer = CountingWriter()
+    # Очередь вмещает все ответы: замеряется планировщик, а не отбрасывание событий
+    events = EventBuffer(writer, max_events=args.steps + 1, batch_size=args.batch_size, flush_interval=3600)
+    scheduler = Scheduler(synthetic_reviews(args.reviews, now), events, max_users=args.users)
+    rng = random.Random(1)
+    new_words = args.users * 1000 + 10 ** 9
+    next_due_timings, answer_timings = [], []
+
+    started = time.perf_counter()
+    for step in range(args.steps):
+        user_id = rng.randrange(args.users)
+        now += 0.05  # 20 ответов в секунду на всех пользователей в виртуальном времени
+
+        t0 = time.perf_counter()
+        review = scheduler.next_due(user_id, now)
+        t1 = time.perf_counter()
+        if review is None:
+            new_words += 1
+            word_id, russian, english = new_words, 'ru', 'en'
+        else:
+            word_id, russian, english = review.word_id, review.russian, review.english
+        scheduler.answer(user_id, word_id, russian, english, rng.random() < args.accuracy, now)
+        t2 = time.perf_counter()
+        next_due_timings.append(t1 - t0)
+        answer_timings.append(t2 - t1)
+    events.close()
+    elapsed = time.perf_counter() - started
+
+    stats = scheduler.stats()
+    answers = writer.answer_rows
+    print(f"{args.users} users, {args.steps} answers in {elapsed:.1f}s ({args.steps / elapsed:.0f}/s)")
+    print(f"reviews in memory: {stats['reviews']}, due cards: {stats['due']}, new cards: {stats['not_due']}")
+    for name, timings in (('next_due', next_due_timings), ('answer', answer_timings)):
+        print(f"{name:<9} p50 {percentile(timings, 0.5):6.1f} us   p99 {percentile(timings, 0.99):6.1f} us   "
+              f"mean {statistics.fmean(timings) * 1e6:6.1f} us")
+    row_writes = writer.answer_rows + writer.review_rows + writer.stats_rows
+    index_writes = writer.review_rows * WORD_REVIEWS_INDEXES
+    print(f"round trips: {writer.calls} ({answers / max(writer.calls, 1):.0f} answers per round trip)")
+    print(f"rows written per answer: {row_writes / answers:.2f} (answer_log {writer.answer_rows / answers:.2f}, "
+          f"word_reviews {writer.review_rows / answers:.2f}, user_stats {writer.stats_rows / answers:.2f})")
+    print(f"index entries per answer: {index_writes / answers:.2f}, "
+          f"write amplification: {(row_writes + index_writes) / answers:.2f} writes per answer")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Delivery of the bot's messages under the flood limits of Telegram, with and without the outbound scheduler
+(sender.Sender).
+
+The fake Bot API (benchmarks/fake_telegram.py) rejects messages above --global-rate per second in total and
+--chat-rate per second per chat with 429. --chats users answer a card every --think seconds; every answer is followed
+by the feedback and the next card, as in main2.py. After the first second a notification is broadcast to every chat.
+The "direct" mode calls bot.send_message() from a thread pool, as the handlers used to; the "sender" mode queues the
+same messages to Sender. For each mode the benchmark reports how many messages were delivered and rejected and the
+delay from queuing a card or a notification to its delivery. No database is needed.
+
+    python3 -m benchmarks.bench_sender --chats 200 --duration 20
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from telebot.apihelper import ApiTelegramException
+
+from benchmarks.fake_telegram import FakeTelegram
+from sender import Sender, CARD, REPLY, BULK
+
+KINDS = {'card': CARD, 'feedback': REPLY, 'notice': BULK}
+
+
+class Delivery:
+    """
+    Remembers when every numbered message was queued and when the fake API received it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.numbers = iter(range(10 ** 9))
+        self.queued = {}  # номер -> (вид, время постановки в очередь)
+        self.delays = {kind: [] for kind in KINDS}
+
+    def text(self, kind):
+        with self.lock:
+            number = next(self.numbers)
+            self.queued[number] = (kind, time.perf_counter())
+        return f'{kind} #{number}'
+
+    def on_message(self, chat_id, text, reply_markup):
+        now = time.perf_counter()
+        with self.lock:
+            # В объединённом сообщении несколько номеров
+            for number in re.findall(r'#(\d+)', text):
+                kind, queued_at = self.queued.pop(int(number))
+                self.delays[kind].append(now - queued_at)
+
+
+def plan(chats, duration, think, rng):
+    """
+    Returns the list of (time, chat_id, kind) of the messages of the session, sorted by time.
+    """
+    events = []
+    for chat_id in range(1, chats + 1):
+        at = rng.uniform(0, think)
+        while at < duration:
+            events.append((at, chat_id, 'feedback'))
+            events.append((at, chat_id, 'card'))
+            at += rng.expovariate(1 / think)
+        events.append((1.0, chat_id, 'notice'))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def replay(events, send):
+    started = time.perf_counter()
+    for at, chat_id, kind in events:
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        send(chat_id, kind)
+
+
+def run_direct(bot, events, delivery, threads):
+    def send_message(chat_id, text):
+        try:
+            bot.send_message(chat_id, text)
+        except ApiTelegramException:
+            pass  # Сообщение, отклонённое с 429, потеряно: обработчики не отправляли его повторно
+
+    with ThreadPoolExecutor(threads) as pool:
+        replay(events, lambda chat_id, kind: pool.submit(send_message, chat_id, delivery.text(kind)))
+
+
+def run_sender(bot, events, delivery, args):
+    sender = Sender(bot, global_rate=args.global_rate * args.margin, chat_rate=args.chat_rate, workers=args.threads)
+    replay(events, lambda chat_id, kind: sender.send(chat_id, delivery.text(kind), priority=KINDS[kind]))
+    sender.flush(timeout=60)
+    sender.close()
+    return sender.stats()
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * share))] * 1000 if timings else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['direct', 'sender', 'both'], default='both')
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20, help='seconds of answers')
+    parser.add_argument('--think', type=float, default=12, help='mean seconds between the answers of a user')
+    parser.add_argument('--global-rate', type=float, default=30, help='limit of the fake API, messages per second')
+    parser.add_argument('--chat-rate', type=float, default=1, help='limit of the fake API per chat')
+    parser.add_argument('--margin', type=float, default=0.85, help='share of the global limit the sender uses')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    events = plan(args.chats, args.duration, args.think, random.Random(1))
+    bot = telebot.TeleBot('123:fake', threaded=False)
+    modes = ['direct', 'sender'] if args.mode == 'both' else [args.mode]
+    print(f"{len(events)} messages to {args.chats} chats in {args.duration:.0f}s")
+    print(f"{'mode':<6} {'delivered':>9} {'429':>6} {'lost':>6} {'card p50/p99, ms':>18} {'notice p99, ms':>15}")
+    for mode in modes:
+        delivery = Delivery()
+        server = FakeTelegram(on_message=delivery.on_message, global_rate=args.global_rate,
+                              chat_rate=args.chat_rate).start()
+        telebot.apihelper.API_URL = server.api_url
+        try:
+            stats = None
+            if mode == 'direct':
+                run_direct(bot, events, delivery, args.threads)
+            else:
+                stats = run_sender(bot, events, delivery, args)
+        finally:
+            server.stop()
+        delivered = sum(len(delays) for delays in delivery.delays.values())
+        cards = delivery.delays['card']
+        print(f"{mode:<6} {delivered:>9} {server.rejected:>6} {len(delivery.queued):>6} "
+              f"{percentile(cards, 0.5):>8.0f}/{percentile(cards, 0.99):<9.0f} "
+              f"{percentile(delivery.delays['notice'], 0.99):>15.0f}")
+        if stats is not None:
+            print(f"{'':<6} merged {stats['merged']}, sent again after 429 {stats['retries']}, "
+                  f"failed {stats['failed']}")
+
+
+if __name__ == '__main__':
+    main()
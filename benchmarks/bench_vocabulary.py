@@ -0,0 +1,65 @@
+"""
+Memory and card-sampling time of the in-memory common dictionary (vocabulary.Vocabulary).
+
+The benchmark loads --pairs synthetic pairs, as main.load_shared_vocabulary would pass them from the database, and
+reports the memory of the table measured with tracemalloc, the load time and the time of one
+Vocabulary.random_pairs() call for a batch of CardQueue. No database is needed.
+
+    python3 -m benchmarks.bench_vocabulary --pairs 1000000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from vocabulary import Vocabulary
+
+
+def synthetic_dictionary(pairs, synonyms):
+    """
+    Returns the loader of a dictionary of pairs pairs. Every Russian word has synonyms English translations on
+    average, as in a real dictionary, where the same word is in several pairs.
+    """
+    def load_shared(add):
+        for word_id in range(1, pairs + 1):
+            add(word_id, f'слово{word_id // synonyms:07d}', f'word{word_id:07d}')
+        return 1
+    return load_shared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=1_000_000)
+    parser.add_argument('--synonyms', type=int, default=2, help='pairs per Russian word')
+    parser.add_argument('--batch', type=int, default=50, help='pairs per random_pairs() call')
+    parser.add_argument('--calls', type=int, default=100_000)
+    args = parser.parse_args()
+
+    own_words = [(10 ** 9 + i, f'моё{i}', f'mine{i}') for i in range(20)]
+    vocabulary = Vocabulary(synthetic_dictionary(args.pairs, args.synonyms), lambda: 1,
+                            lambda user_id: own_words)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    vocabulary.reload()
+    elapsed = time.perf_counter() - started
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.pairs} pairs loaded in {elapsed:.1f}s: {(after - before) / 2 ** 20:.1f} MiB "
+          f"({(after - before) / args.pairs:.0f} bytes per pair), "
+          f"peak while loading {(peak - before) / 2 ** 20:.1f} MiB")
+
+    users = [random.randrange(1000) for _ in range(args.calls)]
+    started = time.perf_counter()
+    for user_id in users:
+        vocabulary.random_pairs(user_id, args.batch)
+    elapsed = time.perf_counter() - started
+    stats = vocabulary.stats()
+    print(f"random_pairs({args.batch}): {elapsed / args.calls * 1e6:.1f} us per call, "
+          f"{elapsed / args.calls / args.batch * 1e9:.0f} ns per pair, "
+          f"{stats['user_loads']} loads of user words for {args.calls} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Regression check for the query plans of main.py.
+
+The check fills a separate schema with a large dictionary, calls every function of main.py decorated with
+db_connection and asks PostgreSQL for the plan (EXPLAIN) of every statement the function executes. If any plan reads
+one of the tables of the bot with a sequential scan, the check prints the statement and exits with code 1.
+All changes made by the functions are rolled back.
+
+    python3 -m benchmarks.explain_check --pairs 200000
+"""
+import argparse
+import sys
+
+import main
+from benchmarks.fixtures import add_pairs, add_users, connect, create_schema, drop_schema
+
+SCHEMA = 'explain_check'
+TABLES = {'english_words', 'russian_words', 'all_words', 'users', 'user_words', 'user_stats', 'word_reviews'}
+USERS = 10000
+
+# Функция из main.py -> аргументы, с которыми она вызывается (без курсора).
+# Пользователь 2 владеет парой слов 100 и повторяет её (см. benchmarks/fixtures.py)
+CALLS = {
+    'random_words_from_db': (2,),
+    'random_english_words': ('en10', 2),
+    'random_russian_words': ('ru10', 2),
+    'build_card': (2,),
+    'random_pairs_from_db': (2, 50),
+    'user_pairs_from_db': (2,),
+    'if_users_not_exists': (2,),
+    'add_users': (10 ** 12, 'new user'),
+    'add_word_to_dictionary': (2, 'explain-en', 'explain-ru'),
+    'add_words_to_dictionary': (2, [('explain-en', 'explain-ru'), ('en100', 'ru100'), ('en101', 'ru-new')]),
+    'delete_word_to_dictionary': (2, 'en100'),
+    'delete_words_from_dictionary': (2, ['en100', 'ru10100', 'missing']),
+    'adding_a_word_by_the_user': (2,),
+    'load_reviews': (2, 50),
+}
+
+
+class _NoCommitConnection:
+    """
+    Connection wrapper that ignores commit(), so that the changes made by the checked functions can be rolled back.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# Служебные команды prepared.py, у которых нет плана: они выполняются без EXPLAIN
+PASS_THROUGH = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'PREPARE')
+
+
+class ExplainingCursor:
+    """
+    Cursor wrapper that runs EXPLAIN for every statement before executing it and collects the plans. The statements
+    prepared by prepared.py are explained as EXPLAIN EXECUTE, so the plan is the one the server uses for them.
+
+    :param cur: psycopg2 cursor
+    :param connection: _NoCommitConnection of the cursor; the same object for all calls, because prepared.py
+    remembers the prepared statements by the connection
+    """
+
+    def __init__(self, cur, connection):
+        self._cur = cur
+        self.connection = connection
+        self.plans = []
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().upper().startswith(PASS_THROUGH):
+            return self._cur.execute(sql, params)
+        self._cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        self.plans.append((sql, self._cur.fetchone()[0][0]['Plan']))
+        return self._cur.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+def seq_scans(plan):
+    """
+    Returns the names of the tables of the bot read with a sequential scan anywhere in the plan.
+    """
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in TABLES:
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def check(conn):
+    failures = []
+    connection = _NoCommitConnection(conn)
+    for name, args in CALLS.items():
+        func = getattr(main, name).__wrapped__
+        with conn.cursor() as raw:
+            cur = ExplainingCursor(raw, connection)
+            func(cur, *args)
+            conn.rollback()
+        if not cur.plans:
+            failures.append((name, '<no statements executed, the function failed>', []))
+        for sql, plan in cur.plans:
+            tables = seq_scans(plan)
+            if tables:
+                failures.append((name, sql, tables))
+        print(f"{name:<36} {len(cur.plans)} statement(s)")
+    return failures
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=200_000)
+    parser.add_argument('--keep', action='store_true', help='do not drop the schema at the end')
+    args = parser.parse_args()
+
+    admin = create_schema(SCHEMA)
+    with admin.cursor() as cur:
+        add_users(cur, USERS)
+        add_pairs(cur, 0, args.pairs, users=USERS)
+    conn = connect(SCHEMA)
+    conn.autocommit = False
+    try:
+        failures = check(conn)
+    finally:
+        conn.close()
+        if not args.keep:
+            drop_schema(admin, SCHEMA)
+        admin.close()
+
+    for name, sql, tables in failures:
+        print(f"\nSEQ SCAN in {name} on {', '.join(tables)}:\n{sql}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,204 @@
+"""
+Local fake of the Telegram Bot API for load tests.
+
+The server answers getUpdates with the updates queued by put_message() and records every sendMessage of the bot.
+With global_rate and chat_rate it also enforces flood limits like Telegram does: a message above the limits is not
+delivered and the bot gets 429 Too Many Requests with retry_after.
+The bot is pointed at it by replacing the API URL of telebot:
+
+    server = FakeTelegram()
+    server.start()
+    telebot.apihelper.API_URL = server.api_url
+    telebot.asyncio_helper.API_URL = server.api_url
+"""
+import itertools
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake bot', 'username': 'fake_bot'}
+
+
+class FakeTelegram:
+    """
+    Fake Bot API server.
+
+    :param host: Address to listen on
+    :param port: Port to listen on, 0 - any free port
+    :param on_message: Function (chat_id, text, reply_markup) called for every message sent by the bot
+    :param global_rate: Messages per second the bot may send to all chats together, None - no limit
+    :param global_burst: Messages the bot may send at once to all chats together
+    :param chat_rate: Messages per second the bot may send to one chat, None - no limit
+    :param chat_burst: Messages the bot may send at once to one chat
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, on_message=None, global_rate=None, global_burst=30, chat_rate=None,
+                 chat_burst=3):
+        self.on_message = on_message
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._allowance = {}  # None (все чаты) или chat_id -> [доступные сообщения, время пересчёта]
+        self._updates = []
+        self._condition = threading.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.sent = 0
+        self.rejected = 0
+        self.calls = {}
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode('utf-8')
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body))
+                status, result = fake.call(method, params)
+                payload = json.dumps(result).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/bot{{0}}/{{1}}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def put_update(self, update):
+        """
+        Queues an update for the next getUpdates and returns its update_id.
+        """
+        with self._condition:
+            update['update_id'] = next(self._update_ids)
+            self._updates.append(update)
+            self._condition.notify_all()
+        return update['update_id']
+
+    def put_message(self, chat_id, text, first_name='User'):
+        """
+        Queues a text message from the user chat_id. Commands (text starting with "/") get a bot_command entity.
+        """
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.put_update({'message': message})
+
+    def call(self, method, params):
+        """
+        Handles one Bot API method call and returns (HTTP status, response body).
+        """
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+        if method in ('sendMessage', 'editMessageText'):
+            retry_after = self._flood_wait(int(params['chat_id']))
+            if retry_after:
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f'Too Many Requests: retry after {retry_after}',
+                             'parameters': {'retry_after': retry_after}}
+            return 200, {'ok': True, 'result': self._send_message(params)}
+        return 200, {'ok': True, 'result': True}
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        # Долгий опрос ограничен секундой, чтобы бот быстро останавливался в конце теста
+        timeout = min(float(params.get('timeout') or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if offset < 0:
+                self._updates.clear()
+                return []
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _flood_wait(self, chat_id):
+        """
+        Counts the message against the limits. Returns 0 if it may be delivered, otherwise the number of seconds to
+        wait, as Telegram does in retry_after.
+        """
+        limits = []
+        if self.global_rate:
+            limits.append((None, self.global_rate, self.global_burst))
+        if self.chat_rate:
+            limits.append((chat_id, self.chat_rate, self.chat_burst))
+        if not limits:
+            return 0
+        now = time.monotonic()
+        with self._condition:
+            wait = 0.0
+            for key, rate, burst in limits:
+                allowance = self._allowance.setdefault(key, [float(burst), now])
+                allowance[0] = min(burst, allowance[0] + (now - allowance[1]) * rate)
+                allowance[1] = now
+                if allowance[0] < 1:
+                    wait = max(wait, (1 - allowance[0]) / rate)
+            if wait:
+                self.rejected += 1
+                return max(1, math.ceil(wait))
+            for key, rate, burst in limits:
+                self._allowance[key][0] -= 1
+        return 0
+
+    def _send_message(self, params):
+        chat_id = int(params['chat_id'])
+        reply_markup = params.get('reply_markup')
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        with self._condition:
+            self.sent += 1
+        if self.on_message is not None:
+            self.on_message(chat_id, params.get('text', ''), reply_markup)
+        return {
+            'message_id': int(params.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
@@ -0,0 +1,152 @@
+"""
+Synthetic data for the benchmarks. Every benchmark works in its own schema of the database from config.py, so the real
+tables of the bot are not touched.
+
+The dictionary of size N consists of the pairs 'en1' - 'ru1' ... 'enN' - 'ruN', so a simulated user knows the right
+answer to every card: the translation of 'en123' is 'ru123'. The standard sizes are in SIZES, any other size is given
+as a number:
+
+    python3 -m benchmarks.fixtures --schema sessions_1m --pairs 1m --users 1000
+"""
+import argparse
+import time
+
+import psycopg2
+
+import config
+from migrations import migrate
+from normalize_words import create_unique_indexes
+
+# Стандартные размеры словаря для сравнения результатов между коммитами
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Пары добавляются пачками, чтобы 10 млн строк не вставлялись одним запросом
+BATCH_SIZE = 1_000_000
+
+
+def connect(schema):
+    """
+    Opens an autocommit connection with search_path set to the schema.
+    """
+    conn = psycopg2.connect(database=config.database, user=config.user, password=config.password,
+                            options=f'-c search_path={schema}')
+    conn.autocommit = True
+    return conn
+
+
+def create_schema(schema):
+    """
+    Creates an empty schema with the tables of the bot at the latest migration and returns a connection to it.
+    """
+    conn = connect(schema)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};")
+    conn.autocommit = False
+    migrate(conn)
+    conn.autocommit = True
+    return conn
+
+
+def drop_schema(conn, schema):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+def add_users(cur, count):
+    cur.execute("""
+        INSERT INTO users (id, name)
+        SELECT g, 'user' || g FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING;
+    """, (count,))
+
+
+def add_pairs(cur, start, stop, users=100, user_words_share=0.01):
+    """
+    Adds word pairs with ids start + 1 .. stop. Every pair with id divisible by step = 1 / user_words_share belongs
+    to the user id / step % users + 1, the rest are shared. So the user 2 owns the pairs step, step * (users + 1), ...
+    The owner also has a repetition state of the pair in word_reviews, due a day later. The users must already exist.
+    """
+    step = int(1 / user_words_share)
+    cur.execute("""
+        INSERT INTO english_words (id, word) SELECT g, 'en' || g FROM generate_series(%(start)s, %(stop)s) g;
+        INSERT INTO russian_words (id, word) SELECT g, 'ru' || g FROM generate_series(%(start)s, %(stop)s) g;
+        INSERT INTO all_words (id, english_words_id, russian_words_id)
+            SELECT g, g, g FROM generate_series(%(start)s, %(stop)s) g;
+        INSERT INTO user_words (user_id, all_words_id)
+            SELECT g / %(step)s %% %(users)s + 1, g FROM generate_series(%(start)s, %(stop)s) g WHERE g %% %(step)s = 0;
+        INSERT INTO word_reviews (user_id, all_words_id, due_at, interval_seconds, ease, repetitions)
+            SELECT g / %(step)s %% %(users)s + 1, g, now() + interval '1 day', 86400, 2.5, 1
+            FROM generate_series(%(start)s, %(stop)s) g WHERE g %% %(step)s = 0;
+        SELECT setval(pg_get_serial_sequence('english_words', 'id'), %(stop)s);
+        SELECT setval(pg_get_serial_sequence('russian_words', 'id'), %(stop)s);
+        SELECT setval(pg_get_serial_sequence('all_words', 'id'), %(stop)s);
+        ANALYZE english_words, russian_words, all_words, user_words, users, word_reviews;
+    """, {'start': start + 1, 'stop': stop, 'users': users, 'step': step})
+
+
+def parse_size(text):
+    """
+    Converts a size of the dictionary from SIZES ('10k', '1m', '10m') or a number of pairs to the number of pairs.
+    """
+    text = text.lower()
+    if text in SIZES:
+        return SIZES[text]
+    try:
+        return int(text.replace('_', ''))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected one of {', '.join(SIZES)} or a number of pairs, got {text!r}")
+
+
+def size_label(pairs):
+    """
+    :return: Name of the size in SIZES or the number of pairs as a string
+    """
+    for label, size in SIZES.items():
+        if size == pairs:
+            return label
+    return str(pairs)
+
+
+def pair_count(conn):
+    """
+    :return: Largest id of the pairs in the schema of the connection, None if the schema has no tables of the bot
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('all_words') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT coalesce(max(id), 0) FROM all_words")
+        return cur.fetchone()[0]
+
+
+def generate(schema, pairs, users=1000, user_words_share=0.01):
+    """
+    Creates the schema with users and a dictionary of pairs word pairs, like create_db.py creates the tables of the bot:
+    at the latest migration and with unique indexes on the keys of the words.
+
+    :return: Autocommit connection to the schema
+    """
+    conn = create_schema(schema)
+    with conn.cursor() as cur:
+        add_users(cur, users)
+        for start in range(0, pairs, BATCH_SIZE):
+            add_pairs(cur, start, min(pairs, start + BATCH_SIZE), users=users, user_words_share=user_words_share)
+    create_unique_indexes(conn)
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schema', required=True)
+    parser.add_argument('--pairs', type=parse_size, default='10k', help=f"{', '.join(SIZES)} or a number of pairs")
+    parser.add_argument('--users', type=int, default=1000, help='users that own the personal words of the dictionary')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = generate(args.schema, args.pairs, args.users)
+    conn.close()
+    print(f"{args.schema}: {args.pairs} pairs, {args.users} users in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Load test of the sync (main2.py) and the async (async_bot.py) mode of the bot.
+
+A fake Telegram Bot API (benchmarks/fake_telegram.py) plays many users at once: every user sends /start, then /cards,
+and then answers every card the bot sends with one of its buttons. The bot works with a separate schema of the local
+database from config.py, filled with a synthetic dictionary. For each mode the test reports the number of bot replies
+per second and the latency from a user message to the bot's reply. With --flood-limits the fake API enforces the flood
+limits of Telegram and the test also reports how many messages it rejected with 429.
+
+    python3 -m benchmarks.load_test --mode both --users 200 --duration 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import threading
+import time
+
+SCHEMA = 'load_test'
+
+# Пул соединений создаётся при первом запросе, поэтому search_path нужно задать до импорта бота
+os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+import telebot  # noqa: E402
+from telebot import asyncio_helper  # noqa: E402
+
+from benchmarks.fake_telegram import FakeTelegram  # noqa: E402
+from benchmarks.fixtures import add_pairs, add_users, create_schema, drop_schema  # noqa: E402
+from bot_common import Commands  # noqa: E402
+
+COMMANDS = {Commands.NEXT, Commands.ADD_WORD, Commands.DELETE_WORD}
+
+
+class SimulatedUsers:
+    """
+    Answers every message of the bot on behalf of its user and measures the time from a user message to the reply.
+    """
+
+    def __init__(self, server, count):
+        self.server = server
+        self.count = count
+        self.lock = threading.Lock()
+        self.waiting = {}  # chat_id -> время отправки последнего сообщения пользователя
+        self.latencies = []
+        self.running = False
+
+    def send(self, chat_id, text):
+        with self.lock:
+            self.waiting[chat_id] = time.perf_counter()
+        self.server.put_message(chat_id, text)
+
+    def on_message(self, chat_id, text, reply_markup):
+        now = time.perf_counter()
+        with self.lock:
+            sent_at = self.waiting.pop(chat_id, None)
+            if sent_at is not None and self.running:
+                self.latencies.append(now - sent_at)
+        if not self.running:
+            return
+        options = [button['text'] for row in (reply_markup or {}).get('keyboard', []) for button in row]
+        options = [option for option in options if option not in COMMANDS and not option.endswith('❌')]
+        if options:
+            self.send(chat_id, random.choice(options))
+        elif text.startswith('Привет'):
+            self.send(chat_id, '/cards')
+        elif sent_at is not None:
+            # Ответ без клавиатуры (например, после верного ответа) - ждём следующую карточку
+            with self.lock:
+                self.waiting.setdefault(chat_id, sent_at)
+
+
+def run_sync(users, duration, flood_limits=False):
+    import config
+    if not flood_limits:
+        # Без лимитов поддельного API бот не ограничивает скорость отправки (см. sender.py)
+        config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = None
+    import main2
+    main2.start_services()
+    thread = threading.Thread(target=main2.BOT.infinity_polling, kwargs={'timeout': 1, 'long_polling_timeout': 1},
+                              daemon=True)
+    thread.start()
+    drive(users, duration)
+    main2.BOT.stop_polling()
+    thread.join(timeout=5)
+    main2.stop_services()
+
+
+def run_async(users, duration, flood_limits=False):
+    import async_bot
+
+    async def session():
+        task = asyncio.create_task(async_bot.main())
+        await asyncio.get_running_loop().run_in_executor(None, drive, users, duration)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(session())
+
+
+def drive(users, duration):
+    """
+    Starts all users and lets them work for duration seconds.
+    """
+    users.running = True
+    for chat_id in range(1, users.count + 1):
+        users.send(chat_id, '/start')
+    time.sleep(duration)
+    users.running = False
+
+
+def report(mode, users, duration):
+    latencies = sorted(users.latencies)
+    if not latencies:
+        print(f"{mode:<6} no replies")
+        return
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{mode:<6} {len(latencies) / duration:>10.1f} {p50:>10.2f} {p99:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--users', type=int, default=100, help='number of concurrent users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per mode')
+    parser.add_argument('--pairs', type=int, default=10_000, help='size of the synthetic dictionary')
+    parser.add_argument('--flood-limits', action='store_true',
+                        help='reject messages above 30 per second in total and 1 per second per chat with 429')
+    args = parser.parse_args()
+
+    admin = create_schema(SCHEMA)
+    with admin.cursor() as cur:
+        add_users(cur, args.users)
+        add_pairs(cur, 0, args.pairs, users=args.users)
+
+    if args.flood_limits:
+        server = FakeTelegram(global_rate=30, chat_rate=1).start()
+    else:
+        server = FakeTelegram().start()
+    telebot.apihelper.API_URL = server.api_url
+    asyncio_helper.API_URL = server.api_url
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    print(f"{'mode':<6} {'replies/s':>10} {'p50, ms':>10} {'p99, ms':>10}")
+    try:
+        for mode in modes:
+            users = SimulatedUsers(server, args.users)
+            server.on_message = users.on_message
+            rejected = server.rejected
+            (run_sync if mode == 'sync' else run_async)(users, args.duration, args.flood_limits)
+            report(mode, users, args.duration)
+            if args.flood_limits:
+                print(f"{'':<6} {server.rejected - rejected} messages rejected with 429")
+    finally:
+        server.stop()
+        drop_schema(admin, SCHEMA)
+        admin.close()
+
+
+if __name__ == '__main__':
+    main()
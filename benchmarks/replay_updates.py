@@ -0,0 +1,73 @@
+"""
+Posts recorded Telegram updates to a running webhook server (python3 main2.py --webhook) and counts the answers.
+503 answers mean the server pushed back because its queues were full.
+
+The file contains one update JSON per line. Without a file, synthetic /start and /cards messages of --chats users are
+posted instead.
+
+    python3 -m benchmarks.replay_updates updates.jsonl --url http://127.0.0.1:8443/webhook --threads 16
+"""
+import argparse
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def synthetic_updates(chats):
+    update_ids = itertools.count(1)
+    for text in ('/start', '/cards'):
+        for chat_id in range(1, chats + 1):
+            yield {
+                'update_id': next(update_ids),
+                'message': {
+                    'message_id': next(update_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+                    'text': text,
+                    'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+                },
+            }
+
+
+def post(url, body, secret_token=None):
+    request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+    if secret_token:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file', nargs='?', help='file with one update JSON per line')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret-token')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--chats', type=int, default=100, help='number of users for synthetic updates')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding='utf-8') as file:
+            bodies = [line.strip().encode('utf-8') for line in file if line.strip()]
+    else:
+        bodies = [json.dumps(update).encode('utf-8') for update in synthetic_updates(args.chats)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        statuses = Counter(executor.map(lambda body: post(args.url, body, args.secret_token), bodies))
+    elapsed = time.perf_counter() - started
+    print(f"Posted {len(bodies)} updates in {elapsed:.2f}s ({len(bodies) / elapsed:.1f}/s)")
+    for status, count in sorted(statuses.items()):
+        print(f"  HTTP {status}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Scripted user sessions against the sync bot (main2.py) with a synthetic dictionary.
+
+The bot works with the fake Telegram Bot API (benchmarks/fake_telegram.py) and its own schema of the local database
+from config.py, filled by benchmarks/fixtures.py with --pairs word pairs. Every of the --users new users replays the
+same script: /start, /cards, --answers answers to cards (the right one with the probability --accuracy), adding a word
+(the command, the English word, the translation), --answers answers again and deleting the added word (the command,
+the word); then the script starts again from /cards. Every step waits for the reply of the bot and --think seconds on
+average before the next one.
+
+The run reports as JSON:
+- steps: the latency from a message of the user to the reply of the bot and the steps per second for every step of the
+  script, measured by the users;
+- handlers, routes, queries: the time of create_cards and message_processing, of every route of router.Router and of
+  every function of main.py with the time of taking a connection (acquire_p99_ms), from the histograms of metrics.py.
+  Their percentiles are estimated from the buckets of the histograms.
+
+    python3 -m benchmarks.sessions --pairs 1m --users 100 --duration 30 --output sessions.json
+
+benchmarks/suite.py runs it for several sizes of the dictionary and compares the results between commits.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import telebot
+
+import config
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.fixtures import SIZES, connect, drop_schema, generate, pair_count, parse_size, size_label
+from bot_common import Commands
+from metrics import REGISTRY
+
+COMMANDS = {Commands.NEXT, Commands.ADD_WORD, Commands.DELETE_WORD}
+
+# Первые пользователи владеют личными словами словаря, пользователи сценария идут после них
+DICTIONARY_USERS = 1000
+
+# Сообщения, после которых бот присылает карточку
+CARD_TITLE = 'Выберите перевод слова:'
+
+
+def script(answers):
+    """
+    :return: Steps of one pass of the script, starting from /cards
+    """
+    return (['cards'] + ['answer'] * answers + ['add_word', 'add_english', 'add_translation'] + ['answer'] * answers
+            + ['delete_word', 'delete_english'])
+
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * share))] if timings else None
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def translation(prompt):
+    """
+    Right answer to the card with the prompt: the dictionary of benchmarks/fixtures.py and the words the users add
+    are built so that the translation follows from the word.
+    """
+    if prompt.startswith('bench'):
+        return 'бенч' + prompt[len('bench'):]
+    if prompt.startswith('en'):
+        return 'ru' + prompt[2:]
+    return prompt
+
+
+class ScriptedUsers:
+    """
+    Plays the script on behalf of every user and measures the time from a message of the user to the reply.
+
+    :param server: FakeTelegram
+    :param chat_ids: IDs of the users (and their chats)
+    :param answers: Answers to cards between adding and deleting a word
+    :param accuracy: Probability of the right answer
+    :param think: Mean pause of a user before the next step, seconds
+    :param timeout: Seconds without a reply after which the step is counted as lost and the user goes on
+    :param seed: Seed of the random choices
+    """
+
+    def __init__(self, server, chat_ids, answers=5, accuracy=0.8, think=0.0, timeout=5.0, seed=1):
+        self.server = server
+        self.chat_ids = list(chat_ids)
+        self.script = script(answers)
+        self.accuracy = accuracy
+        self.think = think
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Condition()
+        self.position = {}  # chat_id -> номер шага сценария, -1 - /start
+        self.pending = {}  # chat_id -> (шаг, время отправки сообщения)
+        self.cards = {}  # chat_id -> (слово карточки, варианты ответа)
+        self.words = {}  # chat_id -> номер последнего добавленного слова
+        self.due = []  # куча (время, chat_id) следующих шагов
+        self.latencies = {}  # шаг -> задержки ответов, с
+        self.timeouts = 0
+        self.running = False
+
+    def _step_text(self, chat_id, step):
+        if step == 'start':
+            return '/start'
+        if step == 'cards':
+            return '/cards'
+        if step == 'add_word':
+            return Commands.ADD_WORD
+        if step == 'delete_word':
+            return Commands.DELETE_WORD
+        if step == 'add_english':
+            self.words[chat_id] = self.words.get(chat_id, 0) + 1
+            return f'bench{chat_id}x{self.words[chat_id]}'
+        if step == 'add_translation':
+            return f'бенч{chat_id}x{self.words[chat_id]}'
+        if step == 'delete_english':
+            return f'bench{chat_id}x{self.words[chat_id]}'
+        return self._answer(chat_id)
+
+    def _answer(self, chat_id):
+        prompt, options = self.cards.get(chat_id, ('', []))
+        if not options:
+            return '/cards'
+        right = translation(prompt)
+        if right in options and self.random.random() < self.accuracy:
+            return right
+        wrong = [option for option in options if option != right]
+        return self.random.choice(wrong or options)
+
+    def _schedule(self, chat_id, now):
+        pause = self.random.expovariate(1 / self.think) if self.think else 0.0
+        heapq.heappush(self.due, (now + pause, chat_id))
+        self.lock.notify()
+
+    def on_message(self, chat_id, text, reply_markup):
+        now = time.perf_counter()
+        options = [button['text'] for row in (reply_markup or {}).get('keyboard', []) for button in row]
+        options = [option for option in options if option not in COMMANDS and not option.endswith('❌')]
+        with self.lock:
+            if chat_id not in self.position:
+                return
+            if options:
+                prompt = text.rsplit('\n', 1)[-1].strip() if CARD_TITLE in text else self.cards.get(chat_id, ('',))[0]
+                self.cards[chat_id] = (prompt, options)
+            pending = self.pending.pop(chat_id, None)
+            if pending is None:
+                return  # Ответ пришёл после таймаута
+            step, sent_at = pending
+            if self.running:
+                self.latencies.setdefault(step, []).append(now - sent_at)
+                self._schedule(chat_id, now)
+
+    def _send(self, chat_id, now):
+        position = self.position[chat_id]
+        step = 'start' if position < 0 else self.script[position % len(self.script)]
+        self.position[chat_id] = position + 1
+        self.pending[chat_id] = (step, now)
+        return self._step_text(chat_id, step)
+
+    def run(self, duration):
+        """
+        Plays the script for duration seconds and waits for the replies to the last steps.
+        """
+        with self.lock:
+            self.running = True
+            now = time.perf_counter()
+            for chat_id in self.chat_ids:
+                self.position[chat_id] = -1
+                self._schedule(chat_id, now)
+        stop_at = time.perf_counter() + duration
+        while True:
+            with self.lock:
+                now = time.perf_counter()
+                if now >= stop_at:
+                    self.running = False
+                    break
+                for chat_id, (step, sent_at) in list(self.pending.items()):
+                    if now - sent_at > self.timeout:
+                        # Бот не ответил: шаг потерян, пользователь продолжает сценарий
+                        del self.pending[chat_id]
+                        self.timeouts += 1
+                        self._schedule(chat_id, now)
+                messages = []
+                while self.due and self.due[0][0] <= now:
+                    _, chat_id = heapq.heappop(self.due)
+                    messages.append((chat_id, self._send(chat_id, now)))
+                if not messages:
+                    wait = self.due[0][0] - now if self.due else 0.1
+                    self.lock.wait(min(wait, 0.1))
+            for chat_id, text in messages:
+                self.server.put_message(chat_id, text)
+        deadline = time.perf_counter() + self.timeout
+        with self.lock:
+            while self.pending and time.perf_counter() < deadline:
+                self.lock.wait(0.1)
+
+    def results(self, duration):
+        steps = {}
+        for step, timings in sorted(self.latencies.items()):
+            steps[step] = {'count': len(timings), 'per_second': round(len(timings) / duration, 2),
+                           'p50_ms': milliseconds(percentile(timings, 0.5)),
+                           'p99_ms': milliseconds(percentile(timings, 0.99)),
+                           'max_ms': milliseconds(max(timings))}
+        return steps
+
+
+def histogram_stats(histogram, duration):
+    _, seconds, count, max_seconds = histogram.snapshot()
+    return {'count': count, 'per_second': round(count / duration, 2),
+            'mean_ms': milliseconds(seconds / count) if count else None,
+            'p50_ms': milliseconds(histogram.quantile(0.5)), 'p99_ms': milliseconds(histogram.quantile(0.99)),
+            'max_ms': milliseconds(max_seconds) if count else None}
+
+
+def server_results(registry, duration, handlers=('create_cards', 'message_processing')):
+    """
+    :return: Sections handlers, routes and queries of the results from the histograms of the registry
+    """
+    results = {'handlers': {}, 'routes': {}, 'queries': {}}
+    for labels, histogram in registry.series('bot_handler_seconds'):
+        if labels['handler'] in handlers:
+            results['handlers'][labels['handler']] = histogram_stats(histogram, duration)
+    for labels, histogram in registry.series('bot_route_seconds'):
+        results['routes'][labels['route']] = histogram_stats(histogram, duration)
+    acquire = {labels['function']: histogram for labels, histogram in registry.series('bot_db_acquire_seconds')}
+    for labels, histogram in registry.series('bot_db_query_seconds'):
+        name = labels['function']
+        results['queries'][name] = histogram_stats(histogram, duration)
+        if name in acquire:
+            results['queries'][name]['acquire_p99_ms'] = milliseconds(acquire[name].quantile(0.99))
+    return results
+
+
+def reset_users(conn, first_id):
+    """
+    Removes the users of a previous run from a reused schema, so that /start greets them again.
+    """
+    with conn.cursor() as cur:
+        for table in ('user_words', 'user_states', 'answer_log', 'word_reviews', 'word_events'):
+            cur.execute(f"DELETE FROM {table} WHERE user_id >= %s", (first_id,))
+        cur.execute("DELETE FROM users WHERE id >= %s", (first_id,))
+
+
+def run(args):
+    """
+    Prepares the schema, runs the sessions and returns the results as a dictionary.
+    """
+    schema = args.schema or f'sessions_{size_label(args.pairs)}'
+    first_id = DICTIONARY_USERS + 1
+    conn = connect(schema)
+    if args.reuse and pair_count(conn) == args.pairs:
+        reset_users(conn, first_id)
+    else:
+        conn.close()
+        started = time.perf_counter()
+        conn = generate(schema, args.pairs, DICTIONARY_USERS)
+        print(f"{schema}: {args.pairs} pairs generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # Пул соединений создаётся при первом запросе, поэтому search_path нужно задать до импорта бота
+    os.environ['PGOPTIONS'] = f'-c search_path={schema}'
+    # Измеряется бот, а не лимиты Telegram: очередь отправки не ограничивает скорость (см. sender.py)
+    config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = None
+    config.INLINE_KEYBOARD = False
+    import main2
+
+    server = FakeTelegram().start()
+    telebot.apihelper.API_URL = server.api_url
+    users = ScriptedUsers(server, range(first_id, first_id + args.users), answers=args.answers,
+                          accuracy=args.accuracy, think=args.think, timeout=args.timeout, seed=args.seed)
+    server.on_message = users.on_message
+    main2.start_services()
+    thread = threading.Thread(target=main2.BOT.infinity_polling, kwargs={'timeout': 1, 'long_polling_timeout': 1},
+                              daemon=True)
+    thread.start()
+    try:
+        started = time.perf_counter()
+        users.run(args.duration)
+        duration = time.perf_counter() - started
+    finally:
+        main2.BOT.stop_polling()
+        thread.join(timeout=5)
+        main2.stop_services()
+        server.stop()
+        if not args.reuse:
+            drop_schema(conn, schema)
+        conn.close()
+
+    result = {'pairs': args.pairs, 'size': size_label(args.pairs), 'users': args.users, 'duration': args.duration,
+              'think': args.think, 'answers': args.answers, 'accuracy': args.accuracy,
+              'steps_per_second': round(sum(len(timings) for timings in users.latencies.values()) / duration, 2),
+              'timeouts': users.timeouts, 'steps': users.results(duration)}
+    result.update(server_results(REGISTRY, duration))
+    return result
+
+
+def parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=parse_size, default='10k', help=f"{', '.join(SIZES)} or a number of pairs")
+    parser.add_argument('--users', type=int, default=100, help='number of concurrent users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of the sessions')
+    parser.add_argument('--answers', type=int, default=5, help='answers to cards between adding and deleting a word')
+    parser.add_argument('--accuracy', type=float, default=0.8, help='probability of the right answer')
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause of a user between the steps, seconds')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for a reply of the bot')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--schema', help='schema of the database, by default sessions_<size>')
+    parser.add_argument('--reuse', action='store_true',
+                        help='keep the generated schema and reuse it if it has the same number of pairs')
+    parser.add_argument('--output', help='file for the JSON results, by default they are printed')
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
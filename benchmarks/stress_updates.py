@@ -0,0 +1,134 @@
+"""
+Stress test of the order of updates: the thread pool of TeleBot against ShardedTeleBot (workers.py).
+
+--users users send --messages messages each; the messages of all users are interleaved and passed to
+process_new_updates() in batches of 100, as getUpdates returns them. The handler changes the state of the user in a
+plain dictionary without locks, like the dialogue of adding a word: it reads the state, waits --handler-ms (a request
+to the database or to Telegram, the GIL is released) and writes the state with the text of the message appended.
+When two messages of one user are handled at the same time, one of the changes is lost, and when they are handled in
+the wrong order, the texts are out of order.
+
+After all messages are handled, the test checks the final state of every user and reports the users with lost or
+reordered messages and the number of messages per second. It exits with code 1 if ShardedTeleBot broke the state of
+any user. No database and no network are needed.
+
+    python3 -m benchmarks.stress_updates --users 200 --messages 50 --workers 8 --handler-ms 2
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from telebot import TeleBot, types
+
+from workers import ShardedTeleBot
+
+TOKEN = '123456:stress-test'
+
+
+def interleaved_updates(users, messages, seed):
+    """
+    Returns the updates of all users: the messages of every user are numbered in the order they are sent, and the
+    users take turns in a random order.
+    """
+    rng = random.Random(seed)
+    pending = {user_id: 0 for user_id in range(1, users + 1)}
+    updates = []
+    while pending:
+        user_id = rng.choice(list(pending))
+        number = pending[user_id]
+        pending[user_id] += 1
+        if pending[user_id] == messages:
+            del pending[user_id]
+        update_id = len(updates) + 1
+        updates.append(types.Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+                'text': str(number),
+            },
+        }))
+    return updates
+
+
+def run(bot, updates, handler_seconds, timeout):
+    """
+    Registers the handler on the bot, processes the updates and waits until all of them are handled.
+
+    :return: (state of the users, seconds)
+    """
+    state = {}
+    handled = threading.Semaphore(0)
+
+    @bot.message_handler(content_types=['text'])
+    def remember(message):
+        # Чтение, ожидание и запись состояния без блокировки, как в диалоге добавления слова
+        texts = state.get(message.from_user.id, [])
+        time.sleep(handler_seconds * random.uniform(0.5, 1.5))
+        state[message.from_user.id] = texts + [message.text]
+        handled.release()
+
+    started = time.perf_counter()
+    for first in range(0, len(updates), 100):
+        bot.process_new_updates(updates[first:first + 100])
+    deadline = started + timeout
+    for _ in updates:
+        if not handled.acquire(timeout=max(deadline - time.perf_counter(), 0)):
+            break
+    return state, time.perf_counter() - started
+
+
+def check(state, users, messages):
+    """
+    :return: (users with lost messages, users with messages out of order)
+    """
+    expected = [str(number) for number in range(messages)]
+    lost = reordered = 0
+    for user_id in range(1, users + 1):
+        texts = state.get(user_id, [])
+        if len(texts) < messages:
+            lost += 1
+        elif texts != expected:
+            reordered += 1
+    return lost, reordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=50, help='messages of every user')
+    parser.add_argument('--workers', type=int, default=8, help='threads of both bots')
+    parser.add_argument('--handler-ms', type=float, default=2.0, help='average time of the handler, milliseconds')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    updates = interleaved_updates(args.users, args.messages, args.seed)
+    bots = {
+        'telebot threads': lambda: TeleBot(TOKEN, num_threads=args.workers),
+        'sharded': lambda: ShardedTeleBot(TOKEN, workers=args.workers, queue_size=args.messages * args.users),
+    }
+    print(f"{len(updates)} updates of {args.users} users, {args.workers} threads")
+    print(f"{'bot':<16} {'seconds':>8} {'msg/s':>8} {'lost':>6} {'reordered':>10}")
+    broken = False
+    for name, make_bot in bots.items():
+        bot = make_bot()
+        state, seconds = run(bot, updates, args.handler_ms / 1000, args.timeout)
+        lost, reordered = check(state, args.users, args.messages)
+        print(f"{name:<16} {seconds:>8.2f} {len(updates) / seconds:>8.0f} {lost:>6} {reordered:>10}")
+        if isinstance(bot, ShardedTeleBot):
+            bot.stop_workers(timeout=5)
+            broken = broken or lost or reordered
+        else:
+            bot.worker_pool.close()
+    if broken:
+        print("ShardedTeleBot lost or reordered the messages of some users", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Reproducible benchmark of the bot for comparing commits.
+
+The suite runs benchmarks/sessions.py with the same script and seed for every size of the dictionary in --sizes, each
+in its own process (the bot connects to the schema of its size when it is imported), and writes one JSON file with the
+commit, the parameters and the results of all sizes. With --compare it also compares the results with the file of
+another commit: every step, handler, route and query whose p50 or p99 became slower by more than --threshold is
+reported as a regression, and the suite exits with code 1.
+
+    git checkout main && python3 -m benchmarks.suite --sizes 10k 1m --reuse --output main.json
+    git checkout feature && python3 -m benchmarks.suite --sizes 10k 1m --reuse --output feature.json --compare main.json
+    python3 -m benchmarks.suite --compare main.json --results feature.json
+
+--reuse keeps the generated schemas between runs, so the dictionary of 10 million pairs is generated only once.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+# Стандартные размеры словаря (benchmarks/fixtures.SIZES). Сравнение результатов работает и без psycopg2
+SIZES = ['10k', '1m', '10m']
+
+SECTIONS = ('steps', 'handlers', 'routes', 'queries')
+
+# Параметры benchmarks/sessions.py, которые передаются из набора без изменений
+SESSION_OPTIONS = ('users', 'duration', 'answers', 'accuracy', 'think', 'timeout', 'seed')
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(size, args):
+    """
+    Runs benchmarks/sessions.py for one size of the dictionary in a separate process and returns its results.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'sessions.json')
+        command = [sys.executable, '-m', 'benchmarks.sessions', '--pairs', size, '--output', output]
+        for option in SESSION_OPTIONS:
+            command += [f'--{option}', str(getattr(args, option))]
+        if args.reuse:
+            command.append('--reuse')
+        subprocess.run(command, check=True)
+        with open(output, encoding='utf-8') as file:
+            return json.load(file)
+
+
+def compare(baseline, results, threshold, min_count=20):
+    """
+    Compares the results of two runs of the suite.
+
+    :param baseline: Results of the suite to compare with
+    :param results: New results of the suite
+    :param threshold: Relative growth of p50 or p99 that is a regression, for example 0.2
+    :param min_count: Entries with fewer calls in any of the runs are not compared: their percentiles are noise
+    :return: List of (size, section, name, metric, old value, new value, relative change) whose change is beyond the
+    threshold in either direction
+    """
+    changes = []
+    old_runs = {run['size']: run for run in baseline['runs']}
+    for run in results['runs']:
+        old_run = old_runs.get(run['size'])
+        if old_run is None:
+            continue
+        for section in SECTIONS:
+            old_entries = old_run.get(section, {})
+            for name, entry in run.get(section, {}).items():
+                old_entry = old_entries.get(name)
+                if old_entry is None or min(old_entry['count'], entry['count']) < min_count:
+                    continue
+                for metric in ('p50_ms', 'p99_ms'):
+                    old, new = old_entry[metric], entry[metric]
+                    if not old or new is None:
+                        continue
+                    change = new / old - 1
+                    if abs(change) > threshold:
+                        changes.append((run['size'], section, name, metric, old, new, change))
+    return changes
+
+
+def print_results(results):
+    for run in results['runs']:
+        print(f"{run['size']} ({run['pairs']} pairs, {run['users']} users): {run['steps_per_second']} steps/s, "
+              f"{run['timeouts']} without reply")
+        for section in SECTIONS:
+            for name, entry in run.get(section, {}).items():
+                if entry['count']:
+                    print(f"  {section:<9} {name:<40} {entry['count']:>8} {entry['per_second']:>9.1f}/s "
+                          f"p50 {entry['p50_ms']:>9.3f} ms  p99 {entry['p99_ms']:>9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=SIZES, help=f"{', '.join(SIZES)} or numbers of pairs")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--answers', type=int, default=5)
+    parser.add_argument('--accuracy', type=float, default=0.8)
+    parser.add_argument('--think', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='keep the generated schemas and reuse them')
+    parser.add_argument('--output', help='file for the JSON results')
+    parser.add_argument('--results', help='compare this file of results instead of running the suite')
+    parser.add_argument('--compare', help='file of results of another commit')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown that is a regression')
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results, encoding='utf-8') as file:
+            results = json.load(file)
+    else:
+        results = {
+            'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'parameters': {option: getattr(args, option) for option in SESSION_OPTIONS},
+            'runs': [run_size(size, args) for size in args.sizes],
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+                file.write('\n')
+        print_results(results)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('parameters') != results.get('parameters'):
+            print("warning: the runs were made with different parameters", file=sys.stderr)
+        changes = compare(baseline, results, args.threshold)
+        regressions = [change for change in changes if change[-1] > 0]
+        print(f"compared with {baseline.get('commit')}: {len(regressions)} regressions, "
+              f"{len(changes) - len(regressions)} improvements beyond {args.threshold:.0%}")
+        for size, section, name, metric, old, new, change in changes:
+            kind = 'REGRESSION' if change > 0 else 'improvement'
+            print(f"  {kind:<11} {size:<4} {section:<9} {name:<40} {metric} {old:.3f} -> {new:.3f} ms ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
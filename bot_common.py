@@ -0,0 +1,127 @@
+"""
+Commands, states and message helpers shared by the sync (main2.py) and the async (async_bot.py) mode of the bot.
+"""
+from telebot import types
+from telebot.handler_backends import State, StatesGroup
+
+
+def show_chat_hint(*lines):
+    """
+    The function takes an arbitrary number of lines and combines them into one string, separating each new line with
+    a newline character.
+    This can be useful for formatting output in a chat.
+
+    :param lines: Lines to join
+    :return: One string consisting of all input lines separated by a newline character
+    """
+    return '\n'.join(lines)
+
+
+def show_translation_process(card):
+    """
+    The function takes a card and returns a string representing the process of translating a word.
+
+    :param card: card_queue.ChatCard
+    :return: String representing the process of translating a word
+    """
+    return f"{card.answer} -> {card.prompt}"
+
+
+def card_keyboard(card):
+    """
+    Builds the keyboard of a card: the options (the wrong answers already given are marked with ❌) and the
+    "Next", "Add word" and "Delete word" buttons.
+
+    :param card: card_queue.ChatCard
+    :return: ReplyKeyboardMarkup
+    """
+    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
+    buttons = [types.KeyboardButton(word) for word in card.labels()]
+    buttons.extend([types.KeyboardButton(Commands.NEXT),
+                    types.KeyboardButton(Commands.ADD_WORD),
+                    types.KeyboardButton(Commands.DELETE_WORD)])
+    keyboard_markup.add(*buttons)
+    return keyboard_markup
+
+
+def inline_card_keyboard(card):
+    """
+    Builds the inline keyboard of a card for the inline quiz mode. The option buttons carry "<card_id>:<index>" in
+    callback_data, the "Next" button "<card_id>:next" (see parse_callback).
+
+    :param card: card_queue.ChatCard
+    :return: InlineKeyboardMarkup
+    """
+    keyboard_markup = types.InlineKeyboardMarkup(row_width=2)
+    keyboard_markup.add(*[types.InlineKeyboardButton(label, callback_data=f'{card.card_id}:{i}')
+                          for i, label in enumerate(card.labels())])
+    keyboard_markup.add(types.InlineKeyboardButton(Commands.NEXT, callback_data=f'{card.card_id}:{Callbacks.NEXT}'))
+    keyboard_markup.add(types.InlineKeyboardButton(Commands.ADD_WORD, callback_data=Callbacks.ADD_WORD),
+                        types.InlineKeyboardButton(Commands.DELETE_WORD, callback_data=Callbacks.DELETE_WORD))
+    return keyboard_markup
+
+
+def parse_callback(data):
+    """
+    Splits callback_data of a card button.
+
+    :param data: callback_data of the pressed button
+    :return: (card_id, action): action is the index of the option or Callbacks.NEXT; (None, data) for the buttons
+    that do not belong to a card and for unknown data
+    """
+    card_id, separator, action = data.partition(':')
+    if not separator or not card_id.isdigit():
+        return None, data
+    return int(card_id), int(action) if action.isdigit() else action
+
+
+class Callbacks:
+    """
+    callback_data of the inline buttons that are not options (see inline_card_keyboard).
+    """
+    NEXT = 'next'
+    ADD_WORD = 'add'
+    DELETE_WORD = 'delete'
+
+
+class Commands:
+    """
+    Class containing constants for bot commands. Each constant is a text string that the user must send to the bot
+    to perform a certain command.
+
+    ADD_WORD: Command to add a new word to the user's dictionary.
+    DELETE_WORD: Command to delete a word from the user's dictionary.
+    NEXT: Command to move to the next set of flashcards for learning words.
+    """
+    ADD_WORD = 'Добавить слово ➕'
+    DELETE_WORD = 'Удалить слово 🗑️'
+    NEXT = 'Дальше ⏩'
+
+
+class Status:
+    """
+    Steps of the dialogue of a user, stored in state_store.UserState.status. The handlers of the steps are chosen by
+    router.Router.
+
+    CARDS: The user answers the cards.
+    ENGLISH_WORD: The user enters an English word to add.
+    TRANSLATION: The user enters the translation of the word being added.
+    DELETE_WORD: The user enters a word to delete.
+    """
+    CARDS = 0
+    ENGLISH_WORD = 1
+    TRANSLATION = 2
+    DELETE_WORD = 3
+
+
+class States(StatesGroup):
+    """
+    Class containing states for the bot. Each state represents a stage in the dialogue with the bot.
+
+    initial_word: The state in which the user enters the initial word for translation.
+    translate_word: The state in which the user enters the translation of the word.
+    another_word: The state in which the user can enter another word for translation.
+    """
+    initial_word = State()
+    translate_word = State()
+    another_word = State()
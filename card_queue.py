@@ -0,0 +1,302 @@
+import logging
+import random
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from normalization import word_key
+
+logger = logging.getLogger(__name__)
+
+
+class Card:
+    """
+    One flashcard: the word the user has to choose (answer), the word shown in the message (prompt) and the shuffled
+    answer options, one of which is the answer.
+    """
+    __slots__ = ('word_id', 'answer', 'prompt', 'options')
+
+    def __init__(self, word_id, answer, prompt, options):
+        self.word_id = word_id
+        self.answer = answer
+        self.prompt = prompt
+        self.options = options
+
+    def __repr__(self):
+        return f"Card({self.word_id!r}, {self.answer!r}, {self.prompt!r}, {self.options!r})"
+
+
+class ChatCard:
+    """
+    The card a chat is answering right now, with the answers the user has already got wrong.
+
+    positions maps the normalized key of every option (see normalization.word_key) to its place on the keyboard, so
+    an answer is checked with one dictionary lookup, and a typed answer may differ from the option in case, spaces
+    or ё/е.
+    wrong is a bit mask: bit i is set when the user chose options[i] and it was wrong. The size of the object does
+    not depend on the number of attempts, see benchmarks/bench_chat_cards.py.
+    card_id is a random number that the inline buttons of the card carry in callback_data, so that a button of an
+    older card is not taken for an answer to this one.
+    """
+    __slots__ = ('word_id', 'answer', 'prompt', 'options', 'positions', 'wrong', 'card_id')
+
+    def __init__(self, word_id, answer, prompt, options, wrong=0, card_id=None):
+        self.word_id = word_id
+        self.answer = answer
+        self.prompt = prompt
+        self.options = tuple(options)
+        self.positions = {}
+        for i, word in enumerate(self.options):
+            key = word_key(word)
+            # Обычно ключ совпадает со словом - тогда храним само слово, а не его копию
+            self.positions[word if key == word else key] = i
+        self.wrong = wrong
+        self.card_id = card_id
+
+    @classmethod
+    def from_card(cls, card):
+        return cls(card.word_id, card.answer, card.prompt, card.options, card_id=random.getrandbits(32))
+
+    def check(self, text):
+        """
+        Checks the answer of the user and remembers a wrong one.
+
+        :param text: Text of the pressed button or the typed answer
+        :return: True if the answer is right, False if it is wrong, None if text is not one of the options
+        """
+        position = self.positions.get(word_key(text))
+        if position is None:
+            return None
+        return self.check_position(position)
+
+    def check_position(self, position):
+        """
+        Checks the answer given by the number of the option (an inline button) and remembers a wrong one.
+
+        :param position: Index of the option in options
+        :return: True if the answer is right, False if it is wrong, None if there is no such option
+        """
+        if not 0 <= position < len(self.options):
+            return None
+        # Обычно правильный ответ - тот же объект строки, что и вариант, и строки не сравниваются по символам
+        if self.options[position] == self.answer:
+            return True
+        self.wrong |= 1 << position
+        return False
+
+    def labels(self):
+        """
+        Returns the texts of the option buttons; the options already chosen wrongly are marked with ❌.
+        """
+        return [word + '❌' if self.wrong >> i & 1 else word for i, word in enumerate(self.options)]
+
+    def copy(self):
+        card = ChatCard.__new__(ChatCard)
+        card.word_id = self.word_id
+        card.answer = self.answer
+        card.prompt = self.prompt
+        card.options = self.options
+        card.positions = self.positions  # Не меняется после создания, поэтому общий
+        card.wrong = self.wrong
+        card.card_id = self.card_id
+        return card
+
+    def to_list(self):
+        return [self.word_id, self.answer, self.prompt, list(self.options), self.wrong, self.card_id]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def __repr__(self):
+        return (f"ChatCard({self.word_id!r}, {self.answer!r}, {self.prompt!r}, {self.options!r}, {self.wrong!r}, "
+                f"{self.card_id!r})")
+
+
+def make_cards(pairs, to_russian=True, options=5, distractors=None):
+    """
+    Builds cards from a batch of word pairs. The wrong options of every card are the words of the other pairs of
+    the batch, so no extra queries are needed, or, if distractors is given, words that look like the answer.
+
+    :param pairs: List of tuples (all_words ID, Russian word, English word)
+    :param to_russian: If True, the user chooses a Russian word for an English prompt, otherwise vice versa
+    :param options: Number of buttons with words on the card
+    :param distractors: distractors.Distractors or None
+    :return: List of cards
+    """
+    answer_index, prompt_index = (1, 2) if to_russian else (2, 1)
+    words = list({pair[answer_index] for pair in pairs})
+    cards = []
+    for pair in pairs:
+        answer = pair[answer_index]
+        others = distractors.choose(answer, options - 1, to_russian) if distractors is not None else []
+        if len(others) < options - 1:
+            # Словарь слишком мал для похожих вариантов: добираем словами других карточек пачки
+            others += [word for word in random.sample(words, min(len(words), options))
+                       if word_key(word) != word_key(answer) and word not in others]
+        card_options = [answer] + others[:options - 1]
+        random.shuffle(card_options)
+        cards.append(Card(pair[0], answer, pair[prompt_index], tuple(card_options)))
+    return cards
+
+
+def make_review_card(review, donor, to_russian=True):
+    """
+    Builds the card of a word to repeat. The wrong options are taken from another card, so no query is needed.
+
+    :param review: scheduler.Review of the word
+    :param donor: Card from CardQueue whose options are used as the wrong options
+    :param to_russian: Direction of the card, see make_cards()
+    :return: Card
+    """
+    answer, prompt = (review.russian, review.english) if to_russian else (review.english, review.russian)
+    # Варианты сравниваются по ключу: "Ёж" и "еж" - одно слово, и оно не должно оказаться среди неверных
+    answer_key = word_key(answer)
+    others = [word for word in donor.options if word_key(word) != answer_key][:len(donor.options) - 1]
+    card_options = [answer] + others
+    random.shuffle(card_options)
+    return Card(review.word_id, answer, prompt, tuple(card_options))
+
+
+class _UserCards:
+    __slots__ = ('cards', 'generation', 'refilling')
+
+    def __init__(self):
+        self.cards = deque()
+        self.generation = 0
+        self.refilling = False
+
+
+class CardQueue:
+    """
+    Per-user buffer of ready flashcards, so that the /cards and "Next" handlers take a card from memory instead of
+    querying the database.
+
+    Cards are loaded in batches of batch_size pairs with one query (fetch_pairs). When fewer than low_water cards
+    are left, the next batch is loaded in a background thread. Only the first card of a user waits for the database.
+    Buffers of at most max_users users are kept; the user who has not asked for a card for the longest time is
+    evicted first. So the memory is bounded by max_users * batch_size cards.
+
+    :param fetch_pairs: Function (user_id, count) -> list of tuples (all_words ID, Russian word, English word)
+    :param batch_size: Number of cards loaded at once
+    :param low_water: Background refill starts when fewer cards are left
+    :param max_users: Maximum number of users with buffered cards
+    :param to_russian: Direction of the cards, see make_cards()
+    :param workers: Number of background threads loading cards
+    :param distractors: distractors.Distractors that chooses the wrong options, see make_cards()
+    """
+
+    def __init__(self, fetch_pairs, batch_size=50, low_water=10, max_users=10000, to_russian=True, workers=2,
+                 distractors=None):
+        self.fetch_pairs = fetch_pairs
+        self.distractors = distractors
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_users = max_users
+        self.to_russian = to_russian
+
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='card-queue')
+        self._stats = {'hits': 0, 'misses': 0, 'refills': 0, 'evictions': 0, 'invalidations': 0, 'errors': 0}
+
+    def _load(self, user_id):
+        pairs = self.fetch_pairs(user_id, self.batch_size) or []
+        return make_cards(pairs, to_russian=self.to_russian, distractors=self.distractors)
+
+    def _safe_load(self, user_id):
+        """
+        Loads the cards like _load(). An error is logged and gives no cards, so that it does not reach the handler.
+        """
+        try:
+            return self._load(user_id)
+        except Exception as ex:
+            logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+            with self._lock:
+                self._stats['errors'] += 1
+            return []
+
+    def _store(self, user_id, generation, cards):
+        """
+        Adds loaded cards to the buffer, unless the buffer was invalidated or evicted while they were loading.
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry.generation != generation:
+                return
+            entry.cards.extend(cards)
+            entry.refilling = False
+
+    def _refill(self, user_id, generation):
+        self._store(user_id, generation, self._safe_load(user_id))
+
+    def _entry(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = _UserCards()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self._stats['evictions'] += 1
+        else:
+            self._users.move_to_end(user_id)
+        return entry
+
+    def pop(self, user_id):
+        """
+        Returns the next card of the user. If the buffer is empty, the cards are loaded synchronously.
+
+        :param user_id: User ID
+        :return: Card, or None if the user has no words or the cards could not be loaded
+        """
+        with self._lock:
+            entry = self._entry(user_id)
+            card = entry.cards.popleft() if entry.cards else None
+            generation = entry.generation
+            if card is not None:
+                self._stats['hits'] += 1
+                if len(entry.cards) < self.low_water and not entry.refilling:
+                    entry.refilling = True
+                    self._stats['refills'] += 1
+                    self._executor.submit(self._refill, user_id, generation)
+                return card
+            self._stats['misses'] += 1
+
+        # Ошибка БД здесь, как и при фоновой загрузке, не доходит до обработчика: он получает None, как без слов
+        cards = self._safe_load(user_id)
+        if not cards:
+            return None
+        card = cards.pop(0)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry.generation == generation and not entry.cards:
+                entry.cards.extend(cards)
+        return card
+
+    def invalidate(self, user_id):
+        """
+        Drops the buffered cards of the user. It must be called after the user adds or deletes a word, so that
+        the new word appears on the cards and the deleted one does not.
+
+        :param user_id: User ID
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.cards.clear()
+                entry.generation += 1
+                entry.refilling = False
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        """
+        Returns the counters of the queue: hits (card taken from memory), misses (card loaded synchronously),
+        background refills, evictions, invalidations, failed loads and the number of buffered users and cards.
+        """
+        with self._lock:
+            result = dict(self._stats)
+            result['users'] = len(self._users)
+            result['cards'] = sum(len(entry.cards) for entry in self._users.values())
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -1,58 +1,37 @@
+import argparse
+
 import psycopg2
 from config import password, database, user
 
-
-def create_tables(cur):
-
-    cur.execute("""
-                DROP TABLE IF EXISTS all_words CASCADE;
-                DROP TABLE IF EXISTS english_words CASCADE;
-                DROP TABLE IF EXISTS russian_words CASCADE;
-                DROP TABLE IF EXISTS user_words;
-                DROP TABLE IF EXISTS users;
-    """)
-    conn.commit()
-
-    cur.execute("""
-                CREATE TABLE IF NOT EXISTS english_words(
-                id SERIAL PRIMARY KEY,
-                word VARCHAR(60) NOT NULL UNIQUE
-                );
-    """)
-
-    cur.execute("""
-                CREATE TABLE IF NOT EXISTS russian_words(
-                id SERIAL PRIMARY KEY,
-                word VARCHAR(60) NOT NULL UNIQUE
-                );
-    """)
-
-    cur.execute("""
-                CREATE TABLE IF NOT EXISTS all_words(
-                id SERIAL PRIMARY KEY,
-                english_words_id INTEGER NOT NULL REFERENCES english_words(id),
-                russian_words_id INTEGER NOT NULL REFERENCES russian_words(id)
-                );
-        """)
-
-    cur.execute("""
-                CREATE TABLE IF NOT EXISTS users(
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(100) NOT NULL
-                );
-        """)
-
-    cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_words(
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id),
-                all_words_id INTEGER NOT NULL REFERENCES all_words(id)
-                );
-    """)
-
-    conn.commit()
-
-
-with psycopg2.connect(database=database, user=user, password=password) as conn:
-    with conn.cursor() as cur:
-        create_tables(cur)
+from migrations import MIGRATIONS, drop_tables, migrate
+from normalize_words import normalize_words
+
+
+def create_tables(conn, reset=False):
+    """
+    The function creates the tables of the bot or upgrades an existing database to the latest version of the schema.
+    The structure of the tables is described by the migrations in migrations.py. Existing data is kept, unless
+    reset is True: then all tables are dropped and created from scratch. Afterwards the normalized keys of the words
+    are filled and the unique indexes on them are created (normalize_words.py).
+
+    :param conn: psycopg2 connection
+    :param reset: Drop all tables before creating them
+    :return: List of applied migration versions
+    """
+    if reset:
+        drop_tables(conn)
+    applied = migrate(conn)
+    normalize_words(conn)
+    return applied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Creates or upgrades the database of the bot")
+    parser.add_argument('--reset', action='store_true', help='drop all tables and data and create them again')
+    args = parser.parse_args()
+
+    with psycopg2.connect(database=database, user=user, password=password) as conn:
+        applied = create_tables(conn, reset=args.reset)
+        if applied:
+            print(f"Applied migrations: {', '.join(map(str, applied))}")
+        print(f"The database is at version {MIGRATIONS[-1][0]}")
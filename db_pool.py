@@ -0,0 +1,286 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import config
+
+# Необязательные настройки пула. Их можно переопределить в config.py
+POOL_MIN_SIZE = getattr(config, 'POOL_MIN_SIZE', 1)
+POOL_MAX_SIZE = getattr(config, 'POOL_MAX_SIZE', 10)
+POOL_TIMEOUT = getattr(config, 'POOL_TIMEOUT', 5.0)
+POOL_MAX_LIFETIME = getattr(config, 'POOL_MAX_LIFETIME', 1800.0)
+POOL_MAX_IDLE = getattr(config, 'POOL_MAX_IDLE', 60.0)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection became available within the pool timeout. The message contains the pool size, so it
+    is clear from the log that the pool is exhausted and not the database is unavailable.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are created lazily up to max_size. A connection that has been idle for longer than max_idle is checked
+    with "SELECT 1" before it is handed out, and a connection older than max_lifetime is closed and replaced.
+    If all connections are in use, getconn() waits up to timeout seconds and then raises PoolTimeout.
+
+    :param min_size: Number of connections kept open even when idle
+    :param max_size: Maximum number of connections
+    :param timeout: Maximum time in seconds to wait for a free connection
+    :param max_lifetime: Connections older than this number of seconds are recycled
+    :param max_idle: Connections idle for longer than this number of seconds are health checked before use
+    :param connect_kwargs: Arguments for psycopg2.connect()
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=5.0, max_lifetime=1800.0, max_idle=60.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.connect_kwargs = connect_kwargs
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (connection, время возврата в пул)
+        self._created_at = {}  # id(connection) -> время создания
+        # id(connection) -> {имя запроса: True - подготовлен на нём, False - сервер отказался} (см. prepared.py)
+        self._prepared = {}
+        self._size = 0
+        self._closed = False
+
+        self._stats = {
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'connections_broken': 0,
+            'acquired': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self._prepared[id(conn)] = {}
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, idle_since):
+        """
+        Checks the connection before it is handed out. Returns False if the connection has to be replaced.
+        Called without the lock of the pool: the check of an idle connection is a round trip to the server.
+        """
+        reason = None
+        now = time.monotonic()
+        if conn.closed:
+            reason = 'connections_broken'
+        elif now - self._created_at.get(id(conn), now) > self.max_lifetime:
+            reason = 'connections_recycled'
+        elif now - idle_since > self.max_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                reason = 'connections_broken'
+        if reason is None:
+            return True
+        with self._lock:
+            self._stats[reason] += 1
+        return False
+
+    def getconn(self):
+        """
+        Takes a connection from the pool. Opens a new one if the pool is not full, otherwise waits for a connection to
+        be returned.
+
+        :return: psycopg2 connection
+        """
+        wait_started = None
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # Место под соединение резервируем заранее, чтобы не держать блокировку во время connect()
+                        self._size += 1
+                        conn = None
+                        break
+                    now = time.monotonic()
+                    if wait_started is None:
+                        wait_started = now
+                        self._stats['waits'] += 1
+                    remaining = wait_started + self.timeout - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        self._stats['wait_time'] += now - wait_started
+                        raise PoolTimeout(f"No free connection after {self.timeout}s "
+                                          f"(pool size {self.max_size}, all in use)")
+                    self._lock.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                break
+            # Соединение уже снято с очереди свободных, поэтому проверяется без блокировки пула
+            if self._is_usable(conn, idle_since):
+                break
+            with self._lock:
+                self._discard(conn)
+                self._size -= 1
+                self._lock.notify()
+
+        with self._lock:
+            if wait_started is not None:
+                self._stats['wait_time'] += time.monotonic() - wait_started
+            self._stats['acquired'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns the connection to the pool. An open transaction is rolled back, broken connections are closed.
+
+        :param conn: Connection taken by getconn()
+        :param discard: Close the connection instead of returning it
+        :return: None
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._lock:
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager over getconn()/putconn(). If an OperationalError or InterfaceError escapes from the block,
+        the connection is considered broken and is not returned to the pool.
+        """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def fill(self):
+        """
+        Opens connections up to min_size. The threaded bot calls it at startup (main2.py), so that the first
+        requests do not pay for the connection setup.
+        """
+        with self._lock:
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        opened = 0
+        try:
+            while opened < missing:
+                conn = self._connect()
+                opened += 1
+                self.putconn(conn)
+        except Exception:
+            # Места, зарезервированные под так и не открытые соединения, возвращаются пулу
+            with self._lock:
+                self._size -= missing - opened
+            raise
+
+    def close(self):
+        """
+        Closes all idle connections. Connections that are in use are closed when they are returned.
+        """
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+                self._size -= 1
+            self._lock.notify_all()
+
+    def prepared(self, conn):
+        """
+        Returns the statements prepared on the connection: name -> True if the statement is prepared, False if the
+        server refused to prepare it. The dictionary is forgotten when the connection is closed, so a new connection
+        with the same id() starts with an empty one.
+
+        :param conn: Connection taken by getconn()
+        :return: Dictionary that the caller updates itself
+        """
+        return self._prepared.setdefault(id(conn), {})
+
+    def stats(self):
+        """
+        Returns the pool counters: how many connections are open and in use, how many times and for how long callers
+        had to wait for a connection, how many connections were recycled.
+
+        :return: Dictionary with the counters
+        """
+        with self._lock:
+            result = dict(self._stats)
+            result['size'] = self._size
+            result['idle'] = len(self._idle)
+            result['in_use'] = self._size - len(self._idle)
+        return result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the shared connection pool, creating it on first use with the settings from config.py.
+
+    :return: ConnectionPool
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                                       max_lifetime=POOL_MAX_LIFETIME, max_idle=POOL_MAX_IDLE,
+                                       database=config.database, user=config.user, password=config.password)
+    return _pool
+
+
+def pool_stats():
+    """
+    Returns the counters of the shared pool, or an empty dictionary if the pool has not been created yet.
+    """
+    return _pool.stats() if _pool is not None else {}
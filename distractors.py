@@ -0,0 +1,245 @@
+"""
+Choice of plausible wrong options for a card: words that look like the right answer.
+
+For every distinct word of the common dictionary (see vocabulary.py) three features are precomputed into NumPy
+arrays: the length, a rough part of speech guessed from the ending of the word and a 64-bit signature of its character
+bigrams and trigrams. The words are grouped into buckets by (part of speech, length). To choose the options for an
+answer, a random sample of the words of its bucket and of the neighbouring lengths is scored at once by the Jaccard
+similarity of the signatures minus a penalty for the difference in length, and the options are drawn from the best
+scored candidates, so the same answer does not always get the same options. The cost of a card does not depend on the
+size of the dictionary: about 0.1 ms for a million words, see benchmarks/bench_distractors.py.
+
+When the common dictionary is reloaded, only the words added at its end are processed.
+"""
+import random
+import threading
+import zlib
+from array import array
+
+import numpy as np
+
+from normalization import word_key
+
+# Части речи, которые угадываются по окончанию слова. Точность невысокая, но глагол среди вариантов-существительных
+# сразу выдаёт неправильный ответ, поэтому и грубого деления достаточно
+OTHER, NOUN, VERB, ADJECTIVE, ADVERB = range(5)
+
+RUSSIAN_ENDINGS = [
+    (VERB, ('ться', 'тись', 'ть', 'ти', 'чь')),
+    (ADJECTIVE, ('ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие')),
+    (ADVERB, ('о', 'е')),
+    (NOUN, ('а', 'я', 'ь', 'ие', 'ия', 'ость', 'ство', 'ние')),
+]
+ENGLISH_ENDINGS = [
+    (ADVERB, ('ly',)),
+    (NOUN, ('tion', 'sion', 'ness', 'ment', 'ity', 'ship', 'hood', 'er', 'or', 'ist')),
+    (ADJECTIVE, ('ful', 'ous', 'ive', 'able', 'ible', 'al', 'less', 'ic', 'ish')),
+    (VERB, ('ize', 'ise', 'ify', 'ate', 'en')),
+]
+
+# Слова длиннее считаются словами этой длины
+MAX_LENGTH = 32
+# Сколько кандидатов оценивается на одну карточку
+SAMPLE_SIZE = 256
+# На сколько уменьшается сходство за каждый символ разницы в длине
+LENGTH_PENALTY = 0.05
+
+# Число единичных битов в каждом байте
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def part_of_speech(word, english):
+    """
+    Guesses the part of speech of a word by its ending.
+
+    :param word: Word in lower case
+    :param english: True for an English word
+    :return: OTHER, NOUN, VERB, ADJECTIVE or ADVERB
+    """
+    if english and word.startswith('to '):
+        return VERB
+    for tag, endings in ENGLISH_ENDINGS if english else RUSSIAN_ENDINGS:
+        if word.endswith(endings):
+            return tag
+    return OTHER
+
+
+def ngram_signature(word):
+    """
+    Returns a 64-bit mask with one bit per character bigram and trigram of the word. crc32 is used instead of hash(),
+    which changes from process to process.
+    """
+    padded = f' {word} '
+    signature = 0
+    for size in (2, 3):
+        for i in range(len(padded) - size + 1):
+            signature |= 1 << (zlib.crc32(padded[i:i + size].encode()) & 63)
+    return signature
+
+
+def popcount(values):
+    """
+    Number of set bits of every element of a uint64 array.
+    """
+    return _POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+
+
+class DistractorIndex:
+    """
+    Features of the words of one language.
+
+    :param english: True for English words
+    :param sample_size: Number of candidates scored per card
+    """
+
+    def __init__(self, english, sample_size=SAMPLE_SIZE):
+        self.english = english
+        self.sample_size = sample_size
+        self.words = []
+        self.lengths = np.zeros(0, dtype=np.int16)
+        self.signatures = np.zeros(0, dtype=np.uint64)
+        self._buckets = {}  # (часть речи, длина) -> array номеров слов
+        self._lock = threading.Lock()  # Только для замены массивов целиком
+        self._update_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.words)
+
+    def features(self, word):
+        word = word_key(word)
+        return part_of_speech(word, self.english), min(len(word), MAX_LENGTH), ngram_signature(word)
+
+    def update(self, words):
+        """
+        Makes the index match the list of words. If the old words are the beginning of the new list, only the new
+        words are processed; otherwise the index is built again. The new arrays are built without the lock and
+        replace the old ones at once, so choose() is not delayed by the rebuild and never sees a half-built index.
+
+        :param words: List of distinct words
+        :return: Number of processed words
+        """
+        with self._update_lock:
+            with self._lock:
+                old_words, old_lengths, old_signatures, old_buckets = (self.words, self.lengths, self.signatures,
+                                                                       self._buckets)
+            start = len(old_words)
+            if words[:start] != old_words:
+                start = 0
+            new_words = words[start:]
+            tags, lengths, signatures = [], [], []
+            for word in new_words:
+                tag, length, signature = self.features(word)
+                tags.append(tag)
+                lengths.append(length)
+                signatures.append(signature)
+
+            if start == 0:
+                new_lengths = np.array(lengths, dtype=np.int16)
+                new_signatures = np.array(signatures, dtype=np.uint64)
+                buckets = {}
+            else:
+                new_lengths = np.concatenate([old_lengths, np.array(lengths, dtype=np.int16)])
+                new_signatures = np.concatenate([old_signatures, np.array(signatures, dtype=np.uint64)])
+                buckets = dict(old_buckets)
+            copied = set()  # Корзины старого индекса не меняются: choose() может читать их в это время
+            for position, key in enumerate(zip(tags, lengths), start):
+                if key not in copied:
+                    copied.add(key)
+                    buckets[key] = array('i', buckets.get(key, ()))
+                buckets[key].append(position)
+
+            with self._lock:
+                self.words, self.lengths, self.signatures, self._buckets = words, new_lengths, new_signatures, buckets
+            return len(new_words)
+
+    def _candidates(self, buckets, tag, length, rng):
+        """
+        Random numbers of words of the same part of speech and a similar length.
+        """
+        buckets = [buckets.get((tag, length + delta)) for delta in (0, -1, 1, -2, 2)]
+        buckets = [bucket for bucket in buckets if bucket]
+        size = sum(len(bucket) for bucket in buckets)
+        if size <= self.sample_size:
+            parts = [np.frombuffer(bucket, dtype=np.int32) for bucket in buckets]
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+        parts = []
+        for bucket in buckets:
+            # Из каждой корзины берём долю выборки, пропорциональную её размеру
+            count = max(1, self.sample_size * len(bucket) // size)
+            positions = rng.integers(0, len(bucket), count)
+            parts.append(np.frombuffer(bucket, dtype=np.int32)[positions])
+        return np.concatenate(parts)
+
+    def choose(self, answer, count, rng):
+        """
+        Chooses count distinct words that look like the answer and differ from it.
+
+        :param answer: Right answer of the card
+        :param count: Number of wrong options
+        :param rng: numpy.random.Generator
+        :return: List of words; shorter than count only if the dictionary is too small
+        """
+        tag, length, signature = self.features(answer)
+        with self._lock:
+            words, lengths, signatures, buckets = self.words, self.lengths, self.signatures, self._buckets
+        if not words:
+            return []
+        candidates = self._candidates(buckets, tag, length, rng)
+        if len(candidates) < count * 2:
+            extra = rng.integers(0, len(words), self.sample_size)
+            candidates = np.concatenate([candidates, extra.astype(np.int32)])
+        candidates = np.unique(candidates)
+        target = np.uint64(signature)
+        common = popcount(signatures[candidates] & target)
+        union = popcount(signatures[candidates] | target)
+        scores = common / np.maximum(union, 1) - LENGTH_PENALTY * np.abs(lengths[candidates] - length)
+
+        # Варианты берутся случайно из вдвое большего числа лучших кандидатов
+        best = min(len(candidates), count * 2 + 1)
+        top = candidates[np.argpartition(-scores, best - 1)[:best]] if best < len(candidates) else candidates
+        chosen = []
+        answer_key = word_key(answer)
+        for position in rng.permutation(top):
+            word = words[position]
+            if word_key(word) != answer_key and word not in chosen:
+                chosen.append(word)
+                if len(chosen) == count:
+                    break
+        return chosen
+
+
+class Distractors:
+    """
+    Wrong options for both directions of the cards, built over the words of vocabulary.SharedVocabulary.
+
+    :param sample_size: Number of candidates scored per card
+    """
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.russian = DistractorIndex(english=False, sample_size=sample_size)
+        self.english = DistractorIndex(english=True, sample_size=sample_size)
+        self._rng = threading.local()
+
+    def refresh(self, shared):
+        """
+        Updates the indexes after the common dictionary has been (re)loaded; it is passed to Vocabulary as
+        on_reload.
+
+        :param shared: vocabulary.SharedVocabulary
+        """
+        self.russian.update(shared.russian_words)
+        self.english.update(shared.english_words)
+
+    def choose(self, answer, count, to_russian=True):
+        """
+        :param answer: Right answer of the card
+        :param count: Number of wrong options
+        :param to_russian: True if the answer is a Russian word
+        :return: List of wrong options
+        """
+        rng = getattr(self._rng, 'generator', None)
+        if rng is None:
+            # У numpy.random.Generator нет блокировки, поэтому у каждого потока свой
+            rng = self._rng.generator = np.random.default_rng(random.getrandbits(64))
+        index = self.russian if to_russian else self.english
+        return index.choose(answer, count, rng)
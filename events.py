@@ -0,0 +1,210 @@
+"""
+Write-behind buffer of the events of the bot: answers to cards and added or deleted words.
+
+The handlers only put an event into a bounded in-memory queue and never wait for the database. A background thread
+collects the events and writes them with a few multi-row INSERTs in one transaction (see main.save_events) when
+batch_size events have been collected or flush_interval seconds after the first event of the batch, and the rest on
+close(). If the database falls behind and the queue fills up, new events are dropped and counted instead of slowing
+the bot down.
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    :param write_batch: Function (answers, reviews, stats, word_events) that writes one batch in one transaction:
+    answers - list of (user_id, all_words_id, correct, answered_at);
+    reviews - list of (user_id, all_words_id, due_at, interval, ease, repetitions), one per word;
+    stats - list of (user_id, right answers, wrong answers), one per user;
+    word_events - list of (user_id, action, word, happened_at), action is 'add' or 'delete'
+    :param max_events: Maximum number of events waiting in the queue
+    :param batch_size: Number of events that triggers a write
+    :param flush_interval: Maximum number of seconds an event waits for its batch
+    """
+
+    def __init__(self, write_batch, max_events=10000, batch_size=500, flush_interval=0.2):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_events)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # user_id -> {word_id: [последнее несохранённое повторение, число его событий в очереди и в записи]}
+        self._pending_reviews = {}
+        self._closed = False
+        self._stats = {'events': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'failed_batches': 0,
+                       'flush_seconds': 0.0, 'max_flush_seconds': 0.0, 'last_flush_seconds': 0.0}
+        self._thread = threading.Thread(target=self._run, name='event-buffer', daemon=True)
+        self._thread.start()
+
+    def _put(self, event, pending=None):
+        if self._closed:
+            return False
+        with self._lock:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self._stats['dropped'] += 1
+                return False
+            self._stats['events'] += 1
+            if pending is not None:
+                user_id, word_id, row = pending
+                entry = self._pending_reviews.setdefault(user_id, {}).setdefault(word_id, [row, 0])
+                entry[0] = row
+                entry[1] += 1
+        return True
+
+    def answer(self, user_id, word_id, correct, review=None, answered_at=None, words=None):
+        """
+        Adds the answer of the user to a card.
+
+        :param user_id: User ID
+        :param word_id: ID of the pair in all_words or None
+        :param correct: True if the answer is right
+        :param review: New repetition state of the word (user_id, all_words_id, due_at, interval, ease,
+        repetitions) or None
+        :param answered_at: Time of the answer (time.time())
+        :param words: (Russian word, English word) of the pair, returned with the review by pending_reviews()
+        :return: False if the event was dropped because the queue is full
+        """
+        answered_at = time.time() if answered_at is None else answered_at
+        event = ('answer', user_id, word_id, correct, answered_at, review)
+        pending = None
+        if review is not None:
+            russian, english = words or (None, None)
+            pending = (user_id, review[1], (review[1], russian, english) + tuple(review[2:]))
+        return self._put(event, pending)
+
+    def word_added(self, user_id, word, happened_at=None):
+        return self._put(('word', user_id, 'add', word, time.time() if happened_at is None else happened_at))
+
+    def word_deleted(self, user_id, word, happened_at=None):
+        return self._put(('word', user_id, 'delete', word, time.time() if happened_at is None else happened_at))
+
+    def pending_reviews(self, user_id):
+        """
+        Returns the repetition states of the user that are not written yet: the queued ones and the ones of the batch
+        being written. The database does not have them, so they are applied over the rows read from it.
+
+        :param user_id: User ID
+        :return: List of tuples (all_words ID, Russian word, English word, due_at, interval, ease, repetitions), the
+        latest state of every word; the words are None if answer() was called without them
+        """
+        with self._lock:
+            return [entry[0] for entry in self._pending_reviews.get(user_id, {}).values()]
+
+    def _collect(self, wait):
+        """
+        Takes up to batch_size events from the queue. With wait, waits for the first event and then up to
+        flush_interval seconds for the rest of the batch.
+        """
+        events = []
+        deadline = None
+        while len(events) < self.batch_size:
+            try:
+                if not wait:
+                    events.append(self._queue.get_nowait())
+                    continue
+                if deadline is None:
+                    events.append(self._queue.get(timeout=self.flush_interval))
+                    deadline = time.monotonic() + self.flush_interval
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                events.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def _write(self, events):
+        answers = []
+        reviews = {}
+        stats = {}
+        word_events = []
+        reviewed = []
+        for event in events:
+            if event[0] == 'answer':
+                _, user_id, word_id, correct, answered_at, review = event
+                if word_id is not None:
+                    # У карточек без пары из all_words (async_bot) ответ идёт только в статистику
+                    answers.append((user_id, word_id, correct, answered_at))
+                right_wrong = stats.setdefault(user_id, [0, 0])
+                right_wrong[0 if correct else 1] += 1
+                if review is not None:
+                    # Несколько ответов на одно слово в пачке дают одну запись в word_reviews
+                    reviews[review[:2]] = review
+                    reviewed.append((user_id, review[1]))
+            else:
+                word_events.append(event[1:])
+
+        started = time.perf_counter()
+        try:
+            self.write_batch(answers, list(reviews.values()),
+                             [(user_id, right, wrong) for user_id, (right, wrong) in stats.items()], word_events)
+            failed = False
+        except Exception as ex:
+            logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+            failed = True
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            for user_id, word_id in reviewed:
+                user_reviews = self._pending_reviews[user_id]
+                entry = user_reviews[word_id]
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del user_reviews[word_id]
+                    if not user_reviews:
+                        del self._pending_reviews[user_id]
+            if failed:
+                self._stats['failed_batches'] += 1
+                self._stats['dropped'] += len(events)
+                return
+            self._stats['batches'] += 1
+            self._stats['written'] += len(events)
+            self._stats['flush_seconds'] += elapsed
+            self._stats['last_flush_seconds'] = elapsed
+            self._stats['max_flush_seconds'] = max(self._stats['max_flush_seconds'], elapsed)
+
+    def _run(self):
+        while not (self._closed and self._queue.empty()):
+            with self._flush_lock:
+                events = self._collect(wait=True)
+                if events:
+                    self._write(events)
+
+    def flush(self):
+        """
+        Writes all queued events now. Waits for the batch the background thread is collecting, so after the call
+        every event put before it is in the database.
+        """
+        with self._flush_lock:
+            while True:
+                events = self._collect(wait=False)
+                if not events:
+                    return
+                self._write(events)
+
+    def close(self):
+        """
+        Stops accepting events and writes the queued ones.
+        """
+        self._closed = True
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        """
+        Returns the counters: accepted, dropped and written events, batches, failed batches, the total, maximum and
+        last flush time in seconds and the current length of the queue.
+        """
+        with self._lock:
+            result = dict(self._stats)
+        result['queued'] = self._queue.qsize()
+        return result
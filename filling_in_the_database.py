@@ -1,55 +1,317 @@
+"""
+Fills the common dictionary of the bot (english_words, russian_words, all_words).
+
+Without arguments the small starter dictionary SEED_WORDS is loaded. Dictionary files are loaded with
+
+    python3 filling_in_the_database.py words.csv more_words.tsv big_dictionary.jsonl
+
+CSV and TSV files have the English word in the first column and the Russian one in the second; a header line with
+the columns "english" and "russian" is recognised and then the columns may go in any order. JSONL files have one
+object {"english": ..., "russian": ...} per line.
+
+The file is read as a stream and loaded in batches: every batch is sent with COPY into a temporary staging table and
+is moved to the dictionary tables with a few set-based INSERT ... SELECT statements, so the memory does not depend on
+the size of the file. After each batch the number of loaded rows is saved in the import_progress table in the same
+transaction, and an interrupted import continues from the first unsaved batch when it is started again. A batch
+that adds pairs also increases the version of the dictionary, so that running bots reload it.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
 import psycopg2
 from config import password, database, user
 
-with psycopg2.connect(database=database, user=user, password=password) as conn:
-    with conn.cursor() as cur:
-        cur.execute("""
-                    INSERT INTO english_words (word)
-                    VALUES
-                    ('Hello'),
-                    ('Apple'),
-                    ('Orange'),
-                    ('Pumpkin'),
-                    ('Banana'),
-                    ('Milk'),
-                    ('Table'),
-                    ('Chair'),
-                    ('Water'),
-                    ('Drink'),
-                    ('Mango');
-        """)
-
-        cur.execute("""
-                    INSERT INTO russian_words (word)
-                    VALUES
-                    ('Привет'),
-                    ('Яблоко'),
-                    ('Оранжевый'),
-                    ('Тыква'),
-                    ('Банан'),
-                    ('Молоко'),
-                    ('Стол'),
-                    ('Стул'),
-                    ('Вода'),
-                    ('Пить'),
-                    ('Манго');
-        """)
-
-        cur.execute("""
-                    INSERT INTO all_words (english_words_id, russian_words_id)
-                    VALUES
-                    (1, 1),
-                    (2, 2),
-                    (3, 3),
-                    (4, 4),
-                    (5, 5),
-                    (6, 6),
-                    (7, 7),
-                    (8, 8),
-                    (9, 9),
-                    (10, 10),
-                    (11, 11);
-        """)
+from migrations import migrate
+from normalization import clean_word
+from normalize_words import normalize_words
+
+SEED_WORDS = [
+    ('Hello', 'Привет'),
+    ('Apple', 'Яблоко'),
+    ('Orange', 'Оранжевый'),
+    ('Pumpkin', 'Тыква'),
+    ('Banana', 'Банан'),
+    ('Milk', 'Молоко'),
+    ('Table', 'Стол'),
+    ('Chair', 'Стул'),
+    ('Water', 'Вода'),
+    ('Drink', 'Пить'),
+    ('Mango', 'Манго'),
+]
+
+# Длина столбца word в english_words и russian_words
+MAX_WORD_LENGTH = 60
+BATCH_SIZE = 50_000
+
+CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS import_staging(
+    english TEXT NOT NULL,
+    russian TEXT NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Все три запроса работают со всем пакетом сразу. Слова сравниваются по нормализованному ключу word_key
+# (см. normalization.py). DISTINCT ON убирает повторы внутри пакета, NOT EXISTS - слова и пары, которые уже есть в
+# словаре, ON CONFLICT - слова, которые одновременно добавил кто-то другой
+UPSERT_ENGLISH_WORDS = """
+    INSERT INTO english_words (word)
+    SELECT DISTINCT ON (word_key(english)) english FROM import_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM english_words en_w WHERE en_w.word_key = word_key(s.english))
+    ON CONFLICT DO NOTHING
+"""
+
+UPSERT_RUSSIAN_WORDS = """
+    INSERT INTO russian_words (word)
+    SELECT DISTINCT ON (word_key(russian)) russian FROM import_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM russian_words rus_w WHERE rus_w.word_key = word_key(s.russian))
+    ON CONFLICT DO NOTHING
+"""
+
+BUMP_VOCABULARY_VERSION = """
+    UPDATE vocabulary_version SET version = version + 1
+"""
+
+UPSERT_PAIRS = """
+    INSERT INTO all_words (english_words_id, russian_words_id)
+    SELECT DISTINCT en_w.id, rus_w.id
+    FROM import_staging s
+    JOIN english_words en_w ON en_w.word_key = word_key(s.english)
+    JOIN russian_words rus_w ON rus_w.word_key = word_key(s.russian)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM all_words all_w
+        WHERE all_w.english_words_id = en_w.id
+        AND all_w.russian_words_id = rus_w.id
+    )
+"""
+
+
+# Определяем формат файла по расширению
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.tsv', '.tab'):
+        return 'tsv'
+    return 'csv'
+
+
+# Читаем строки файла по одной
+def read_pairs(path, file_format):
+    """
+    Generator of the word pairs of a dictionary file. Only one line of the file is in memory at a time.
+
+    :param path: Path to the file
+    :param file_format: 'csv', 'tsv' or 'jsonl'
+    :return: Iterator of tuples (English word, Russian word); a malformed line gives None, so that the line numbers
+    stay the same for resuming
+    """
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        if file_format == 'jsonl':
+            for line in file:
+                try:
+                    item = json.loads(line)
+                    yield item['english'], item['russian']
+                except (ValueError, KeyError, TypeError):
+                    yield None
+            return
+
+        reader = csv.reader(file, delimiter='\t' if file_format == 'tsv' else ',')
+        first = next(reader, None)
+        if first is None:
+            return
+        columns = [cell.strip().lower() for cell in first]
+        if 'english' in columns and 'russian' in columns:
+            english, russian = columns.index('english'), columns.index('russian')
+            yield None  # Заголовок тоже считается строкой файла
+        else:
+            english, russian = 0, 1
+            reader = itertools.chain([first], reader)
+        for row in reader:
+            try:
+                yield row[english], row[russian]
+            except IndexError:
+                yield None
+
+
+# Отбрасываем пустые и слишком длинные слова
+def clean_pairs(pairs, stats):
+    """
+    Cleans the words (see normalization.clean_word) and drops pairs that cannot be loaded. The dropped pairs are
+    counted in stats['skipped'].
+
+    :param pairs: Iterator from read_pairs()
+    :param stats: Dictionary with counters
+    :return: Iterator of tuples (English word, Russian word)
+    """
+    for pair in pairs:
+        stats['read'] += 1
+        if pair is not None:
+            english, russian = (clean_word(str(word)) for word in pair)
+            if english and russian and len(english) <= MAX_WORD_LENGTH and len(russian) <= MAX_WORD_LENGTH:
+                yield english, russian
+                continue
+        stats['skipped'] += 1
+        yield None
+
 
+# Делим поток пар на пакеты
+def batches(pairs, size):
+    """
+    Splits the stream of pairs into lists of at most size lines of the file.
+    """
+    iterator = iter(pairs)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_escape(word):
+    """
+    Escapes a word for the text format of COPY.
+    """
+    return word.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# Загружаем пакет во временную таблицу и переносим его в словарь
+def load_batch(cur, batch):
+    """
+    Loads one batch into the dictionary.
+
+    Explanation of the SQL queries:
+    1. COPY sends the whole batch to the temporary table import_staging in one round trip.
+    2. New English and Russian words are inserted, the existing ones are skipped by ON CONFLICT.
+    3. New pairs are inserted by joining the batch with both word tables.
+    4. import_staging is emptied on commit (ON COMMIT DELETE ROWS).
+
+    :param cur: cursor for working with the database
+    :param batch: List of tuples (English word, Russian word) or None
+    :return: Tuple (new English words, new Russian words, new pairs)
+    """
+    buffer = io.StringIO()
+    for pair in batch:
+        if pair is not None:
+            buffer.write(f"{copy_escape(pair[0])}\t{copy_escape(pair[1])}\n")
+    buffer.seek(0)
+    cur.copy_expert("COPY import_staging (english, russian) FROM STDIN", buffer)
+    counts = []
+    for query in (UPSERT_ENGLISH_WORDS, UPSERT_RUSSIAN_WORDS, UPSERT_PAIRS):
+        cur.execute(query)
+        counts.append(cur.rowcount)
+    return tuple(counts)
+
+
+# Сколько строк файла уже загружено
+def rows_done(cur, source, file_size):
+    """
+    Returns the number of lines of the file loaded by a previous run, or 0 if the file is new or has changed since.
+    """
+    cur.execute("""
+        SELECT file_size, rows_done, finished
+        FROM import_progress
+        WHERE source = %s
+    """, (source,))
+    row = cur.fetchone()
+    if row is None or row[0] != file_size:
+        return 0
+    return None if row[2] else row[1]
+
+
+def save_progress(cur, source, file_size, done, finished=False):
+    cur.execute("""
+        INSERT INTO import_progress (source, file_size, rows_done, finished)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (source) DO UPDATE
+        SET file_size = EXCLUDED.file_size, rows_done = EXCLUDED.rows_done, finished = EXCLUDED.finished,
+        updated_at = now()
+    """, (source, file_size, done, finished))
+
+
+def import_pairs(conn, pairs, source=None, file_size=0, batch_size=BATCH_SIZE, restart=False):
+    """
+    Loads a stream of word pairs into the dictionary, one transaction per batch.
+
+    :param conn: psycopg2 connection
+    :param pairs: Iterator of tuples (English word, Russian word); None stands for a line that cannot be loaded
+    :param source: Name of the source for import_progress; None - do not save the progress
+    :param file_size: Size of the source file; if it changes, the file is loaded from the beginning
+    :param batch_size: Number of lines per batch
+    :param restart: Ignore the saved progress and load the source from the beginning
+    :return: Dictionary with counters
+    """
+    stats = {'read': 0, 'skipped': 0, 'english_words': 0, 'russian_words': 0, 'pairs': 0}
+    with conn.cursor() as cur:
+        cur.execute(CREATE_STAGING)
+        start = 0
+        if source is not None and not restart:
+            start = rows_done(cur, source, file_size)
+            if start is None:
+                print(f"{source}: already loaded, use --restart to load it again")
+                conn.commit()
+                return stats
+            if start:
+                print(f"{source}: resuming after line {start}")
         conn.commit()
-# Далее тут будет добавлена функция чтения csv файла со словами и добавление их в базу данных
+
+        pairs = itertools.islice(pairs, start, None)
+        started = time.perf_counter()
+        done = start
+        for batch in batches(clean_pairs(pairs, stats), batch_size):
+            counts = load_batch(cur, batch)
+            done += len(batch)
+            if counts[2]:
+                # Боты перечитают общий словарь, когда увидят новую версию (см. vocabulary.py)
+                cur.execute(BUMP_VOCABULARY_VERSION)
+            if source is not None:
+                save_progress(cur, source, file_size, done)
+            conn.commit()
+            for name, count in zip(('english_words', 'russian_words', 'pairs'), counts):
+                stats[name] += count
+            elapsed = time.perf_counter() - started
+            print(f"{source or 'seed'}: {done} lines, {stats['read'] / elapsed:.0f} rows/s", file=sys.stderr)
+        if source is not None:
+            save_progress(cur, source, file_size, done, finished=True)
+            conn.commit()
+        stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def import_file(conn, path, file_format=None, batch_size=BATCH_SIZE, restart=False):
+    """
+    Loads a CSV, TSV or JSONL dictionary file, see import_pairs().
+    """
+    file_format = file_format or detect_format(path)
+    return import_pairs(conn, read_pairs(path, file_format), source=os.path.abspath(path),
+                        file_size=os.path.getsize(path), batch_size=batch_size, restart=restart)
+
+
+def report(name, stats):
+    seconds = stats.get('seconds') or 0
+    rate = f", {stats['read'] / seconds:.0f} rows/s" if seconds else ''
+    print(f"{name}: {stats['read']} rows read, {stats['skipped']} skipped, {stats['english_words']} new English "
+          f"words, {stats['russian_words']} new Russian words, {stats['pairs']} new pairs{rate}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='dictionary files; without them the starter dictionary is loaded')
+    parser.add_argument('--format', choices=['csv', 'tsv', 'jsonl'], help='format of the files (by default it is '
+                                                                           'chosen by the extension)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='lines per COPY batch')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved progress and load the files again')
+    args = parser.parse_args()
+
+    with psycopg2.connect(database=database, user=user, password=password) as conn:
+        migrate(conn)
+        normalize_words(conn)  # Новые слова сравниваются с существующими по word_key
+        if not args.files:
+            report('seed', import_pairs(conn, iter(SEED_WORDS)))
+        for path in args.files:
+            report(path, import_file(conn, path, args.format, batch_size=args.batch_size, restart=args.restart))
@@ -0,0 +1,247 @@
+"""
+Logging of the bot.
+
+The handlers and the database functions only create log records and put them into a bounded queue (QueueHandler); the
+records are formatted and written by one background thread (QueueListener), so a slow console or file never delays a
+reply. When the queue is full a record is dropped and counted instead of blocking the handler. The records that do not
+pass the level of their logger or the sampling are never formatted. The message of a record that passes is merged with
+its %-arguments in the thread of the handler, so a dictionary changed after the call is logged as it was; the rest of
+the formatting and the values wrapped in Lazy are left to the background thread.
+
+Structured records are created with event(): the name of the event and its fields (chat_id, handler, latency_ms,
+outcome...) are written as key=value pairs or as one JSON object per line. Frequent events can be sampled: with
+LOG_SAMPLING = {'handler': 0.01} in config.py only every hundredth record of the handler event is written. Warnings and
+errors are never sampled. The levels are set per module (the name of the logger) with LOG_LEVELS:
+
+    LOG_LEVELS = {'': 'INFO', 'TeleBot': 'WARNING', 'main': 'ERROR', 'router': 'DEBUG'}
+
+    logs = setup_logging(levels=config.LOG_LEVELS, sampling=config.LOG_SAMPLING)
+    ...
+    logs.stop()  # Записывает оставшиеся записи
+"""
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+
+# Уровни логгеров по умолчанию: отладочные сообщения telebot о каждом запросе к API не пишутся
+LEVELS = {'': 'INFO', 'TeleBot': 'WARNING'}
+
+# Доля записываемых записей событий по умолчанию: каждое сообщение пользователя даёт событие handler
+SAMPLING = {'handler': 0.01}
+
+# Текущие доли записываемых записей: событие -> доля от 0 до 1
+_sampling = dict(SAMPLING)
+
+
+class Lazy:
+    """
+    Value of a field of a record that is computed only when the record is written, for example
+    event(logger, 'card', card=Lazy(lambda: repr(card))). The function runs in the background thread, so it must not
+    read objects the handler changes after the call.
+    """
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        return self.func()
+
+    def __repr__(self):
+        return repr(self.func())
+
+
+def event(logger, name, level=logging.INFO, **fields):
+    """
+    Logs the structured record of the event name with the fields, if the level is enabled for the logger and the record
+    passes the sampling of the event.
+
+    :param logger: logging.Logger of the module
+    :param name: Name of the event, the message of the record
+    :param level: Level of the record; records of level WARNING and higher are never sampled
+    :return: True if the record was logged
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    if level < logging.WARNING:
+        share = _sampling.get(name, 1.0)
+        if share < 1.0 and random.random() >= share:
+            return False
+    logger.log(level, name, extra={'fields': fields}, stacklevel=2)
+    return True
+
+
+def set_sampling(sampling):
+    """
+    Replaces the shares of the written records of the events.
+
+    :param sampling: Dictionary name of the event -> share from 0 to 1; the events not in it are not sampled
+    """
+    _sampling.clear()
+    _sampling.update(sampling)
+
+
+def chat_id(update):
+    """
+    :return: ID of the chat of a message or of the message of a callback query, None if there is none
+    """
+    message = update if hasattr(update, 'chat') else getattr(update, 'message', None)
+    chat = getattr(message, 'chat', None)
+    return None if chat is None else chat.id
+
+
+def handler_event(logger, handler, update, seconds, outcome):
+    """
+    Logs the handler event: the chat, the handler, its time and outcome ('ok' or 'error'). An error is logged as a
+    warning, so it is never sampled.
+
+    :param logger: logging.Logger of the module
+    :param handler: Name of the handler
+    :param update: telebot.types.Message or telebot.types.CallbackQuery
+    :param seconds: Time of the handler
+    :param outcome: 'ok' or 'error'
+    """
+    level = logging.INFO if outcome == 'ok' else logging.WARNING
+    if logger.isEnabledFor(level):
+        event(logger, 'handler', level, chat_id=chat_id(update), handler=handler, latency_ms=round(seconds * 1000, 3),
+              outcome=outcome)
+
+
+def logged(logger):
+    """
+    Decorator that logs the handler event (handler_event) for every call of a handler of an update.
+
+    :param logger: logging.Logger of the module of the handler
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper(update, *args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(update, *args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                handler_event(logger, name, update, time.perf_counter() - started, outcome)
+        return wrapper
+    return decorator
+
+
+def _text(value):
+    text = str(value)
+    if not text or any(char in text for char in ' "=\n'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record as "time level logger message key=value ..." or, with json_lines, as one JSON object.
+    The values wrapped in Lazy are computed here.
+
+    :param json_lines: Write every record as a JSON object
+    """
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                  'message': record.getMessage()}
+        if record.levelno >= logging.WARNING and not hasattr(record, 'fields'):
+            fields['function'] = record.funcName
+        for key, value in getattr(record, 'fields', {}).items():
+            fields[key] = value() if isinstance(value, Lazy) else value
+        if record.exc_info:
+            fields['exception'] = self.formatException(record.exc_info)
+        if self.json_lines:
+            return json.dumps(fields, ensure_ascii=False, default=repr)
+        head = f"{fields.pop('time')} {fields.pop('level')} {fields.pop('logger')} {fields.pop('message')}"
+        exception = fields.pop('exception', None)
+        text = ' '.join([head] + [f'{key}={_text(value)}' for key, value in fields.items()])
+        return text if exception is None else text + '\n' + exception
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the thread that logs: if the queue is full, the record is dropped and counted.
+    Only the message is merged with its arguments here; the record is formatted by the listener thread.
+    """
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы подставляются сразу: изменяемый аргумент (состояние, карточка) может измениться до записи.
+        # Остальное форматирование (время, поля, JSON) делает поток записи
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogQueue:
+    """
+    Queue of the records and the thread that writes them, created by setup_logging().
+    """
+
+    def __init__(self, handler, listener):
+        self.handler = handler
+        self.listener = listener
+
+    def stats(self):
+        return {'queued': self.handler.queue.qsize(), 'dropped': self.handler.dropped}
+
+    def stop(self):
+        """
+        Writes the records that are still in the queue and stops the thread.
+        """
+        self.listener.stop()
+
+
+def setup_logging(levels=None, sampling=None, json_lines=False, stream=None, max_records=10000):
+    """
+    Sends all records of the process through a bounded queue to a background thread that writes them to the stream.
+
+    :param levels: Dictionary name of the logger -> level, '' - the root logger; by default LEVELS
+    :param sampling: Dictionary name of the event -> share of the records that are written; by default SAMPLING
+    :param json_lines: Write every record as a JSON object instead of key=value pairs
+    :param stream: Stream to write to, by default sys.stderr
+    :param max_records: Size of the queue; the records that do not fit are dropped
+    :return: LogQueue
+    """
+    records = queue.Queue(max_records)
+    handler = NonBlockingQueueHandler(records)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(StructuredFormatter(json_lines))
+    listener = QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    # telebot пишет в консоль своим обработчиком, его записи идут через общую очередь
+    telebot_logger = logging.getLogger('TeleBot')
+    for old in list(telebot_logger.handlers):
+        telebot_logger.removeHandler(old)
+    for name, level in (LEVELS if levels is None else levels).items():
+        logging.getLogger(name or None).setLevel(level.upper() if isinstance(level, str) else level)
+    set_sampling(SAMPLING if sampling is None else sampling)
+
+    listener.start()
+    return LogQueue(handler, listener)
@@ -1,7 +1,17 @@
-import psycopg2
-from config import password, database, user
+import logging
+import time
 from functools import wraps
 
+from psycopg2.extras import execute_values
+
+import queries
+from db_pool import get_pool
+from metrics import db_histograms
+from normalization import clean_word
+from prepared import execute
+
+logger = logging.getLogger(__name__)
+
 """
 Хотел тут добавить traceback.
 P.S. : Сделаю это чутка позже :)
@@ -11,11 +21,29 @@ P.S. : Сделаю это чутка позже :)
 
 
 def db_connection(func):
+    """
+    Decorator that takes a connection from the shared pool (see db_pool.py), passes a cursor to the function as
+    the first argument and returns the connection to the pool afterwards. The transaction is committed if the function
+    completes without an exception and rolled back otherwise.
+    The time of taking the connection and the time of the function with the commit are recorded separately in the
+    histograms bot_db_acquire_seconds and bot_db_query_seconds (see metrics.py).
+    The functions run the statements of queries.PREPARED with prepared.execute(): they are prepared once per pooled
+    connection and then sent as EXECUTE with the parameters.
+    """
+    acquire_histogram, query_histogram = db_histograms(func.__name__)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        with psycopg2.connect(database=database, user=user, password=password) as conn:
-            with conn.cursor() as cur:
-                return func(cur, *args, **kwargs)
+        started = time.perf_counter()
+        with get_pool().connection() as conn:
+            acquired = time.perf_counter()
+            acquire_histogram.observe(acquired - started)
+            try:
+                with conn:
+                    with conn.cursor() as cur:
+                        return func(cur, *args, **kwargs)
+            finally:
+                query_histogram.observe(time.perf_counter() - acquired)
     return wrapper
 
 
@@ -25,42 +53,35 @@ def random_words_from_db(cur, user_id):
     """
     The function selects a random word from the database for the specified user.
     It connects to the database, executes an SQL query to select a random word that has not yet been presented to the
-    user, and returns this word. If an exception occurs, the function prints information about the exception.
+    user, and returns this word. If an exception occurs, the function logs information about the exception.
+
+    The query does not sort the whole vocabulary. It takes a random id between min(id) and max(id) of all_words and
+    reads the first visible pair starting from it through the primary key index, so the cost of a card does not depend
+    on the size of the dictionary.
 
     Explanation of the SQL query:
 
-    1. Extracts a couple of words: rus_w.word - Russian word, en_w.word - English word.
-    2. Joins the russian_words table to establish associations with the Russian word.
-    3. Joins the all_words table to link the Russian word with the corresponding English word.
-    4. Joins the english_words table to get the English word.
-    5. Uses FULL OUTER JOIN with the user_words table to activate words that may not have associations with this user.
-    6. Apply the condition to account for the specified user (u_w.user_id = %s OR u_w.user_id is NULL).
-    7. Sort the result randomly (ORDER BY random()).
-    8. Set the result limit to 1 (LIMIT 1).
+    1. The bounds CTE reads min(id) and max(id) of all_words (both come from the primary key index).
+    2. The start CTE picks a random id between them.
+    3. Extracts a couple of words: rus_w.word - Russian word, en_w.word - English word, joining russian_words and
+    english_words to all_words.
+    4. Keeps only the pairs visible to the user: shared pairs (without rows in user_words) and the user's own pairs.
+    5. Takes the first such pair with all_w.id >= start (ORDER BY all_w.id LIMIT 1).
+    6. If the random id fell behind the last visible pair, the second part of UNION ALL wraps around and takes the
+    first visible pair of the table.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
     :return: A random word from database, or None if no words are found or en error occurs
     """
     try:
-        cur.execute("""
-            SELECT rus_w.word AS rw, en_w.word AS ew
-            FROM russian_words rus_w
-            JOIN all_words all_w ON all_w.russian_words_id = rus_w.id
-            JOIN english_words en_w ON en_w.id = all_w.english_words_id
-            FULL OUTER JOIN user_words u_w ON u_w.all_words_id = all_w.id
-            WHERE u_w.user_id = %s OR u_w.user_id is NULL
-            ORDER BY random()
-            LIMIT 1;
-        """, (user_id,))
+        execute(cur, queries.RANDOM_WORDS, {'user_id': user_id})
         return cur.fetchone()
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
@@ -70,20 +91,24 @@ def random_english_words(cur, word_to_avoid, user_id):
     The function selects four random English words from the database that do not match the specified word and have
     not yet been presented to the user.
     It connects to the database, executes an SQL query to select the words, and returns them as a list.
-    If an exception occurs, the function prints information about the exception.
+    If an exception occurs, the function logs information about the exception.
+
+    Like random_words_from_db, the query reads words from random points of the all_words primary key instead of
+    sorting the whole vocabulary.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT operator, extract the English word en_w.word from the english_words table.
-    2. Join the all_words table to establish an association with Russian words.
-    3. Establish a FULL OUTER JOIN with the user_words table to activate words that may not have associations.
-    4. Apply a condition to exclude a certain word (en_w.word!= %s). We also take into account the specified user
-    (u_w.user_id = %s OR u_w.user_id is NULL)
-    5. Sort the result randomly (ORDER BY random()).
+    1. The probes CTE generates several random ids between min(id) and max(id) of all_words.
+    2. For every random id, the LATERAL subquery takes the English word en_w.word of the first pair visible to the
+    user (shared or the user's own) with all_w.id >= this id.
+    3. The second part of UNION ALL adds the first few visible words of the table with a lower priority. They are used
+    only if the random points gave too few different words (small dictionaries).
+    4. Exclude a certain word (word != %(word_to_avoid)s) and duplicates (GROUP BY word).
+    5. Random words go first, then the fallback ones (ORDER BY min(priority), random()).
     6. Set the result limit to 4 (LIMIT 4).
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param word_to_avoid: The word that should not be selected
@@ -92,22 +117,13 @@ def random_english_words(cur, word_to_avoid, user_id):
     """
     output_words = []
     try:
-        cur.execute("""
-            SELECT en_w.word
-            FROM english_words en_w
-            JOIN all_words all_w ON all_w.english_words_id = en_w.id
-            FULL OUTER JOIN user_words u_w ON u_w.all_words_id = all_w.id
-            WHERE en_w.word != %s AND (u_w.user_id = %s OR u_w.user_id is NULL)
-            ORDER BY random()
-            LIMIT 4;
-        """, (word_to_avoid, user_id))
+        execute(cur, queries.RANDOM_ENGLISH_WORDS, {'user_id': user_id, 'word_to_avoid': word_to_avoid, 'limit': 4,
+                                                  'probes': 4 * queries.PROBES_PER_WORD})
         for row_list in cur.fetchall():
             output_words.append(row_list[0])
         return output_words
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
@@ -117,20 +133,23 @@ def random_russian_words(cur, word_to_avoid, user_id):
     The function selects four random Russian words from the database that do not match the specified word and have
     not yet been presented to the user.
     It connects to the database, executes an SQL query to select the words, and returns them as a list.
-    If an exception occurs, the function prints information about the exception.
+    If an exception occurs, the function logs information about the exception.
+
+    The query is the same as in random_english_words, only the words are taken from the russian_words table.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT operator, extract the Russian word rus_w.word from the russian_words table.
-    2. Join the all_words table to establish an association with English words.
-    3. Establish a FULL OUTER JOIN with the user_words table to activate words that may not have associations.
-    4. Apply a condition to exclude a certain word (rus_w.word != %s). We also take into account the specified user
-    (u_w.user_id = %s OR u_w.user_id is NULL)
-    5. Sort the result randomly (ORDER BY random()).
+    1. The probes CTE generates several random ids between min(id) and max(id) of all_words.
+    2. For every random id, the LATERAL subquery takes the Russian word rus_w.word of the first pair visible to the
+    user (shared or the user's own) with all_w.id >= this id.
+    3. The second part of UNION ALL adds the first few visible words of the table with a lower priority. They are used
+    only if the random points gave too few different words (small dictionaries).
+    4. Exclude a certain word (word != %(word_to_avoid)s) and duplicates (GROUP BY word).
+    5. Random words go first, then the fallback ones (ORDER BY min(priority), random()).
     6. Set the result limit to 4 (LIMIT 4).
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param word_to_avoid: The word that should not be selected
@@ -139,22 +158,148 @@ def random_russian_words(cur, word_to_avoid, user_id):
     """
     output_words = []
     try:
-        cur.execute("""
-            SELECT rus_w.word
-            FROM russian_words rus_w
-            JOIN all_words all_w ON all_w.russian_words_id = rus_w.id
-            FULL OUTER JOIN user_words u_w ON u_w.all_words_id = all_w.id
-            WHERE rus_w.word != %s AND (u_w.user_id = %s OR u_w.user_id is NULL)
-            ORDER BY random()
-            LIMIT 4;
-        """, (word_to_avoid, user_id))
+        execute(cur, queries.RANDOM_RUSSIAN_WORDS, {'user_id': user_id, 'word_to_avoid': word_to_avoid, 'limit': 4,
+                                                  'probes': 4 * queries.PROBES_PER_WORD})
         for row_list in cur.fetchall():
             output_words.append(row_list[0])
         return output_words
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+
+@db_connection
+# Получение карточки целиком: слово, его перевод и варианты ответа за один запрос к базе данных
+def build_card(cur, user_id, to_russian=True):
+    """
+    The function builds a whole flashcard for the specified user in one round trip to the database: the word that
+    the user has to choose (the answer), its translation that is shown in the message (the prompt) and four other
+    words of the same language for the remaining buttons.
+    It replaces the pair of calls random_words_from_db + random_russian_words (or random_english_words), which needed
+    two connections and ran the sampling query twice.
+    If an exception occurs, the function logs information about the exception.
+
+    Explanation of the SQL query:
+
+    1. The bounds, start and probes CTEs generate random ids between min(id) and max(id) of all_words, the same way
+    as in random_words_from_db and random_russian_words.
+    2. The card CTE takes the first pair visible to the user with all_w.id >= start (with a wrap-around to the first
+    visible pair of the table) and returns its answer and prompt words.
+    3. The candidates CTE collects words of the answer language from the random probes, plus the first few visible
+    words of the table with a lower priority for small dictionaries.
+    4. The final SELECT returns the answer, the prompt and an array of four distinct candidates that differ from
+    the answer.
+
+    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
+    detailed information about them to the log of the module (see logs.py) for debugging.
+
+    :param cur: cursor for working with the database
+    :param user_id: User ID
+    :param to_russian: If True, the user chooses a Russian word for an English prompt, otherwise vice versa
+    :return: Tuple (answer word, prompt word, list of other words), or None if no words are found or an error occurs
+    """
+    try:
+        sql = queries.BUILD_CARD_TO_RUSSIAN if to_russian else queries.BUILD_CARD_TO_ENGLISH
+        execute(cur, sql, {'user_id': user_id, 'limit': 4, 'probes': 4 * queries.PROBES_PER_WORD})
+        return cur.fetchone()
+    except Exception as ex:
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+
+@db_connection
+# Получение пачки случайных пар слов для очереди карточек (см. card_queue.py)
+def random_pairs_from_db(cur, user_id, count):
+    """
+    The function selects up to count distinct random word pairs visible to the specified user in one query.
+    The card queue builds whole cards from them: the distractors of a card are taken from the other pairs of the same
+    batch, so one query is enough for a batch of cards.
+    If an exception occurs, the function logs information about the exception.
+
+    Explanation of the SQL query:
+
+    1. The probes CTE generates random ids between min(id) and max(id) of all_words, as in random_russian_words.
+    2. For every random id, the LATERAL subquery takes the first pair visible to the user with all_w.id >= this id.
+    3. The second part of UNION ALL adds the first visible pairs of the table with a lower priority for small
+    dictionaries.
+    4. Duplicates are removed (GROUP BY all_w.id), random pairs go first (ORDER BY min(priority), random()).
+
+    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
+    detailed information about them to the log of the module (see logs.py) for debugging.
+
+    :param cur: cursor for working with the database
+    :param user_id: User ID
+    :param count: Number of pairs
+    :return: List of tuples (all_words ID, Russian word, English word), or None if an error occurs
+    """
+    try:
+        execute(cur, queries.RANDOM_PAIRS, {'user_id': user_id, 'count': count, 'probes': count * 2})
+        return cur.fetchall()
+    except Exception as ex:
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+
+@db_connection
+# Загрузка общего словаря в память (см. vocabulary.py)
+def load_shared_vocabulary(cur, add):
+    """
+    The function reads all common word pairs (pairs that are not linked to any user) for vocabulary.Vocabulary.
+    The rows are read with a server-side cursor in portions of itersize rows, so the client does not hold the whole
+    result at once. Exceptions are not caught: Vocabulary keeps the previous table if the load fails.
+
+    Explanation of the SQL query:
+
+    1. Using the SELECT operator, we read the version of the dictionary from vocabulary_version first, so that a
+    change made during the load is noticed by the next check.
+    2. Using the SELECT operator with NOT EXISTS, we read all pairs of all_words without links in user_words, joined
+    with their Russian and English words.
+
+    :param cur: cursor for working with the database
+    :param add: Function (all_words ID, Russian word, English word) called for every pair
+    :return: Version of the dictionary
+    """
+    execute(cur, queries.VOCABULARY_VERSION)
+    version = cur.fetchone()[0]
+    with cur.connection.cursor(name='shared_vocabulary') as pairs:
+        pairs.itersize = 20000
+        pairs.execute(queries.SHARED_PAIRS)
+        for word_id, russian, english in pairs:
+            add(word_id, russian, english)
+    return version
+
+
+@db_connection
+# Текущая версия общего словаря
+def vocabulary_version(cur):
+    """
+    The function returns the version of the common dictionary. Exceptions are not caught, see load_shared_vocabulary.
+
+    :param cur: cursor for working with the database
+    :return: Version number
+    """
+    execute(cur, queries.VOCABULARY_VERSION)
+    return cur.fetchone()[0]
+
+
+@db_connection
+# Пары слов, добавленные пользователем
+def user_pairs_from_db(cur, user_id):
+    """
+    The function selects the word pairs added by the user, which vocabulary.Vocabulary merges with the common pairs.
+    If an exception occurs, the function logs information about the exception.
+
+    Explanation of the SQL query:
+
+    1. Using the SELECT operator, we take the links of the user from user_words (the unique index on user_id,
+    all_words_id) and join them with the pairs and their words.
+
+    :param cur: cursor for working with the database
+    :param user_id: User ID
+    :return: List of tuples (all_words ID, Russian word, English word), or None if an error occurs
+    """
+    try:
+        execute(cur, queries.USER_PAIRS, {'user_id': user_id})
+        return cur.fetchall()
+    except Exception as ex:
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
@@ -164,7 +309,7 @@ def if_users_not_exists(cur, user_id):
     The function checks whether the user exists in the database.
     It connects to the database, executes an SQL query to search for a user with the specified ID, and returns True if
     the user is not found, and False if the user is found.
-    If an exception occurs, the function prints information about the exception.
+    If an exception occurs, the function logs information about the exception.
 
     Explanation of the SQL query:
 
@@ -173,17 +318,14 @@ def if_users_not_exists(cur, user_id):
     3. The function returns True if the user is found, otherwise it returns False.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
     :return: True if the user is not found, and False if the user is found
     """
     try:
-        cur.execute("""
-            SELECT * FROM users
-            WHERE id = %s
-        """, (user_id,))
+        execute(cur, queries.USER_EXISTS, (user_id,))
         if cur.fetchone() is None:
             return True
         # if cur.fetchone() is None:
@@ -191,9 +333,7 @@ def if_users_not_exists(cur, user_id):
         # else:
         #     return False
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
         return False
 
 
@@ -206,10 +346,10 @@ def add_users(cur, user_id, name):
     It connects to the database, executes an SQL query to check whether a user with the specified ID exists.
     If the user already exists, the function prints a message about this and terminates.
     If the user does not exist, the function executes an SQL query to add a new user and commits the changes.
-    If an exception occurs, the function prints information about the exception.
+    If an exception occurs, the function logs information about the exception.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
@@ -217,349 +357,218 @@ def add_users(cur, user_id, name):
     :return:
     """
     try:
-        cur.execute("""
-            INSERT INTO users (id, name)
-            VALUES (%s, %s)
-        """, (user_id, name))
+        execute(cur, queries.ADD_USER, (user_id, name))
         cur.connection.commit()
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
 # Добавление пар слов в словарь
 def add_word_to_dictionary(cur, user_id, english_word, russian_word):
     """
-    The function adds a new word to the user's dictionary in the database.
-    It connects to the database and executes a series of SQL queries to add the English and Russian words to their
-    respective tables, links them in the all_words table, and adds the link to the user in the user_words table.
-    If an exception occurs, the function checks if it is a duplicate and returns 'Duplicate' if so.
-    Otherwise, the function prints information about the exception.
+    The function adds a new word to the user's dictionary in the database with one statement (queries.ADD_USER_WORDS).
+    If the pair is already visible to the user (it is in the common dictionary or the user has already added it),
+    the function returns 'Duplicate'.
+    If an exception occurs, the function logs information about the exception.
 
     Explanation of the SQL query:
 
-    1. Using the INSERT operator, insert the provided word - english into the english_words table, while returning
-    the generated ID - english_word_id.
-    2. Using the INSERT operator, insert the provided word world - Russian into the russian_words table, while returning
-    the generated ID - russian_word_id.
-    3. Using the INSERT operator, insert a row into the all_word table, while establishing a connection between English
-    and Russian words, while returning the generated ID - all_words_id.
-    4. Using the INSERT operator, insert a row into the user_word table, while associating the user word with the
-    specified user.
-    5. Using the conn.commit() function, we commit a transaction to save changes to the database.
-    6. In exception handling, we check whether the exception contains the PostgresSQL error code '23505', which
-    indicates a violation of the uniqueness of the restriction. In such situations, the function will return 'Duplicate'
+    1. Insert the English and the Russian word, unless a word with the same normalized key (word_key, see
+    normalization.py) is already in the english_words and russian_words tables; the ids of the existing words are
+    taken instead, so "Apple" and "apple " are the same word.
+    2. If the pair of these words is not in the all_words table yet, insert it.
+    3. Using INSERT ... ON CONFLICT DO NOTHING, link the pair to the user in the user_words table, unless the pair is
+    already visible to the user.
+    4. Return the number of linked pairs (0 means a duplicate) and the new number of the user's words, which is
+    the counter from user_stats plus the linked pairs. So no separate query is needed to show the count.
+    5. Everything is one statement, so it takes one connection and one round trip and either happens completely
+    or not at all.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
     :param english_word: English word to add
     :param russian_word: Russian word to add
-    :return:
+    :return: 'Duplicate' if the word is already in the user's dictionary, otherwise the new number of the user's words
     """
     try:
-        cur.execute("""
-            INSERT INTO english_words (word)
-            VALUES (%s) RETURNING id
-        """, (english_word,))
-        english_word_id = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO russian_words (word)
-            VALUES (%s) RETURNING id
-        """, (russian_word,))
-        russian_word_id = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO all_words (english_words_id, russian_words_id)
-            VALUES (%s, %s) RETURNING id
-        """, (english_word_id, russian_word_id))
-        all_words_id = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO user_words (user_id, all_words_id)
-            VALUES (%s, %s)
-        """, (user_id, all_words_id))
+        execute(cur, queries.ADD_USER_WORDS, {'user_id': user_id, 'english_words': [clean_word(english_word)],
+                                              'russian_words': [clean_word(russian_word)]})
+        added, word_count = cur.fetchone()
         cur.connection.commit()
-    except Exception as ex:
-        if ex.pgcode == '23505':
+        if added == 0:
             return 'Duplicate'
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
-
-
-# Удаление пары слов из словаря
-def delete_word_to_dictionary(user_id, english_word):
-    """
-    The function removes the specified word from the user's dictionary in the database.
-    It checks the existence of the English word and its Russian equivalent in the user's dictionary,
-    finds the link between them and deletes this word.
-    If the word is successfully deleted, the function returns True.
-    If the word is not found, the function returns False.
-    If an exception occurs, the function prints information about the exception.
-
-    :param user_id: User ID
-    :param english_word: English word t delete
-    :return: True if the word is successfully deleted, and False if the word is not found
-    """
-    try:
-        english_words_id = checking_existence_english_word(user_id, english_word)
-        russian_words_id = checking_existence_russian_word(user_id, english_word)
-        if english_words_id is not None:
-            word_id = find_connect_between_english_words(english_words_id[0])
-            russian_words_id = word_id[1]
-            all_words = word_id[0]
-            delete_a_specific_word(all_words, english_words_id[0], russian_words_id)
-            return True
-        elif russian_words_id is not None and english_words_id is None:
-            word_id = find_connect_between_russian_words(russian_words_id[0])
-            english_words_id = word_id[1]
-            all_words = word_id[0]
-            delete_a_specific_word(all_words, english_words_id, russian_words_id[0])
-            return True
-        else:
-            return False
+        return word_count
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Удаление пользовательской пары слов
-def delete_a_specific_word(cur, all_words, english_word_id, russian_word_id):
+# Добавление нескольких пар слов одним запросом
+def add_words_to_dictionary(cur, user_id, pairs):
     """
-    The function deletes a specific word from the database.
-    It connects to the database and executes a series of SQL queries to delete the word from the user_words, all_words,
-    english_words, and russian_words tables.
-    If an exception occurs, the function prints information about the exception.
-
-    Explanation of the SQL query:
-
-    1. Defines the ID of the Russian (russian_words_id) and English (english_words_id) words, if they exist in the
-    database.
-    2. If an English word exists (english_words_id is not equal to None), then we find the ID of the related
-    English-Russian words into words (all_words_id).
-    3. Removes the word association from the database.
-    Russian word exists (russian_words_id is not equal to None), then we find the ID of the related Russian-English
-    words into words (all_words_id).
-    5. Removes the word association from the database.
-
-    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    The function adds a list of word pairs to the user's dictionary in one round trip, see add_word_to_dictionary.
 
     :param cur: cursor for working with the database
-    :param all_words: Word ID in the all_words table
-    :param english_word_id: English word ID in the english_words table
-    :param russian_word_id: Russian word ID in the russian_words table
-    :return:
+    :param user_id: User ID
+    :param pairs: List of tuples (English word, Russian word)
+    :return: Number of pairs added to the user's dictionary
     """
     try:
-        cur.execute("""
-            DELETE FROM user_words
-            WHERE all_words_id = %s
-        """, (all_words,))
-        cur.execute("""
-            DELETE FROM all_words
-            WHERE id = %s
-        """, (all_words,))
-        cur.execute("""
-            DELETE FROM english_words
-            WHERE id = %s
-        """, (english_word_id,))
-        cur.execute("""
-            DELETE FROM russian_words
-            WHERE id = %s
-        """, (russian_word_id,))
+        execute(cur, queries.ADD_USER_WORDS, {'user_id': user_id,
+                                              'english_words': [clean_word(english) for english, russian in pairs],
+                                              'russian_words': [clean_word(russian) for english, russian in pairs]})
+        added = cur.fetchone()[0]
         cur.connection.commit()
+        return added
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Проверка существования английского слова. Если существует, то выводим id
-def checking_existence_english_word(cur, user_id, word):
+# Удаление пары слов из словаря
+def delete_word_to_dictionary(cur, user_id, english_word):
     """
-    The function checks the existence of an English word in the database.
-    If the word exists, the function returns its ID.
-    If an exception occurs, the function prints information about the exception.
+    The function removes the specified word from the user's dictionary in the database with one statement
+    (queries.DELETE_USER_WORDS). The word may be English or Russian.
+    If the word is successfully deleted, the function returns True.
+    If the word is not found, the function returns False.
+    If an exception occurs, the function logs information about the exception.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT statement, we extract the ID en_w.id the English word (english_words) associated with the user.
-    2. Using the JOIN operator, we join the all_words table to establish associations with Russian words.
-    3. Using the JOIN operator, we join the user_words table to get user-specific associations.
-    4. Using the WHERE operator, we apply conditions to verify that the provided user ID matches the English word.
-    (u_w.user_id = %sANDen_w.ward = %s).
+    1. Find the pairs in which the English or the Russian word is equal to the given one and which the user has
+    added (user_words).
+    2. Using DELETE ... RETURNING, delete the links of the user to these pairs.
+    3. Delete the pairs that no other user has added.
+    4. Delete the English and Russian words of the deleted pairs that are not used in other pairs.
+    5. Return the number of deleted links of the user.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
-    :param word: English word to check
-    :return: ID of the English word, if it exists
+    :param english_word: English (or Russian) word to delete
+    :return: True if the word is successfully deleted, and False if the word is not found
     """
     try:
-        cur.execute("""
-            SELECT en_w.id 
-            FROM english_words en_w
-            JOIN all_words all_w ON en_w.id = all_w.english_words_id
-            JOIN user_words u_w ON u_w.all_words_id = all_w.id
-            WHERE u_w.user_id = %s AND en_w.word = %s
-        """, (user_id, word))
-        return cur.fetchone()
+        execute(cur, queries.DELETE_USER_WORDS, {'user_id': user_id, 'words': [english_word]})
+        deleted = cur.fetchone()[0]
+        cur.connection.commit()
+        return deleted > 0
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Проверка существования русского слова. Если существует, то выводим id
-def checking_existence_russian_word(cur, user_id, word):
+# Удаление нескольких слов одним запросом
+def delete_words_from_dictionary(cur, user_id, words):
     """
-    The function checks the existence of a Russian word in the database.
-    If the word exists, the function returns its ID.
-    If an exception occurs, the function prints information about the exception.
-
-    Explanation of the SQL query:
-
-    1. Using the SELECT statement, we extract the ID en_w.id the Russian word (russian_words) associated with the user.
-    2. Using the JOIN operator, we join the all_words table to establish associations with English words.
-    3. Using the JOIN operator, we join the user_words table to get user-specific associations.
-    4. Using the WHERE operator, we apply conditions to verify that the provided user ID and the Russian word match.
-    (u_w.user_id = %s AND rus_w.word = %s).
-
-    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    The function removes a list of words from the user's dictionary in one round trip, see delete_word_to_dictionary.
 
     :param cur: cursor for working with the database
     :param user_id: User ID
-    :param word: Russian word to check
-    :return: ID of the Russian word, if it exists
+    :param words: List of English or Russian words
+    :return: Number of pairs deleted from the user's dictionary
     """
     try:
-        cur.execute("""
-            SELECT rus_w.id 
-            FROM russian_words rus_w
-            JOIN all_words all_w ON rus_w.id = all_w.russian_words_id
-            JOIN user_words u_w ON u_w.all_words_id = all_w.id
-            WHERE u_w.user_id = %s AND rus_w.word = %s
-        """, (user_id, word))
-        return cur.fetchone()
+        execute(cur, queries.DELETE_USER_WORDS, {'user_id': user_id, 'words': list(words)})
+        deleted = cur.fetchone()[0]
+        cur.connection.commit()
+        return deleted
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Поиск связей между английскими словами
-def find_connect_between_english_words(cur, english_words_id):
+# Пользователь добавляет своё слово
+def adding_a_word_by_the_user(cur, user_id):
     """
-    The function finds connections between English words in the database.
-    It returns the ID and the ID of the Russian word associated with the English word.
-    If an exception occurs, the function prints information about the exception.
+    The function counts the number of words added by the user to the database.
+    If an exception occurs, the function logs information about the exception.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT operator, we extract the ID of the English-Russian word reference (all_words_id) and the ID of
-    the associated Russian word russian_words_id.
-    2. Using the WHERE operator, we filter the results based on the provided english_words_id to search for associations
-    specific to this word.
+    1. Using the SELECT operator, we extract the word counter of the user from the user_stats table by its primary
+    key. The counter is kept up to date by the triggers on user_words (see migrations.py), so the words of the user
+    are not counted on every call.
 
     Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    detailed information about them to the log of the module (see logs.py) for debugging.
 
     :param cur: cursor for working with the database
-    :param english_words_id: English word ID
-    :return: tuple containing ID and Russian word ID
+    :param user_id: User ID
+    :return: String representation of the number of words added by the user
     """
     try:
-        cur.execute("""
-            SELECT id, russian_words_id FROM all_words
-            WHERE english_words_id = %s
-        """, (english_words_id,))
-        return cur.fetchone()
+        execute(cur, queries.COUNT_USER_WORDS, (user_id,))
+        row = cur.fetchone()
+        return str(row[0] if row is not None else 0)
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Поиск связей между русскими словами
-def find_connect_between_russian_words(cur, russian_words_id):
+# Повторения пользователя для планировщика интервального повторения
+def load_reviews(cur, user_id, limit):
     """
-    The function finds connections between Russian words in the database.
-    It returns the ID and the ID of the English word associated with the Russian word.
-    If an exception occurs, the function prints information about the exception.
+    The function loads the repetition states of the words of the user for scheduler.Scheduler.
+    If an exception occurs, the function logs information about the exception.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT operator, we extract the ID of the Russian-English word reference (all_words_id) and the ID of
-    the associated English word english_words_id.
-    2. Using the WHERE operator, we filter the results based on the provided russian_words_id to search for associations
-    specific to this word.
-
-    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    1. Using the SELECT operator, we extract the rows of the user from the word_reviews table in the order of due_at
+    (the index on user_id, due_at), joined with the words of the pair.
+    2. Using the LIMIT operator, we take only the limit most overdue rows.
 
     :param cur: cursor for working with the database
-    :param russian_words_id: Russian word ID
-    :return: tuple containing ID and English word ID
+    :param user_id: User ID
+    :param limit: Maximum number of rows
+    :return: List of tuples (all_words ID, Russian word, English word, due_at, interval, ease, repetitions)
     """
     try:
-        cur.execute("""
-            SELECT id, english_words_id FROM all_words
-            WHERE russian_words_id = %s
-        """, (russian_words_id,))
-        return cur.fetchone()
+        execute(cur, queries.LOAD_REVIEWS, {'user_id': user_id, 'limit': limit})
+        return cur.fetchall()
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
 
 
 @db_connection
-# Пользователь добавляет своё слово
-def adding_a_word_by_the_user(cur, user_id):
+# Сохраняем пачку событий: ответы, повторения, статистику и изменения словаря
+def save_events(cur, answers, reviews, stats, word_events):
     """
-    The function counts the number of words added by the user to the database.
-    If an exception occurs, the function prints information about the exception.
+    The function writes a batch of events collected by events.EventBuffer in one transaction. It is called by the
+    buffer, which handles the exceptions itself.
 
     Explanation of the SQL query:
 
-    1. Using the SELECT operator, we extract the number of rows in the user_words table, provided that the user_id
-    corresponds to the provided user_id.
-
-    Also, this function intercepts all exceptions that may occur during the execution of the request and outputs
-    detailed information about them is available in the terminal for debugging.
+    1. Using execute_values, all answers are appended to answer_log with one INSERT.
+    2. Using INSERT ... ON CONFLICT DO UPDATE, the repetition states are inserted or updated with one statement.
+    3. Using INSERT ... ON CONFLICT DO UPDATE, the numbers of right and wrong answers of every user of the batch are
+    added to user_stats with one statement.
+    4. Using execute_values, the added and deleted words are appended to word_events with one INSERT.
 
     :param cur: cursor for working with the database
-    :param user_id: User ID
-    :return: String representation of the number of words added by the user
+    :param answers: List of tuples (user_id, all_words_id, correct, answered_at)
+    :param reviews: List of tuples (user_id, all_words_id, due_at, interval, ease, repetitions)
+    :param stats: List of tuples (user_id, right answers, wrong answers)
+    :param word_events: List of tuples (user_id, action, word, happened_at)
+    :return: None
     """
-    try:
-        cur.execute("""
-            SELECT count(*) FROM user_words
-            WHERE user_id = %s
-        """, (user_id,))
-        return str(cur.fetchone()[0])
-    except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        massage = template.format(type(ex).__name__, ex.args)
-        print(massage)
-
-
-#  В будущем тут будут функции по добавлению статистики пользователей и
-# функция, которая будет показывать ответы пользователя и заносить их в статистику
-# В виде (user_id, word_id, answer - или же ответ пользователя)
+    if answers:
+        execute_values(cur, queries.ADD_ANSWERS, answers, template=queries.ADD_ANSWERS_TEMPLATE,
+                       page_size=len(answers))
+    if reviews:
+        execute_values(cur, queries.SAVE_REVIEWS, reviews, template=queries.SAVE_REVIEWS_TEMPLATE,
+                       page_size=len(reviews))
+    if stats:
+        execute_values(cur, queries.ADD_ANSWER_STATS, stats, template=queries.ADD_ANSWER_STATS_TEMPLATE,
+                       page_size=len(stats))
+    if word_events:
+        execute_values(cur, queries.ADD_WORD_EVENTS, word_events, template=queries.ADD_WORD_EVENTS_TEMPLATE,
+                       page_size=len(word_events))
+    cur.connection.commit()
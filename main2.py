@@ -1,87 +1,115 @@
-import random
+import argparse
 import logging
 
-import telebot
-from telebot import TeleBot
-from telebot import StateMemoryStorage
 from telebot import types, custom_filters
-from telebot.handler_backends import State, StatesGroup
 
-from main import random_words_from_db
-from main import random_english_words
-from main import random_russian_words
+from main import random_pairs_from_db
+from main import load_shared_vocabulary
+from main import vocabulary_version
+from main import user_pairs_from_db
 from main import if_users_not_exists
 from main import add_users
 from main import add_word_to_dictionary
 from main import delete_word_to_dictionary
 from main import adding_a_word_by_the_user
-
+from main import load_reviews
+from main import save_events
+
+from bot_common import Commands, States, Status, Callbacks, card_keyboard, inline_card_keyboard, parse_callback
+from bot_common import show_chat_hint, show_translation_process
+from card_queue import CardQueue, ChatCard, make_review_card
+from distractors import Distractors
+from router import Router
+from events import EventBuffer
+from logs import logged, setup_logging
+from metrics import REGISTRY, MetricsServer, timed
+from db_pool import get_pool, pool_stats
+from prepared import stats as prepared_stats
+from scheduler import Scheduler
+from sender import Sender, CARD
+from state_store import StoreStateStorage, create_state_store
+from vocabulary import Vocabulary
+from workers import ShardedTeleBot
+
+import config
 from config import TOKEN
 
 
-print("Telegram bot start to working...")
-
-logger = telebot.logger
-telebot.logger.setLevel(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
-# Create Memory Storage
-State_Storage = StateMemoryStorage()  # Храним данные в словаре
-BOT = TeleBot(TOKEN, state_storage=State_Storage)
+# Обновления одного чата обрабатываются по порядку одним потоком, разных чатов - параллельно (см. workers.py)
+BOT = ShardedTeleBot(TOKEN, workers=getattr(config, 'UPDATE_WORKERS', 4),
+                     queue_size=getattr(config, 'UPDATE_QUEUE_SIZE', 100))
 
 all_users_list = []
-user_status = {}  # Словарь с состоянием пользователя
-buttons = []
-add_english_word = {}
-add_russian_word = {}
-
-
-def show_chat_hint(*lines):
-    """
-    The function takes an arbitrary number of lines and combines them into one string, separating each new line with
-    a newline character.
-    This can be useful for formatting output in a chat.
-
-    :param lines: Lines to join
-    :return: One string consisting of all input lines separated by a newline character
-    """
-    return '\n'.join(lines)
-
-
-def show_translation_process(data):
-    """
-    The function takes a dictionary with data and returns a string representing the process of translating a word.
-
-    :param data: Dictionary with data containing 'initial_word' and 'translate_word'
-    :return: String representing the process of translating a word
+# True - пользователь выбирает русский перевод английского слова, False - наоборот
+TO_RUSSIAN = True
+# True - карточки с inline-кнопками: ответ приходит нажатием кнопки, и карточка меняется в том же сообщении
+INLINE_KEYBOARD = getattr(config, 'INLINE_KEYBOARD', False)
+# Текстовые сообщения распределяются по обработчикам по таблице, без перебора фильтров telebot
+ROUTER = Router(lambda message: STATE_STORE.get(message.from_user.id))
+
+# Части бота с фоновыми потоками создаёт start_services() в режимах, которые их используют, а не импорт модуля
+STATE_STORE = None  # Состояние диалога пользователей (шаг диалога, добавляемое слово, данные карточки)
+DISTRACTORS = None  # Неправильные варианты, похожие на правильный ответ
+VOCABULARY = None  # Общий словарь в памяти: карточки из общих слов выдаются без запросов к БД
+CARD_QUEUE = None  # Заранее подготовленные карточки пользователей
+EVENTS = None  # Ответы, статистика и изменения словаря записываются в БД пачками в фоновом потоке
+SCHEDULER = None  # Интервальное повторение уже отвеченных слов
+SENDER = None  # Исходящие сообщения отправляются фоновыми потоками с учётом лимитов Telegram
+
+
+def start_services():
     """
-    return f"{data['initial_word']} -> {data['translate_word']}"
-
-
-class Commands:
-    """
-    Class containing constants for bot commands. Each constant is a text string that the user must send to the bot
-    to perform a certain command.
-
-    ADD_WORD: Command to add a new word to the user's dictionary.
-    DELETE_WORD: Command to delete a word from the user's dictionary.
-    NEXT: Command to move to the next set of flashcards for learning words.
+    Creates the parts of the threaded bot that run background threads and registers their counters for /metrics,
+    then opens the connections of the pool and loads the shared vocabulary. Called before the bot accepts updates;
+    stop_services() must be called when it stops.
     """
-    ADD_WORD = 'Добавить слово ➕'
-    DELETE_WORD = 'Удалить слово 🗑️'
-    NEXT = 'Дальше ⏩'
-
-
-class States(StatesGroup):
+    global STATE_STORE, DISTRACTORS, VOCABULARY, CARD_QUEUE, EVENTS, SCHEDULER, SENDER
+    # По умолчанию состояние хранится в памяти, в config.py можно выбрать общее для нескольких процессов хранилище
+    # в БД (STATE_BACKEND)
+    STATE_STORE = create_state_store()
+    BOT.current_states = StoreStateStorage(STATE_STORE)
+    BOT.add_custom_filter(custom_filters.StateFilter(BOT))  # Фильтр состояния
+    DISTRACTORS = Distractors()
+    VOCABULARY = Vocabulary(load_shared_vocabulary, vocabulary_version, user_pairs_from_db,
+                            fallback=random_pairs_from_db, on_reload=DISTRACTORS.refresh,
+                            refresh_interval=getattr(config, 'VOCABULARY_REFRESH_INTERVAL', 30.0))
+    CARD_QUEUE = CardQueue(VOCABULARY.random_pairs, to_russian=TO_RUSSIAN, distractors=DISTRACTORS)
+    EVENTS = EventBuffer(save_events, max_events=getattr(config, 'EVENTS_MAX_QUEUE', 10000),
+                         batch_size=getattr(config, 'EVENTS_BATCH_SIZE', 500),
+                         flush_interval=getattr(config, 'EVENTS_FLUSH_INTERVAL', 0.2))
+    SCHEDULER = Scheduler(load_reviews, EVENTS, visible_pairs=VOCABULARY.visible_pairs)
+    SENDER = Sender(BOT, global_rate=getattr(config, 'SEND_GLOBAL_RATE', 25.0),
+                    chat_rate=getattr(config, 'SEND_CHAT_RATE', 1.0), workers=getattr(config, 'SEND_WORKERS', 4))
+
+    # Счётчики частей бота, которые отдаются вместе с гистограммами по /metrics (см. metrics.py)
+    REGISTRY.collector('bot_updates', BOT.stats)
+    REGISTRY.collector('bot_db_pool', pool_stats)
+    REGISTRY.collector('bot_db_prepared', prepared_stats)
+    REGISTRY.collector('bot_events', EVENTS.stats)
+    REGISTRY.collector('bot_sender', SENDER.stats)
+    REGISTRY.collector('bot_card_queue', CARD_QUEUE.stats)
+    REGISTRY.collector('bot_vocabulary', VOCABULARY.stats)
+    REGISTRY.collector('bot_scheduler', SCHEDULER.stats)
+    if hasattr(STATE_STORE, 'stats'):
+        REGISTRY.collector('bot_state_store', STATE_STORE.stats)
+
+    get_pool().fill()  # Открываем POOL_MIN_SIZE соединений с БД до приёма обновлений
+    VOCABULARY.start()  # Загружаем общий словарь до приёма обновлений
+
+
+def stop_services():
     """
-    Class containing states for the bot. Each state represents a stage in the dialogue with the bot.
-
-    initial_word: The state in which the user enters the initial word for translation.
-    translate_word: The state in which the user enters the translation of the word.
-    another_word: The state in which the user can enter another word for translation.
+    Stops the parts created by start_services(): processes the updates already received, sends the queued messages
+    and writes the unsaved states and events to the database.
     """
-    initial_word = State()
-    translate_word = State()
-    another_word = State()
+    BOT.stop_workers(timeout=10)
+    SENDER.close()
+    STATE_STORE.close()
+    EVENTS.close()
+    CARD_QUEUE.close()
+    VOCABULARY.close()
 
 
 # Данная функция предназначена для дальнейшей реализации и сейчас не задействована!!!
@@ -96,15 +124,15 @@ def get_users_id(user_id):
     """
     if if_users_not_exists(user_id):
         all_users_list.append(user_id)
-        user_status[user_id] = 0
-        print("A new user has been found!")
+        STATE_STORE.update(user_id, status=Status.CARDS)
+        logger.info("A new user has been found!")
         return 0
     else:
-        return user_status[user_id]
+        return STATE_STORE.get(user_id).status
 
 
 # Выделил в отдельную функцию т к я не понимаю почему, когда убираю not то приветственное сообщение не отправляется
-@BOT.message_handler(commands=['start'])
+@ROUTER.command('/start')
 def start(message: types.Message):
     chat_id = message.chat.id
     user_name = message.from_user.first_name
@@ -112,15 +140,69 @@ def start(message: types.Message):
         # Можно и раскомментировать. Опять же для дальнейшей реализации!!!
         # all_users_list.append(chat_id)
         add_users(chat_id, user_name)
-        user_status[chat_id] = 0
-        BOT.send_message(chat_id, f"Привет {user_name} 👋 Давай попрактикуемся в английском языке. "
-                                  f"Тренировки можешь проходить в удобном для себя темпе. "
-                                  f"Используй команду /cards для того чтобы начать обучение.")
+        STATE_STORE.update(chat_id, status=Status.CARDS)
+        SENDER.send(chat_id, f"Привет {user_name} 👋 Давай попрактикуемся в английском языке. "
+                               f"Тренировки можешь проходить в удобном для себя темпе. "
+                               f"Используй команду /cards для того чтобы начать обучение.")
+
+
+def take_card(chat_id, user_id):
+    """
+    Takes the next card of the user and makes it the card of the chat.
+
+    :param chat_id: Chat ID
+    :param user_id: User ID
+    :return: card_queue.ChatCard or None if the dictionary is empty
+    """
+    card = CARD_QUEUE.pop(chat_id)
+    if card is None:
+        return None
+    review = SCHEDULER.next_due(user_id)
+    if review is not None:
+        card = make_review_card(review, card, to_russian=TO_RUSSIAN)
+    card = ChatCard.from_card(card)
+    BOT.set_state(user_id, States.initial_word, chat_id)
+
+    # Запоминаем карточку этого чата, по ней проверяется ответ. Состояние сохраняется до отправки карточки,
+    # чтобы ответ на неё не пришёл раньше
+    STATE_STORE.update(user_id, card=card)
+    return card
+
+
+def card_text(card, hint=None):
+    """
+    :param card: card_queue.ChatCard or None if the dictionary is empty
+    :param hint: Feedback on the previous answer, it goes above the card in the same message
+    :return: Text of the message of the card
+    """
+    if card is None:
+        text = "В словаре пока нет слов. Добавьте их командой " + Commands.ADD_WORD
+    else:
+        text = f"Выберите перевод слова:\n {card.prompt}"
+    return text if hint is None else hint + "\n\n" + text
+
+
+def card_markup(card):
+    # Варианты ответа в карточке уже перемешаны
+    return inline_card_keyboard(card) if INLINE_KEYBOARD else card_keyboard(card)
+
+
+def save_answer(user_id, card, correct, first_attempt):
+    """
+    Records the answer to the card: the first attempt goes to the repetition schedule, the others only to the answer
+    log and the statistics.
+    """
+    if first_attempt:
+        russian, english = (card.answer, card.prompt) if TO_RUSSIAN else (card.prompt, card.answer)
+        SCHEDULER.answer(user_id, card.word_id, russian, english, correct)
+    else:
+        EVENTS.answer(user_id, card.word_id, correct)
 
 
 # Создаём обработчик команды
-@BOT.message_handler(commands=['cards'])
-def create_cards(message: types.Message):
+@ROUTER.command('/cards')
+@timed
+def create_cards(message: types.Message, hint=None):
     """
     Handler for the /cards and /start commands. This function is designed to start communicating with the bot.
     It welcomes the user if he is new (that is, not yet entered into the database) and creates for him
@@ -128,21 +210,24 @@ def create_cards(message: types.Message):
     The function also tracks button clicks and saves information about the current word and its translation.
 
     :param message: Massage from the user
+    :param hint: Feedback on the previous answer that is sent in the same message as the card
     :return: None
 
     Description of the functionality in stages:
 
     1. Checks if the user exists in the database. If not, it adds it to the database.
-    2. Initializes user variables (user_status, user_id ...)
+    2. Initializes user variables (user_id ...)
     3. Creates response markup. Adds an answer keyboard with buttons for the user to interact with the dictionary card.
-    4. Extracts a random English word (initial_word) from the dictionary
-    and its translation (translate_word).
-    5. Also generates additional words (other_words) for multiple choice of options.
-    6. Changes the position and order of the buttons so that they are displayed randomly
-    (using the shuffle() function from the random library).
-    7. Sends the user a message with the translated word and options to match it with the answer.
-    8. Sets the user's status (user_status[chat_id]) to track his status and further interaction.
-    9. Saves all data in the bot's memory to track the user's progress.
+    4. Takes the next card of the user from CARD_QUEUE (take_card): a random word (answer), its translation (prompt)
+    and additional words for multiple choice of options. The cards are loaded from the database in batches in the
+    background, so usually no query is made here. If SCHEDULER has a word that is due to be repeated, the most
+    overdue one is shown instead, with the options of the random card as the wrong options.
+    5. Sets the user's telebot state to track his further interaction.
+    6. Saves the card of the chat (ChatCard) in STATE_STORE, so that the answer is checked against this chat's card.
+    7. Creates buttons for the already shuffled options of the card (bot_common.card_keyboard, or
+    bot_common.inline_card_keyboard if INLINE_KEYBOARD is on).
+    8. Queues for SENDER a message with the feedback on the previous answer (if any), the translated word and options
+    to match it with the answer.
 
     Keyboard layout:
     1-5 flashcards -> word translations
@@ -151,54 +236,17 @@ def create_cards(message: types.Message):
     8 card -> "Delete word"
     """
     chat_id = message.chat.id
-    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
-
-    global buttons
-    buttons = []
-    other_words_buttons = []
-    flag = True
-    if flag:
-        words = random_words_from_db(chat_id)
-        initial_word = words[0]
-        translate_word = words[1]
-        initial_word_button = types.KeyboardButton(initial_word)
-        buttons.append(initial_word_button)
-        other_words = list(random_russian_words(initial_word, chat_id))
-    else:
-        words = random_words_from_db(chat_id)
-        initial_word = words[1]
-        translate_word = words[0]
-        initial_word_button = types.KeyboardButton(initial_word)
-        buttons.append(initial_word_button)
-        other_words = list(random_english_words(initial_word, chat_id))
-
-    for word in other_words:
-        other_words_buttons.append(types.KeyboardButton(word))
-
-    buttons.extend(other_words_buttons)
-    random.shuffle(buttons)
-
-    next_button = types.KeyboardButton(Commands.NEXT)
-    add_word_button = types.KeyboardButton(Commands.ADD_WORD)
-    delete_word_button = types.KeyboardButton(Commands.DELETE_WORD)
-    buttons.extend([next_button, add_word_button, delete_word_button])
-
-    keyboard_markup.add(*buttons)
-
-    first_message = f"Выберите перевод слова:\n {translate_word}"
-    # reply_markup=keyboard_markup - привязываем к сообщению клавиатуру
-    BOT.send_message(message.chat.id, first_message, reply_markup=keyboard_markup)
-    BOT.set_state(message.from_user.id, States.initial_word, message.chat.id)
-
-    # Отслеживаем нажатие кнопки и ловим сообщение по нему
-    with BOT.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data['initial_word'] = initial_word
-        data['translate_word'] = translate_word
-        data['other_words'] = other_words
+    card = take_card(chat_id, message.from_user.id)
+    if card is None:
+        SENDER.send(chat_id, card_text(None, hint))
+        return
+    # Отзыв о верном ответе и следующая карточка уходят одним сообщением.
+    # reply_markup - привязываем к сообщению клавиатуру
+    SENDER.send(chat_id, card_text(card, hint), reply_markup=card_markup(card), priority=CARD)
 
 
 # Создаём обработчик команды
-@BOT.message_handler(func=lambda message: message.text == Commands.NEXT)
+@ROUTER.command(Commands.NEXT)
 def next_cards(message: types.Message):
     """
     Handler for the NEXT command. This function calls the create_cards function to create the next set of
@@ -211,129 +259,301 @@ def next_cards(message: types.Message):
 
 
 # Создаём обработчик команды
-@BOT.message_handler(func=lambda message: message.text == Commands.DELETE_WORD)
+@ROUTER.command(Commands.DELETE_WORD)
 def delete_word(message: types.Message):
     """
     Handler for the DELETE_WORD command. This function is designed to delete a word from the user's dictionary.
-    It sets the user's status to 3 and sends the user a message asking them to enter the word they would like to delete.
+    It sets the user's status to Status.DELETE_WORD and sends the user a message asking them to enter the word they
+    would like to delete.
 
     :param message: Message from the user
     :return: None
     """
     user_id = message.chat.id
-    user_status[user_id] = 3
+    STATE_STORE.update(user_id, status=Status.DELETE_WORD)
     keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
     user_hint = "Напишите какое слово вы хотели бы удалить"
-    BOT.send_message(message.chat.id, user_hint, reply_markup=keyboard_markup)
+    SENDER.send(message.chat.id, user_hint, reply_markup=keyboard_markup)
 
 
 # Создаём обработчик команды
-@BOT.message_handler(func=lambda message: message.text == Commands.ADD_WORD)
+@ROUTER.command(Commands.ADD_WORD)
 def add_word(message: types.Message):
     """
     Handler for the ADD_WORD command. This function is designed to add a new word to the user's dictionary.
-    It sets the user's status to 1 and sends the user a message asking them to enter a new English word.
+    It sets the user's status to Status.ENGLISH_WORD and sends the user a message asking them to enter a new English
+    word.
 
     :param message: Message from the user
     :return: None
     """
     user_id = message.chat.id
-    user_status[user_id] = 1
+    STATE_STORE.update(user_id, status=Status.ENGLISH_WORD)
     keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
     user_hint = "Напишите новое английское слово"
-    BOT.send_message(message.chat.id, user_hint, reply_markup=keyboard_markup)
+    SENDER.send(message.chat.id, user_hint, reply_markup=keyboard_markup)
 
 
-# Создаём обработчик команды
-@BOT.message_handler(func=lambda message: True, content_types=['text'])
-def message_processing(message: types.Message):
+# Создаём обработчик шага диалога
+@ROUTER.step(Status.CARDS)
+def answer_card(message: types.Message, state):
     """
-    Handler for all text messages. This function processes all text messages from the user and
-    performs the corresponding actions depending on the user's status.
+    Handler for the text messages of a user who is answering cards (Status.CARDS).
 
     Description of the functionality in stages:
 
-    1. Initializes the necessary variables and response markup for bot processing.
-    (keyboard_markup, text, flag, user_hint)
-    2. Determines the current state of the user user_status to understand how to interact with the user.
-    3. If the processing status is "0" (the answer to the vocabulary card), then whether the submitted text corresponds
-    to initial_word.
-    Next, it provides the user with feedback and a hint based on their response.
-    4. If the processing status is "1" (adding an English word), then saves the provided text as an English word
-    being added.
-    Next, it takes the user to the next processing state.
-    5. If the processing status is equal to "2" (adding a translation into Russian), then saves the provided text as a
-    Russian word.
-    Next, it adds this word to the user's dictionary and provides feedback.
-    6. Checks for duplicate entries in the dictionary.
-    7. If the processing status is "3" (word deletion), then deletes the provided word from the user's dictionary.
-    Next, it gives feedback on the successful or unsuccessful deletion of the word.
-    8. Sends a reply message to the user with the appropriate prompt and feedback.
-    9. Calls the next_cards function to move to the next card (stage) if the user has correctly specified the
-    translation of the word.
+    1. If the chat has no card yet, sends the first one (create_cards).
+    2. Checks the submitted text against the card of the chat with one dictionary lookup (ChatCard.check) and records
+    the answer (save_answer).
+    3. If the answer is right, the feedback is sent together with the next card in one message (create_cards with
+    hint).
+    4. If the answer is wrong, the wrong option is marked with ❌ on the keyboard that is sent again with a hint.
 
     :param message: Message from the user
+    :param state: Dialogue state of the user (state_store.UserState)
+    :return: None
+    """
+    user_id = message.from_user.id
+    card = state.card
+    if card is None:
+        # Карточка ещё не выдавалась: выдаём первую
+        create_cards(message)
+        return
+    first_attempt = card.wrong == 0
+    correct = card.check(message.text)
+    if correct is not None:
+        # Для повторения учитывается только первая попытка ответа на карточку
+        save_answer(user_id, card, correct, first_attempt)
+    if correct:
+        in_chat_text_hint = ['Отлично!❤', show_translation_process(card)]
+        create_cards(message, hint=show_chat_hint(*in_chat_text_hint))
+        return
+    STATE_STORE.update(user_id, card=card)  # Сохраняем отметку неверного ответа
+    user_hint = show_chat_hint("Допущена ошибка!",
+                               f"Постарайтесь вспомнить слово {card.prompt} "
+                               f"и попробовать заново!")
+    # Ответ на карточку отправляется раньше остальных сообщений
+    SENDER.send(message.chat.id, user_hint, reply_markup=card_markup(card), priority=CARD)
+
+
+# Создаём обработчик шага диалога
+@ROUTER.step(Status.ENGLISH_WORD)
+def enter_english_word(message: types.Message, state):
+    """
+    Handler for the English word being added (Status.ENGLISH_WORD). Saves the text as the English word and takes the
+    user to the step of entering its translation.
+
+    :param message: Message from the user
+    :param state: Dialogue state of the user (state_store.UserState)
+    :return: None
+    """
+    text = message.text
+    STATE_STORE.update(message.from_user.id, status=Status.TRANSLATION, english_word=text)
+    user_hint = f"Отлично, слово {text} добавлено! Теперь введите его значение"
+    SENDER.send(message.chat.id, user_hint, reply_markup=types.ReplyKeyboardMarkup(row_width=2))
+
+
+# Создаём обработчик шага диалога
+@ROUTER.step(Status.TRANSLATION)
+def enter_translation(message: types.Message, state):
+    """
+    Handler for the translation of the word being added (Status.TRANSLATION). Adds the pair to the user's dictionary,
+    checks for duplicate entries and gives feedback with the new number of the user's words.
+
+    :param message: Message from the user
+    :param state: Dialogue state of the user (state_store.UserState)
+    :return: None
+    """
+    text = message.text
+    user_id = message.from_user.id
+    STATE_STORE.update(user_id, status=Status.CARDS, english_word=None)
+    # В ответ сразу приходит новое количество слов пользователя
+    word_count = add_word_to_dictionary(user_id, state.english_word, text)
+    if word_count == 'Duplicate':
+        user_hint = "Это слово уже добавлено в ваш словарь!"
+    elif word_count is None:
+        user_hint = "Не удалось добавить слово, попробуйте ещё раз"
+    else:
+        VOCABULARY.invalidate(user_id)
+        CARD_QUEUE.invalidate(user_id)
+        SCHEDULER.invalidate(user_id)
+        EVENTS.word_added(user_id, state.english_word)
+        user_hint = f"Отлично! Новое слово {text} добавлено в ваш словарь!\n\n"
+        user_hint += "Количество ваших слов ➝ " + str(word_count)
+    SENDER.send(message.chat.id, user_hint, reply_markup=types.ReplyKeyboardMarkup(row_width=2))
+
+
+# Создаём обработчик шага диалога
+@ROUTER.step(Status.DELETE_WORD)
+def enter_deleted_word(message: types.Message, state):
+    """
+    Handler for the word being deleted (Status.DELETE_WORD). Deletes the word from the user's dictionary and gives
+    feedback on the successful or unsuccessful deletion of the word.
+
+    :param message: Message from the user
+    :param state: Dialogue state of the user (state_store.UserState)
     :return: None
     """
-    keyboard_markup = types.ReplyKeyboardMarkup(row_width=2)
     text = message.text
-    flag = False
-    user_hint = ""
-    if len(user_status) == 0 or user_status.get(message.from_user.id) == 0:
-        if len(user_status) == 0:
-            user_status[message.from_user.id] = 0
-        with BOT.retrieve_data(message.from_user.id, message.chat.id) as data:
-
-            print(data)  # Проверяем, что возвращает retrieve_data
-            if data is not None:
-                print(data.keys())  # Производим проверку ключей в словаре data
-                initial_word = data['initial_word']
-            else:
-                print("Errors, data is None!")
-
-            if text == initial_word:
-                user_hint = show_translation_process(data)
-                in_chat_text_hint = ['Отлично!❤', user_hint]
-                user_hint = show_chat_hint(*in_chat_text_hint)
-                flag = True
-            else:
-                for button in buttons:
-                    if button.text == text:
-                        button.text = text + '❌'
-                        break
-                user_hint = show_chat_hint("Допущена ошибка!",
-                                           f"Постарайтесь вспомнить слово {data['translate_word']} "
-                                           f"и попробовать заново!")
-    elif user_status[message.from_user.id] == 1:
-        add_english_word[message.from_user.id] = text
-        user_hint = f"Отлично, слово {text} добавлено! Теперь введите его значение"
-        user_status[message.from_user.id] = 2
-    elif user_status[message.from_user.id] == 2:
-        add_russian_word[message.from_user.id] = text
-        user_status[message.from_user.id] = 0
-        if add_word_to_dictionary(message.from_user.id, add_english_word[message.from_user.id],
-                                  add_russian_word[message.from_user.id]) == 'Duplicate':
-            user_hint = "Это слово уже добавлено в ваш словарь!"
-        else:
-            user_hint = f"Отлично! Новое слово {text} добавлено в ваш словарь!\n\n"
-            user_words = adding_a_word_by_the_user(message.from_user.id)
-            user_hint += "Количество ваших слов ➝ " + user_words
-        add_english_word.pop(message.from_user.id)
-        add_russian_word.pop(message.from_user.id)
-    elif user_status[message.from_user.id] == 3:
-        if not delete_word_to_dictionary(message.from_user.id, text):
-            user_hint = "Данного слова нет в вашем словаре!"
-        else:
-            user_hint = f"Слово {text} успешно удалено!\n"
-            user_words = adding_a_word_by_the_user(message.from_user.id)
-            user_hint += f"Теперь в вашем словаре количество слов составляет ➝ " + user_words
-        user_status[message.from_user.id] = 0
-
-    BOT.send_message(message.chat.id, user_hint, reply_markup=keyboard_markup)
-    if flag:
-        next_cards(message)
+    user_id = message.from_user.id
+    if not delete_word_to_dictionary(user_id, text):
+        user_hint = "Данного слова нет в вашем словаре!"
+    else:
+        VOCABULARY.invalidate(user_id)
+        CARD_QUEUE.invalidate(user_id)
+        SCHEDULER.invalidate(user_id)
+        EVENTS.word_deleted(user_id, text)
+        user_hint = f"Слово {text} успешно удалено!\n"
+        user_words = adding_a_word_by_the_user(user_id)
+        user_hint += f"Теперь в вашем словаре количество слов составляет ➝ " + user_words
+    STATE_STORE.update(user_id, status=Status.CARDS)
+    SENDER.send(message.chat.id, user_hint, reply_markup=types.ReplyKeyboardMarkup(row_width=2))
+
+
+# Единственный обработчик текстовых сообщений в telebot: дальше сообщение распределяет ROUTER
+@BOT.message_handler(content_types=['text'])
+@timed
+def message_processing(message: types.Message):
+    """
+    Handler for all text messages. The handler is found by ROUTER: the commands by the exact text of the message,
+    the other messages by the step of the dialogue of the user (bot_common.Status) and the kind of input.
+
+    :param message: Message from the user
+    :return: None
+    """
+    ROUTER.dispatch(message)
+
+
+def answer_callback_query(call, text=None):
+    """
+    Answers the callback query, so that the Telegram client stops showing the progress on the pressed button.
+    """
+    try:
+        BOT.answer_callback_query(call.id, text)
+    except Exception as ex:
+        logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+
+# Создаём обработчик нажатий на inline-кнопки карточек
+@BOT.callback_query_handler(func=lambda call: True)
+@logged(logger)
+@timed
+def callback_processing(call: types.CallbackQuery):
+    """
+    Handler for the inline buttons of the cards (INLINE_KEYBOARD). The answer comes as callback_data
+    "<card_id>:<index>" and is checked by the index of the option, without comparing the text; the card is changed
+    in the same message instead of sending a new one.
+
+    Description of the functionality in stages:
+
+    1. Parses callback_data (bot_common.parse_callback).
+    2. The "Add word" and "Delete word" buttons start the same dialogs as the commands of the reply keyboard.
+    3. A button of a card that is no longer the card of the chat (card_id differs) only gets a notice.
+    4. An option is checked with ChatCard.check_position and the answer is recorded as in message_processing. An
+    option that has already been chosen wrongly only gets a notice.
+    5. If the answer is wrong, the message is edited: the feedback above the card and the option marked with ❌.
+    6. If the answer is right or "Next" is pressed, the next card replaces this one in the same message, with the
+    feedback on the right answer above it.
+
+    :param call: Callback query of the pressed button
+    :return: None
+    """
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    user_id = call.from_user.id
+    card_id, action = parse_callback(call.data or '')
+    if card_id is None:
+        answer_callback_query(call)
+        if action == Callbacks.ADD_WORD:
+            add_word(call.message)
+        elif action == Callbacks.DELETE_WORD:
+            delete_word(call.message)
+        return
+
+    card = STATE_STORE.get(user_id).card
+    if card is None or card.card_id != card_id:
+        answer_callback_query(call, "Эта карточка уже неактуальна")
+        return
+    hint = None
+    if action != Callbacks.NEXT:
+        if not isinstance(action, int) or card.wrong >> action & 1:
+            answer_callback_query(call, "Этот вариант уже выбран" if isinstance(action, int) else None)
+            return
+        first_attempt = card.wrong == 0
+        correct = card.check_position(action)
+        if correct is None:
+            answer_callback_query(call)
+            return
+        save_answer(user_id, card, correct, first_attempt)
+        if not correct:
+            answer_callback_query(call)
+            STATE_STORE.update(user_id, card=card)  # Сохраняем отметку неверного ответа
+            hint = show_chat_hint("Допущена ошибка!", "Постарайтесь вспомнить слово и попробовать заново!")
+            SENDER.edit(chat_id, message_id, card_text(card, hint), reply_markup=inline_card_keyboard(card))
+            return
+        hint = show_chat_hint('Отлично!❤', show_translation_process(card))
+
+    answer_callback_query(call)
+    next_card = take_card(chat_id, user_id)
+    SENDER.edit(chat_id, message_id, card_text(next_card, hint),
+                reply_markup=inline_card_keyboard(next_card) if next_card is not None else None)
 
 
 if __name__ == '__main__':
-    BOT.add_custom_filter(custom_filters.StateFilter(BOT))  # Фильтр состояния
-    BOT.infinity_polling(skip_pending=True)  # Включаем бота в режиме non_stop
+    parser = argparse.ArgumentParser(description="Telegram bot for learning English words")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='run the asyncio version of the bot (async_bot.py) instead of the threaded one')
+    parser.add_argument('--webhook', action='store_true',
+                        help='receive updates with the built-in webhook server (webhook.py) instead of long polling')
+    parser.add_argument('--webhook-url', help='public URL of the webhook to register in Telegram; without it the '
+                                              'server only accepts updates posted to it locally')
+    parser.add_argument('--host', default='0.0.0.0', help='address of the webhook server')
+    parser.add_argument('--port', type=int, default=8443, help='port of the webhook server')
+    parser.add_argument('--workers', type=int, default=BOT.workers, help='number of threads processing updates')
+    parser.add_argument('--queue-size', type=int, default=BOT.queue_size,
+                        help='maximum number of waiting updates per thread')
+    args = parser.parse_args()
+    if args.async_mode and args.webhook:
+        parser.error("--webhook is supported only in the threaded mode")
+
+    # Записи логов форматирует и пишет фоновый поток, уровни задаются по модулям (см. logs.py)
+    LOGS = setup_logging(levels=getattr(config, 'LOG_LEVELS', None), sampling=getattr(config, 'LOG_SAMPLING', None),
+                         json_lines=getattr(config, 'LOG_FORMAT', 'text') == 'json',
+                         max_records=getattr(config, 'LOG_MAX_QUEUE', 10000))
+    REGISTRY.collector('bot_logs', LOGS.stats)
+    logger.info("Telegram bot start to working...")
+
+    metrics_port = getattr(config, 'METRICS_PORT', None)
+    if metrics_port:
+        # Гистограммы времени запросов и обработчиков: http://127.0.0.1:<METRICS_PORT>/metrics
+        MetricsServer(REGISTRY, port=metrics_port).start()
+
+    if args.async_mode:
+        import asyncio
+        import async_bot
+        try:
+            asyncio.run(async_bot.main())
+        finally:
+            LOGS.stop()
+    elif args.webhook:
+        from webhook import WebhookServer
+        start_services()
+        try:
+            secret_token = getattr(config, 'WEBHOOK_SECRET', None)
+            server = WebhookServer(BOT, host=args.host, port=args.port, secret_token=secret_token,
+                                   workers=args.workers, queue_size=args.queue_size)
+            if args.webhook_url:
+                BOT.remove_webhook()
+                BOT.set_webhook(url=args.webhook_url, secret_token=secret_token)
+            server.serve_forever()
+        finally:
+            stop_services()  # Отправляем сообщения из очереди, записываем в БД несохранённые состояния и ответы
+            LOGS.stop()
+    else:
+        BOT.workers, BOT.queue_size = args.workers, args.queue_size
+        start_services()
+        try:
+            BOT.infinity_polling(skip_pending=True)  # Включаем бота в режиме non_stop
+        finally:
+            stop_services()  # Обрабатываем полученные обновления, отправляем сообщения, записываем несохранённое в БД
+            LOGS.stop()
@@ -0,0 +1,313 @@
+"""
+Versioned migrations of the database schema.
+
+Every migration is a tuple (version, name, SQL). migrate() applies the migrations that are not yet recorded in the
+schema_migrations table, each in its own transaction, so an existing database is upgraded in place and its data is
+kept. New migrations are only ever appended to the end of MIGRATIONS; an applied migration must not be changed.
+"""
+
+# Произвольный ключ для pg_advisory_lock, чтобы два процесса не применяли миграции одновременно
+MIGRATIONS_LOCK_ID = 7283610
+
+MIGRATIONS = [
+    (1, 'initial schema', """
+        CREATE TABLE IF NOT EXISTS english_words(
+        id SERIAL PRIMARY KEY,
+        word VARCHAR(60) NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS russian_words(
+        id SERIAL PRIMARY KEY,
+        word VARCHAR(60) NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS all_words(
+        id SERIAL PRIMARY KEY,
+        english_words_id INTEGER NOT NULL REFERENCES english_words(id),
+        russian_words_id INTEGER NOT NULL REFERENCES russian_words(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS users(
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS user_words(
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        all_words_id INTEGER NOT NULL REFERENCES all_words(id)
+        );
+    """),
+    # В качестве id пользователя используется id чата в Telegram, а он не помещается в INTEGER
+    (2, 'bigint user ids', """
+        ALTER TABLE users ALTER COLUMN id TYPE BIGINT;
+        ALTER TABLE user_words ALTER COLUMN user_id TYPE BIGINT;
+    """),
+    # Индексы под запросы из main.py. Отдельный индекс по user_words(user_id) не нужен: его заменяет
+    # составной уникальный индекс, который начинается с user_id
+    (3, 'indexes for hot lookups', """
+        DELETE FROM user_words u_w
+        USING user_words duplicate
+        WHERE u_w.user_id = duplicate.user_id
+        AND u_w.all_words_id = duplicate.all_words_id
+        AND u_w.id > duplicate.id;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS user_words_user_id_all_words_id_key
+        ON user_words (user_id, all_words_id);
+        CREATE INDEX IF NOT EXISTS user_words_all_words_id_idx ON user_words (all_words_id);
+        CREATE INDEX IF NOT EXISTS all_words_english_words_id_idx ON all_words (english_words_id);
+        CREATE INDEX IF NOT EXISTS all_words_russian_words_id_idx ON all_words (russian_words_id);
+        CREATE INDEX IF NOT EXISTS english_words_lower_word_idx ON english_words (lower(word));
+        CREATE INDEX IF NOT EXISTS russian_words_lower_word_idx ON russian_words (lower(word));
+    """),
+    # Состояние диалога пользователей (state_store.PostgresStateStore). Запись - компактный JSON-массив,
+    # updated_at - время в секундах (time.time()), по нему удаляются устаревшие состояния
+    (4, 'user states', """
+        CREATE TABLE IF NOT EXISTS user_states(
+        user_id BIGINT PRIMARY KEY,
+        record TEXT NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS user_states_updated_at_idx ON user_states (updated_at);
+    """),
+    # Сколько строк каждого файла уже загрузил импорт словаря (filling_in_the_database.py), чтобы прерванный
+    # импорт продолжался с того же места
+    (5, 'import progress', """
+        CREATE TABLE IF NOT EXISTS import_progress(
+        source TEXT PRIMARY KEY,
+        file_size BIGINT NOT NULL,
+        rows_done BIGINT NOT NULL,
+        finished BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """),
+    # Статистика пользователя, чтобы не считать count(*) по user_words после каждого изменения словаря.
+    # word_count поддерживают триггеры на user_words (по одному срабатыванию на запрос, а не на строку), поэтому он
+    # верен для любого способа изменения user_words. Ответы на карточки записывает main.save_events
+    (6, 'user stats', """
+        CREATE TABLE IF NOT EXISTS user_stats(
+        user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        word_count INTEGER NOT NULL DEFAULT 0,
+        right_answers BIGINT NOT NULL DEFAULT 0,
+        wrong_answers BIGINT NOT NULL DEFAULT 0,
+        last_activity TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        INSERT INTO user_stats (user_id, word_count)
+        SELECT users.id, count(u_w.id)
+        FROM users
+        LEFT JOIN user_words u_w ON u_w.user_id = users.id
+        GROUP BY users.id
+        ON CONFLICT (user_id) DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION user_stats_words_added() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO user_stats AS s (user_id, word_count)
+            SELECT user_id, count(*) FROM new_rows GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET word_count = s.word_count + EXCLUDED.word_count, last_activity = now();
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE OR REPLACE FUNCTION user_stats_words_deleted() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE user_stats s
+            SET word_count = s.word_count - deleted.count, last_activity = now()
+            FROM (SELECT user_id, count(*) AS count FROM old_rows GROUP BY user_id) deleted
+            WHERE s.user_id = deleted.user_id;
+            RETURN NULL;
+        END
+        $$;
+
+        DROP TRIGGER IF EXISTS user_words_added ON user_words;
+        CREATE TRIGGER user_words_added
+        AFTER INSERT ON user_words
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE user_stats_words_added();
+
+        DROP TRIGGER IF EXISTS user_words_deleted ON user_words;
+        CREATE TRIGGER user_words_deleted
+        AFTER DELETE ON user_words
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE user_stats_words_deleted();
+    """),
+    # Журнал ответов и интервальное повторение (scheduler.py). В answer_log только дописываются строки, поэтому
+    # у него нет первичного ключа, а индекс по времени - BRIN: каждая вставка обновляет как можно меньше индексов.
+    # word_reviews читается по пользователю в порядке due_at
+    (7, 'answer log and reviews', """
+        CREATE TABLE IF NOT EXISTS answer_log(
+        user_id BIGINT NOT NULL,
+        all_words_id INTEGER NOT NULL,
+        correct BOOLEAN NOT NULL,
+        answered_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE INDEX IF NOT EXISTS answer_log_answered_at_idx ON answer_log USING brin (answered_at);
+
+        CREATE TABLE IF NOT EXISTS word_reviews(
+        user_id BIGINT NOT NULL,
+        all_words_id INTEGER NOT NULL REFERENCES all_words(id) ON DELETE CASCADE,
+        due_at TIMESTAMPTZ NOT NULL,
+        interval_seconds DOUBLE PRECISION NOT NULL,
+        ease REAL NOT NULL,
+        repetitions INTEGER NOT NULL,
+        PRIMARY KEY (user_id, all_words_id)
+        );
+
+        CREATE INDEX IF NOT EXISTS word_reviews_user_id_due_at_idx ON word_reviews (user_id, due_at);
+        CREATE INDEX IF NOT EXISTS word_reviews_all_words_id_idx ON word_reviews (all_words_id);
+    """),
+    # Журнал добавления и удаления слов пользователями. Как и answer_log, его пишет events.EventBuffer пачками,
+    # строки только дописываются
+    (8, 'word events', """
+        CREATE TABLE IF NOT EXISTS word_events(
+        user_id BIGINT NOT NULL,
+        action VARCHAR(10) NOT NULL,
+        word VARCHAR(60) NOT NULL,
+        happened_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE INDEX IF NOT EXISTS word_events_happened_at_idx ON word_events USING brin (happened_at);
+    """),
+    # Версия общего словаря. Бот держит общие пары в памяти (vocabulary.py) и перечитывает их, когда версия меняется;
+    # её увеличивает filling_in_the_database.py после загрузки новых пар
+    (9, 'vocabulary version', """
+        CREATE TABLE IF NOT EXISTS vocabulary_version(
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO vocabulary_version (id, version)
+        VALUES (TRUE, 0)
+        ON CONFLICT (id) DO NOTHING;
+    """),
+    # Нормализованный ключ слова (см. normalization.py): "Apple", " apple " и "APPLE" - одно слово. Ключ новых и
+    # изменённых слов заполняет триггер. Миграция не трогает существующие строки, чтобы не переписывать большие
+    # таблицы в одной транзакции: их ключи заполняет и дубликаты объединяет normalize_words.py, он же создаёт
+    # уникальные индексы по word_key. normalize() есть в PostgreSQL начиная с 13 и только в базе в кодировке UTF8
+    (10, 'normalized word keys', r"""
+        CREATE OR REPLACE FUNCTION word_key(word TEXT) RETURNS TEXT
+        LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+            SELECT replace(lower(regexp_replace(regexp_replace(normalize(word, NFKC), '\s+', ' ', 'g'),
+                                                '^ | $', '', 'g')), 'ё', 'е')
+        $$;
+
+        CREATE OR REPLACE FUNCTION set_word_key() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.word_key := word_key(NEW.word);
+            RETURN NEW;
+        END
+        $$;
+
+        ALTER TABLE english_words ADD COLUMN IF NOT EXISTS word_key VARCHAR(60);
+        ALTER TABLE russian_words ADD COLUMN IF NOT EXISTS word_key VARCHAR(60);
+
+        DROP TRIGGER IF EXISTS english_words_word_key ON english_words;
+        CREATE TRIGGER english_words_word_key
+        BEFORE INSERT OR UPDATE OF word ON english_words
+        FOR EACH ROW EXECUTE PROCEDURE set_word_key();
+
+        DROP TRIGGER IF EXISTS russian_words_word_key ON russian_words;
+        CREATE TRIGGER russian_words_word_key
+        BEFORE INSERT OR UPDATE OF word ON russian_words
+        FOR EACH ROW EXECUTE PROCEDURE set_word_key();
+
+        CREATE INDEX IF NOT EXISTS english_words_word_key_idx ON english_words (word_key);
+        CREATE INDEX IF NOT EXISTS russian_words_word_key_idx ON russian_words (word_key);
+    """),
+    # NFKC может удлинить слово (лигатуры, дроби), и ключ слова из 60 символов не помещался в VARCHAR(60): вставка
+    # падала в триггере. VARCHAR -> TEXT не переписывает таблицу и индексы
+    (11, 'unbounded word keys', """
+        ALTER TABLE english_words ALTER COLUMN word_key TYPE TEXT;
+        ALTER TABLE russian_words ALTER COLUMN word_key TYPE TEXT;
+    """),
+    # Слова ищутся по word_key (миграция 10): индексы по lower(word) из миграции 3 запросы больше не используют,
+    # а каждая вставка слова их обновляет
+    (12, 'drop lower(word) indexes', """
+        DROP INDEX IF EXISTS english_words_lower_word_idx;
+        DROP INDEX IF EXISTS russian_words_lower_word_idx;
+    """),
+]
+
+# Таблицы, которые удаляются при пересоздании базы с нуля (create_db.py --reset)
+TABLES = [
+    'vocabulary_version',
+    'word_events',
+    'answer_log',
+    'word_reviews',
+    'user_stats',
+    'import_progress',
+    'user_states',
+    'user_words',
+    'users',
+    'all_words',
+    'english_words',
+    'russian_words',
+    'schema_migrations',
+]
+
+
+def applied_versions(cur):
+    """
+    Returns the set of versions recorded in the schema_migrations table.
+
+    :param cur: cursor for working with the database
+    :return: Set of applied migration versions
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(conn, target=None):
+    """
+    Applies all pending migrations (up to target, if it is given) to the database.
+    Each migration runs in its own transaction together with its record in schema_migrations, so a failed migration
+    leaves the database at the previous version. An advisory lock makes concurrent calls wait for each other.
+
+    :param conn: psycopg2 connection
+    :param target: The last version to apply, or None to apply all migrations
+    :return: List of applied versions
+    """
+    done = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            applied = applied_versions(cur)
+            conn.commit()
+            for version, name, sql in MIGRATIONS:
+                if version in applied or (target is not None and version > target):
+                    continue
+                cur.execute(sql)
+                cur.execute("""
+                    INSERT INTO schema_migrations (version, name)
+                    VALUES (%s, %s)
+                """, (version, name))
+                conn.commit()
+                done.append(version)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            conn.commit()
+    return done
+
+
+def drop_tables(conn):
+    """
+    Drops all tables of the bot. Only for development: all data is lost.
+
+    :param conn: psycopg2 connection
+    """
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS {} CASCADE".format(', '.join(TABLES)))
+    conn.commit()
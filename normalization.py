@@ -0,0 +1,28 @@
+"""
+Normalization of words, so that "Apple", " apple " and "APPLE" are the same word.
+
+clean_word() is applied to every word before it is stored: Unicode compatibility forms are composed (NFKC), the
+spaces at the ends are removed and the runs of spaces inside are replaced with one space. word_key() is the key the
+words are compared by: the cleaned word in lower case with ё replaced by е. The same key is computed in the database
+by the SQL function word_key() (migration 10) and stored in the word_key columns of english_words and russian_words;
+the two implementations must stay in sync. NFKC can make a word longer than it was typed (ligatures, fractions), so
+the key is not limited to the 60 characters of the word (migration 11).
+"""
+import unicodedata
+
+
+def clean_word(word):
+    """
+    :param word: Word as the user typed it
+    :return: Word without extra spaces in the NFKC form
+    """
+    return ' '.join(unicodedata.normalize('NFKC', word).split())
+
+
+def word_key(word):
+    """
+    :param word: Word as the user typed it
+    :return: Key for comparing words
+    """
+    # lower(), а не casefold(): так же работает lower() в PostgreSQL
+    return clean_word(word).lower().replace('ё', 'е')
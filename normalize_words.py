@@ -0,0 +1,208 @@
+"""
+Fills the normalized keys of the words (see normalization.py) and merges the words and pairs that differ only in case,
+spaces or ё/е. Run it once after migration 10 has been applied:
+
+    python3 normalize_words.py
+
+1. The word_key of the existing rows of english_words and russian_words is filled in batches of --batch-size rows,
+   each batch in its own transaction, so the tables are not locked for long and an interrupted run simply continues.
+2. Words with the same key are merged into the one with the smallest id, and then the pairs that have become equal
+   are merged. A common pair is kept in preference to a pair of a user, so the word stays common; the links, the
+   repetition states and the answers of the removed pairs are moved to the kept pair. This step is one transaction.
+3. The unique indexes on word_key are created (CONCURRENTLY, without blocking the bot) and the columns are made
+   NOT NULL. After that the database itself does not allow two words with the same key.
+
+Running the tool again does nothing if the keys are already filled and there are no duplicates.
+"""
+import argparse
+import time
+
+import psycopg2
+from config import password, database, user
+
+from migrations import migrate
+
+BATCH_SIZE = 10_000
+TABLES = ['english_words', 'russian_words']
+
+BACKFILL = """
+    UPDATE {table} SET word_key = word_key(word)
+    WHERE id IN (
+        SELECT id FROM {table}
+        WHERE word_key IS NULL
+        LIMIT %(batch_size)s
+    )
+"""
+
+# Номер слова -> номер слова с тем же ключом, которое остаётся
+WORD_DUPLICATES = """
+    CREATE TEMP TABLE word_duplicates ON COMMIT DROP AS
+    SELECT id, keep
+    FROM (
+        SELECT id, min(id) OVER (PARTITION BY word_key) AS keep
+        FROM {table}
+        WHERE word_key IN (SELECT word_key FROM {table} GROUP BY word_key HAVING count(*) > 1)
+    ) ranked
+    WHERE id <> keep
+"""
+
+MERGE_WORDS = """
+    UPDATE all_words SET {column} = d.keep
+    FROM word_duplicates d
+    WHERE all_words.{column} = d.id;
+
+    DELETE FROM {table}
+    USING word_duplicates d
+    WHERE {table}.id = d.id;
+
+    DROP TABLE word_duplicates;
+"""
+
+# Номер пары -> номер одинаковой пары, которая остаётся. Общие пары (без связей в user_words) идут первыми
+PAIR_DUPLICATES = """
+    CREATE TEMP TABLE pair_duplicates ON COMMIT DROP AS
+    SELECT id, keep, keep_private
+    FROM (
+        SELECT id,
+        first_value(id) OVER w AS keep,
+        first_value(private) OVER w AS keep_private
+        FROM (
+            SELECT all_w.id, all_w.english_words_id, all_w.russian_words_id,
+            EXISTS (SELECT 1 FROM user_words u_w WHERE u_w.all_words_id = all_w.id) AS private
+            FROM all_words all_w
+            WHERE (all_w.english_words_id, all_w.russian_words_id) IN (
+                SELECT english_words_id, russian_words_id
+                FROM all_words
+                GROUP BY english_words_id, russian_words_id
+                HAVING count(*) > 1
+            )
+        ) pairs
+        WINDOW w AS (PARTITION BY english_words_id, russian_words_id ORDER BY private, id)
+    ) ranked
+    WHERE id <> keep
+"""
+
+# Если остаётся общая пара, связи пользователей с удаляемыми парами не переносятся: общая пара и так видна всем,
+# а связь сделала бы её личной. Триггеры на user_words пересчитают word_count в user_stats
+MERGE_PAIRS = """
+    INSERT INTO user_words (user_id, all_words_id)
+    SELECT u_w.user_id, d.keep
+    FROM user_words u_w
+    JOIN pair_duplicates d ON d.id = u_w.all_words_id
+    WHERE d.keep_private
+    ON CONFLICT (user_id, all_words_id) DO NOTHING;
+
+    DELETE FROM user_words u_w
+    USING pair_duplicates d
+    WHERE u_w.all_words_id = d.id;
+
+    INSERT INTO word_reviews (user_id, all_words_id, due_at, interval_seconds, ease, repetitions)
+    SELECT r.user_id, d.keep, r.due_at, r.interval_seconds, r.ease, r.repetitions
+    FROM word_reviews r
+    JOIN pair_duplicates d ON d.id = r.all_words_id
+    ON CONFLICT (user_id, all_words_id) DO NOTHING;
+
+    UPDATE answer_log SET all_words_id = d.keep
+    FROM pair_duplicates d
+    WHERE answer_log.all_words_id = d.id;
+
+    DELETE FROM all_words
+    USING pair_duplicates d
+    WHERE all_words.id = d.id;
+"""
+
+BUMP_VOCABULARY_VERSION = """
+    UPDATE vocabulary_version SET version = version + 1
+"""
+
+
+def backfill(conn, table, batch_size=BATCH_SIZE):
+    """
+    Fills word_key of the rows of the table where it is empty, one transaction per batch.
+
+    :param conn: psycopg2 connection
+    :param table: 'english_words' or 'russian_words'
+    :param batch_size: Number of rows per transaction
+    :return: Number of updated rows
+    """
+    done = 0
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        while True:
+            cur.execute(BACKFILL.format(table=table), {'batch_size': batch_size})
+            conn.commit()
+            if cur.rowcount <= 0:
+                break
+            done += cur.rowcount
+            print(f"{table}: {done} keys filled, {done / (time.perf_counter() - started):.0f} rows/s")
+    return done
+
+
+def merge_duplicates(conn):
+    """
+    Merges the words with the same key and the pairs that have become equal in one transaction.
+
+    :param conn: psycopg2 connection
+    :return: Dictionary table -> number of removed rows
+    """
+    removed = {}
+    with conn.cursor() as cur:
+        for table, column in (('english_words', 'english_words_id'), ('russian_words', 'russian_words_id')):
+            cur.execute(WORD_DUPLICATES.format(table=table))
+            removed[table] = cur.rowcount
+            cur.execute(MERGE_WORDS.format(table=table, column=column))
+        cur.execute(PAIR_DUPLICATES)
+        removed['all_words'] = cur.rowcount
+        cur.execute(MERGE_PAIRS)
+        if any(removed.values()):
+            # Слова общего словаря изменились - боты перечитают его (см. vocabulary.py)
+            cur.execute(BUMP_VOCABULARY_VERSION)
+    conn.commit()
+    return removed
+
+
+def create_unique_indexes(conn):
+    """
+    Replaces the plain indexes on word_key with unique ones and makes the columns NOT NULL.
+
+    :param conn: psycopg2 connection
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+    try:
+        with conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_word_key_key "
+                            f"ON {table} (word_key)")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {table}_word_key_idx")
+                cur.execute(f"ALTER TABLE {table} ALTER COLUMN word_key SET NOT NULL")
+    finally:
+        conn.autocommit = autocommit
+
+
+def normalize_words(conn, batch_size=BATCH_SIZE):
+    """
+    Runs all steps of the tool, see the description of the module.
+
+    :param conn: psycopg2 connection
+    :param batch_size: Number of rows per transaction of the backfill
+    :return: Dictionary with counters
+    """
+    stats = {}
+    for table in TABLES:
+        stats[f'{table} keys'] = backfill(conn, table, batch_size)
+    for table, count in merge_duplicates(conn).items():
+        stats[f'{table} merged'] = count
+    create_unique_indexes(conn)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per transaction of the backfill')
+    args = parser.parse_args()
+
+    with psycopg2.connect(database=database, user=user, password=password) as conn:
+        migrate(conn)
+        result = normalize_words(conn, batch_size=args.batch_size)
+        print(', '.join(f"{name}: {count}" for name, count in result.items()))
@@ -0,0 +1,161 @@
+"""
+Prepared statements for the queries of queries.py on the psycopg2 connections of the pool (db_pool.py).
+
+cur.execute() sends the whole text of a statement, and the server parses, analyzes and plans it on every call. For the
+statements named in queries.PREPARED, execute() instead prepares the statement once per pooled connection
+(PREPARE name AS ..., on the first use of the statement on that connection) and then runs EXECUTE name(...) with only
+the parameters. The join-heavy sampling queries then skip the parse and the analysis on every call, and after five
+executions the server may switch to a generic plan and skip the planning as well (see benchmarks/bench_prepared.py).
+The %(name)s and %s placeholders of queries.py are converted to $1, $2, ... once, when the module is imported, so the
+text of a statement stays the same for the async mode of the bot.
+
+Poolers in transaction mode (for example PgBouncer without prepared statement support) hand every transaction a
+different server connection that does not have the statements prepared. With PREPARED_STATEMENTS = False in config.py
+execute() sends the plain statements as before. A statement the server refuses to prepare (a syntax or access error,
+a feature it does not support, a parameter whose type it cannot infer) is logged and sent as plain text on that
+connection from then on. Other errors of PREPARE, such as a lost connection, are raised to the caller like the errors
+of cur.execute().
+"""
+import logging
+import re
+import threading
+
+import psycopg2
+
+import config
+import queries
+from db_pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+PREPARED_STATEMENTS = getattr(config, 'PREPARED_STATEMENTS', True)
+
+# %(name)s, %s и экранированный %% в тексте запроса
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+
+class Statement:
+    """
+    Statement of queries.py converted for PREPARE and EXECUTE.
+
+    :param name: Name of the statement in queries.py, the prepared statement is called by it in lower case
+    :param sql: Text of the statement with %(name)s or %s placeholders
+    """
+    __slots__ = ('name', 'sql', 'names', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name, sql):
+        self.name = name.lower()
+        self.sql = sql
+        self.names = []  # имена параметров по номерам $1, $2... (для %s - их позиции)
+        numbers = {}
+        positional = named = False
+
+        def number(match):
+            nonlocal positional, named
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(1) is None:
+                positional = True
+                self.names.append(len(self.names))
+                return f'${len(self.names)}'
+            named = True
+            key = match.group(1)
+            if key not in numbers:
+                self.names.append(key)
+                numbers[key] = len(self.names)
+            return f'${numbers[key]}'
+
+        text = PLACEHOLDER.sub(number, sql)
+        if positional and named:
+            raise ValueError(f"Statement {name} mixes %s and %(name)s placeholders")
+        self.prepare_sql = f'PREPARE {self.name} AS {text}'
+        arguments = ', '.join(['%s'] * len(self.names))
+        self.execute_sql = f'EXECUTE {self.name}({arguments})' if self.names else f'EXECUTE {self.name}'
+
+    def values(self, params):
+        """
+        :param params: Dictionary or sequence of the parameters, as for cur.execute(sql, params)
+        :return: List of the parameters in the order of $1, $2, ...
+        """
+        if not self.names:
+            return None
+        return [params[key] for key in self.names]
+
+
+# Текст запроса -> Statement. Поиск по тексту позволяет вызывать execute() с той же константой queries.X, что и
+# cur.execute(): хэш строки вычисляется один раз и хранится в ней
+STATEMENTS = {getattr(queries, name): Statement(name, getattr(queries, name)) for name in queries.PREPARED}
+
+# Классы кодов ошибок PostgreSQL, при которых запрос больше не готовится на соединении: 42 - синтаксис и права
+# доступа (в том числе неизвестный тип параметра), 0A - неподдерживаемая возможность
+REFUSAL_CLASSES = ('42', '0A')
+
+_stats = {'prepared': 0, 'executed': 0, 'plain': 0, 'refused': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _prepare(cur, statement):
+    """
+    Prepares the statement on the connection of the cursor. If the server refuses the statement, the error of PREPARE
+    is rolled back to a savepoint, so the transaction of the caller continues; any other error is raised.
+
+    :return: True if the statement is prepared, False if the server refused it
+    """
+    in_transaction = not cur.connection.autocommit
+    if in_transaction:
+        cur.execute("SAVEPOINT prepare_statement")
+    try:
+        cur.execute(statement.prepare_sql)
+    except psycopg2.Error as ex:
+        if not (ex.pgcode or '').startswith(REFUSAL_CLASSES):
+            raise
+        if in_transaction:
+            cur.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+        _count('refused')
+        logger.warning("Statement %s is not prepared, it is sent as text: %s", statement.name, ex)
+        return False
+    if in_transaction:
+        cur.execute("RELEASE SAVEPOINT prepare_statement")
+    _count('prepared')
+    return True
+
+
+def execute(cur, sql, params=None):
+    """
+    Runs the statement like cur.execute(sql, params): a statement of queries.PREPARED with EXECUTE, preparing it on
+    the connection first if needed, any other statement as text. The connection must be taken from the pool of
+    db_pool.get_pool(), which remembers the statements prepared on it.
+
+    :param cur: psycopg2 cursor
+    :param sql: Text of the statement, a constant of queries.py
+    :param params: Parameters of the statement
+    """
+    statement = STATEMENTS.get(sql) if PREPARED_STATEMENTS else None
+    if statement is not None:
+        prepared = get_pool().prepared(cur.connection)
+        if statement.name not in prepared:
+            prepared[statement.name] = _prepare(cur, statement)
+        if not prepared[statement.name]:
+            statement = None
+    if statement is None:
+        _count('plain')
+        cur.execute(sql, params)
+        return
+    _count('executed')
+    cur.execute(statement.execute_sql, statement.values(params))
+
+
+def stats():
+    """
+    Returns the counters: how many statements were prepared on the connections, run with EXECUTE and sent as text,
+    and how many times the server refused to prepare one.
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    result['enabled'] = int(PREPARED_STATEMENTS)
+    return result
@@ -0,0 +1,474 @@
+"""
+SQL statements of the bot, each under its own name.
+
+main.py runs them with psycopg2 and async_db.py with psycopg 3. Both drivers use the same %s / %(name)s placeholders,
+so the text of a statement is shared by the sync and the async mode of the bot. The statements listed in PREPARED are
+prepared once per connection and run with EXECUTE (see prepared.py).
+"""
+
+# Слово видно пользователю, если оно общее (у него нет связей в user_words) или добавлено самим пользователем.
+# Условие подставляется в запросы ниже, псевдоним all_words в них всегда all_w.
+VISIBLE_TO_USER = """(
+            NOT EXISTS (SELECT 1 FROM user_words u_w WHERE u_w.all_words_id = all_w.id)
+            OR EXISTS (SELECT 1 FROM user_words u_w
+                       WHERE u_w.all_words_id = all_w.id AND u_w.user_id = %(user_id)s)
+        )"""
+
+# Сколько случайных точек перебирается на одно слово-вариант. Часть точек попадает на одно и то же слово или на
+# слово, которое нужно исключить, поэтому их берётся с запасом.
+PROBES_PER_WORD = 3
+
+
+# Случайная пара слов, видимая пользователю (см. main.random_words_from_db)
+RANDOM_WORDS = f"""
+    WITH bounds AS (
+        SELECT min(id) AS lo, max(id) - min(id) + 1 AS span FROM all_words
+    ), start AS (
+        SELECT lo + floor(random() * span)::int AS id FROM bounds
+    )
+    (SELECT rus_w.word AS rw, en_w.word AS ew
+    FROM all_words all_w
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    WHERE all_w.id >= (SELECT id FROM start) AND {VISIBLE_TO_USER}
+    ORDER BY all_w.id
+    LIMIT 1)
+    UNION ALL
+    (SELECT rus_w.word AS rw, en_w.word AS ew
+    FROM all_words all_w
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    WHERE {VISIBLE_TO_USER}
+    ORDER BY all_w.id
+    LIMIT 1)
+    LIMIT 1;
+"""
+
+
+# Случайные английские слова для вариантов ответа (см. main.random_english_words)
+RANDOM_ENGLISH_WORDS = f"""
+    WITH bounds AS (
+        SELECT min(id) AS lo, max(id) - min(id) + 1 AS span FROM all_words
+    ), probes AS (
+        SELECT lo + floor(random() * span)::int AS start
+        FROM bounds, generate_series(1, %(probes)s)
+    ), candidates AS (
+        SELECT picked.word, 0 AS priority
+        FROM probes p
+        CROSS JOIN LATERAL (
+            SELECT en_w.word
+            FROM all_words all_w
+            JOIN english_words en_w ON en_w.id = all_w.english_words_id
+            WHERE all_w.id >= p.start AND {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT 1
+        ) picked
+        UNION ALL
+        (SELECT en_w.word, 1 AS priority
+        FROM all_words all_w
+        JOIN english_words en_w ON en_w.id = all_w.english_words_id
+        WHERE {VISIBLE_TO_USER}
+        ORDER BY all_w.id
+        LIMIT %(limit)s + 1)
+    )
+    SELECT min(word)
+    FROM candidates
+    WHERE word_key(word) != word_key(%(word_to_avoid)s)
+    GROUP BY word_key(word)
+    ORDER BY min(priority), random()
+    LIMIT %(limit)s;
+"""
+
+
+# Случайные русские слова для вариантов ответа (см. main.random_russian_words)
+RANDOM_RUSSIAN_WORDS = f"""
+    WITH bounds AS (
+        SELECT min(id) AS lo, max(id) - min(id) + 1 AS span FROM all_words
+    ), probes AS (
+        SELECT lo + floor(random() * span)::int AS start
+        FROM bounds, generate_series(1, %(probes)s)
+    ), candidates AS (
+        SELECT picked.word, 0 AS priority
+        FROM probes p
+        CROSS JOIN LATERAL (
+            SELECT rus_w.word
+            FROM all_words all_w
+            JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+            WHERE all_w.id >= p.start AND {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT 1
+        ) picked
+        UNION ALL
+        (SELECT rus_w.word, 1 AS priority
+        FROM all_words all_w
+        JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+        WHERE {VISIBLE_TO_USER}
+        ORDER BY all_w.id
+        LIMIT %(limit)s + 1)
+    )
+    SELECT min(word)
+    FROM candidates
+    WHERE word_key(word) != word_key(%(word_to_avoid)s)
+    GROUP BY word_key(word)
+    ORDER BY min(priority), random()
+    LIMIT %(limit)s;
+"""
+
+
+# Карточка целиком: слово-ответ, слово-подсказка и варианты ответа (см. main.build_card)
+def _build_card(answer_table, answer_column, prompt_table, prompt_column):
+    return f"""
+        WITH bounds AS (
+            SELECT min(id) AS lo, max(id) - min(id) + 1 AS span FROM all_words
+        ), start AS (
+            SELECT lo + floor(random() * span)::int AS id FROM bounds
+        ), probes AS (
+            SELECT lo + floor(random() * span)::int AS start
+            FROM bounds, generate_series(1, %(probes)s)
+        ), card AS (
+            (SELECT answer_w.word AS answer, prompt_w.word AS prompt
+            FROM all_words all_w
+            JOIN {answer_table} answer_w ON answer_w.id = all_w.{answer_column}
+            JOIN {prompt_table} prompt_w ON prompt_w.id = all_w.{prompt_column}
+            WHERE all_w.id >= (SELECT id FROM start) AND {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT 1)
+            UNION ALL
+            (SELECT answer_w.word AS answer, prompt_w.word AS prompt
+            FROM all_words all_w
+            JOIN {answer_table} answer_w ON answer_w.id = all_w.{answer_column}
+            JOIN {prompt_table} prompt_w ON prompt_w.id = all_w.{prompt_column}
+            WHERE {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT 1)
+            LIMIT 1
+        ), candidates AS (
+            SELECT picked.word, 0 AS priority
+            FROM probes p
+            CROSS JOIN LATERAL (
+                SELECT answer_w.word
+                FROM all_words all_w
+                JOIN {answer_table} answer_w ON answer_w.id = all_w.{answer_column}
+                WHERE all_w.id >= p.start AND {VISIBLE_TO_USER}
+                ORDER BY all_w.id
+                LIMIT 1
+            ) picked
+            UNION ALL
+            (SELECT answer_w.word, 1 AS priority
+            FROM all_words all_w
+            JOIN {answer_table} answer_w ON answer_w.id = all_w.{answer_column}
+            WHERE {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT %(limit)s + 1)
+        )
+        SELECT card.answer, card.prompt, ARRAY(
+            SELECT min(word)
+            FROM candidates
+            WHERE word_key(word) != word_key(card.answer)
+            GROUP BY word_key(word)
+            ORDER BY min(priority), random()
+            LIMIT %(limit)s
+        )
+        FROM card;
+    """
+
+
+BUILD_CARD_TO_RUSSIAN = _build_card('russian_words', 'russian_words_id', 'english_words', 'english_words_id')
+BUILD_CARD_TO_ENGLISH = _build_card('english_words', 'english_words_id', 'russian_words', 'russian_words_id')
+
+
+# Пачка случайных пар слов для очереди карточек (см. main.random_pairs_from_db)
+RANDOM_PAIRS = f"""
+    WITH bounds AS (
+        SELECT min(id) AS lo, max(id) - min(id) + 1 AS span FROM all_words
+    ), probes AS (
+        SELECT lo + floor(random() * span)::int AS start
+        FROM bounds, generate_series(1, %(probes)s)
+    ), candidates AS (
+        SELECT picked.id, 0 AS priority
+        FROM probes p
+        CROSS JOIN LATERAL (
+            SELECT all_w.id
+            FROM all_words all_w
+            WHERE all_w.id >= p.start AND {VISIBLE_TO_USER}
+            ORDER BY all_w.id
+            LIMIT 1
+        ) picked
+        UNION ALL
+        (SELECT all_w.id, 1 AS priority
+        FROM all_words all_w
+        WHERE {VISIBLE_TO_USER}
+        ORDER BY all_w.id
+        LIMIT %(count)s)
+    ), chosen AS (
+        SELECT id
+        FROM candidates
+        GROUP BY id
+        ORDER BY min(priority), random()
+        LIMIT %(count)s
+    )
+    SELECT all_w.id, rus_w.word, en_w.word
+    FROM chosen
+    JOIN all_words all_w ON all_w.id = chosen.id
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id;
+"""
+
+
+# Общий словарь для vocabulary.Vocabulary (см. main.load_shared_vocabulary): все пары, не связанные ни с одним
+# пользователем. Порядок по id нужен, чтобы после загрузки новых пар прежние слова шли в том же порядке и
+# distractors.py обработал только новые
+VOCABULARY_VERSION = """
+    SELECT version FROM vocabulary_version
+"""
+
+SHARED_PAIRS = """
+    SELECT all_w.id, rus_w.word, en_w.word
+    FROM all_words all_w
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    WHERE NOT EXISTS (SELECT 1 FROM user_words u_w WHERE u_w.all_words_id = all_w.id)
+    ORDER BY all_w.id
+"""
+
+# Пары, добавленные пользователем (см. main.user_pairs_from_db)
+USER_PAIRS = """
+    SELECT all_w.id, rus_w.word, en_w.word
+    FROM user_words u_w
+    JOIN all_words all_w ON all_w.id = u_w.all_words_id
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    WHERE u_w.user_id = %(user_id)s
+"""
+
+
+# Пользователи
+USER_EXISTS = """
+    SELECT * FROM users
+    WHERE id = %s
+"""
+
+ADD_USER = """
+    INSERT INTO users (id, name)
+    VALUES (%s, %s)
+"""
+
+
+# Добавление пар слов пользователя одним запросом (см. main.add_words_to_dictionary). Пары передаются двумя
+# массивами одинаковой длины: english_words[i] - перевод russian_words[i].
+# Слова сравниваются по нормализованному ключу word_key (см. normalization.py): слово, которое отличается от
+# существующего только регистром, пробелами или ё/е, не создаётся заново. ON CONFLICT без указания индекса
+# срабатывает и на уникальном индексе по word, и на индексе по word_key, который создаёт normalize_words.py.
+# Слова и пары, которые уже есть в базе, не создаются заново, а переиспользуются. Пара связывается с пользователем,
+# только если она ему ещё не видна: общую пару или пару, уже добавленную пользователем, добавить нельзя. Запрос
+# возвращает число пар, добавленных в словарь пользователя, и новое число его слов. Триггер обновит user_stats
+# только в конце запроса, поэтому новое число считается как старое плюс добавленные.
+ADD_USER_WORDS = f"""
+    WITH input AS (
+        SELECT DISTINCT ON (word_key(english), word_key(russian))
+        english, russian, word_key(english) AS english_key, word_key(russian) AS russian_key
+        FROM unnest(%(english_words)s::text[], %(russian_words)s::text[]) AS i(english, russian)
+    ),
+    new_english AS (
+        INSERT INTO english_words (word)
+        SELECT DISTINCT ON (english_key) english FROM input
+        WHERE NOT EXISTS (SELECT 1 FROM english_words en_w WHERE en_w.word_key = input.english_key)
+        ON CONFLICT DO NOTHING
+        RETURNING id, word_key
+    ),
+    english AS (
+        SELECT DISTINCT ON (word_key) id, word_key
+        FROM (
+            SELECT id, word_key FROM new_english
+            UNION ALL
+            SELECT en_w.id, en_w.word_key FROM english_words en_w
+            WHERE en_w.word_key IN (SELECT english_key FROM input)
+        ) found
+        ORDER BY word_key, id
+    ),
+    new_russian AS (
+        INSERT INTO russian_words (word)
+        SELECT DISTINCT ON (russian_key) russian FROM input
+        WHERE NOT EXISTS (SELECT 1 FROM russian_words rus_w WHERE rus_w.word_key = input.russian_key)
+        ON CONFLICT DO NOTHING
+        RETURNING id, word_key
+    ),
+    russian AS (
+        SELECT DISTINCT ON (word_key) id, word_key
+        FROM (
+            SELECT id, word_key FROM new_russian
+            UNION ALL
+            SELECT rus_w.id, rus_w.word_key FROM russian_words rus_w
+            WHERE rus_w.word_key IN (SELECT russian_key FROM input)
+        ) found
+        ORDER BY word_key, id
+    ),
+    pairs AS (
+        SELECT english.id AS english_id, russian.id AS russian_id
+        FROM input
+        JOIN english ON english.word_key = input.english_key
+        JOIN russian ON russian.word_key = input.russian_key
+    ),
+    existing AS (
+        SELECT DISTINCT ON (pairs.english_id, pairs.russian_id) all_w.id, pairs.english_id, pairs.russian_id
+        FROM pairs
+        JOIN all_words all_w
+        ON all_w.english_words_id = pairs.english_id AND all_w.russian_words_id = pairs.russian_id
+        ORDER BY pairs.english_id, pairs.russian_id, all_w.id
+    ),
+    new_pairs AS (
+        INSERT INTO all_words (english_words_id, russian_words_id)
+        SELECT english_id, russian_id FROM pairs
+        WHERE NOT EXISTS (
+            SELECT 1 FROM existing
+            WHERE existing.english_id = pairs.english_id AND existing.russian_id = pairs.russian_id
+        )
+        RETURNING id
+    ),
+    targets AS (
+        SELECT id FROM new_pairs
+        UNION ALL
+        SELECT all_w.id FROM existing all_w
+        WHERE NOT {VISIBLE_TO_USER}
+    ),
+    new_links AS (
+        INSERT INTO user_words (user_id, all_words_id)
+        SELECT %(user_id)s, id FROM targets
+        ON CONFLICT (user_id, all_words_id) DO NOTHING
+        RETURNING all_words_id
+    )
+    SELECT count(*),
+    coalesce((SELECT word_count FROM user_stats WHERE user_id = %(user_id)s), 0) + count(*)
+    FROM new_links
+"""
+
+# Удаление слов пользователя одним запросом (см. main.delete_words_from_dictionary). Слово может быть английским
+# или русским и ищется по нормализованному ключу word_key, одной проверкой индекса на слово. Удаляются только связи
+# самого пользователя; пара удаляется, если она больше никому не принадлежит, а слово - если оно больше не входит ни
+# в одну пару. Все подзапросы видят одну и ту же версию таблиц, поэтому удаляемые в этом же запросе строки
+# исключаются явно. Запрос возвращает число удалённых пар пользователя.
+DELETE_USER_WORDS = """
+    WITH keys AS (
+        SELECT DISTINCT word_key(word) AS word_key
+        FROM unnest(%(words)s::text[]) AS w(word)
+    ),
+    matched AS (
+        SELECT all_w.id
+        FROM english_words en_w
+        JOIN all_words all_w ON all_w.english_words_id = en_w.id
+        WHERE en_w.word_key IN (SELECT word_key FROM keys)
+        UNION
+        SELECT all_w.id
+        FROM russian_words rus_w
+        JOIN all_words all_w ON all_w.russian_words_id = rus_w.id
+        WHERE rus_w.word_key IN (SELECT word_key FROM keys)
+    ),
+    target AS (
+        SELECT u_w.id, u_w.all_words_id
+        FROM matched
+        JOIN user_words u_w ON u_w.all_words_id = matched.id AND u_w.user_id = %(user_id)s
+    ),
+    deleted_links AS (
+        DELETE FROM user_words u_w
+        USING target
+        WHERE u_w.id = target.id
+        RETURNING u_w.all_words_id
+    ),
+    deleted_pairs AS (
+        DELETE FROM all_words all_w
+        WHERE all_w.id IN (SELECT all_words_id FROM target)
+        AND NOT EXISTS (
+            SELECT 1 FROM user_words u_w
+            WHERE u_w.all_words_id = all_w.id AND u_w.id NOT IN (SELECT id FROM target)
+        )
+        RETURNING all_w.id, all_w.english_words_id, all_w.russian_words_id
+    ),
+    deleted_english AS (
+        DELETE FROM english_words en_w
+        WHERE en_w.id IN (SELECT english_words_id FROM deleted_pairs)
+        AND NOT EXISTS (
+            SELECT 1 FROM all_words all_w
+            WHERE all_w.english_words_id = en_w.id AND all_w.id NOT IN (SELECT id FROM deleted_pairs)
+        )
+    ),
+    deleted_russian AS (
+        DELETE FROM russian_words rus_w
+        WHERE rus_w.id IN (SELECT russian_words_id FROM deleted_pairs)
+        AND NOT EXISTS (
+            SELECT 1 FROM all_words all_w
+            WHERE all_w.russian_words_id = rus_w.id AND all_w.id NOT IN (SELECT id FROM deleted_pairs)
+        )
+    )
+    SELECT count(*) FROM deleted_links
+"""
+
+
+# Количество слов пользователя (см. main.adding_a_word_by_the_user). Счётчик поддерживают триггеры на user_words
+COUNT_USER_WORDS = """
+    SELECT word_count FROM user_stats
+    WHERE user_id = %s
+"""
+
+# Повторения пользователя, начиная с самых просроченных (см. main.load_reviews)
+LOAD_REVIEWS = """
+    SELECT r.all_words_id, rus_w.word, en_w.word, extract(epoch FROM r.due_at), r.interval_seconds, r.ease,
+    r.repetitions
+    FROM word_reviews r
+    JOIN all_words all_w ON all_w.id = r.all_words_id
+    JOIN russian_words rus_w ON rus_w.id = all_w.russian_words_id
+    JOIN english_words en_w ON en_w.id = all_w.english_words_id
+    WHERE r.user_id = %(user_id)s
+    ORDER BY r.due_at
+    LIMIT %(limit)s
+"""
+
+# Пачка ответов и изменённых повторений (см. main.save_events). Строки подставляет execute_values. У answer_log нет
+# внешнего ключа: это журнал, и ответы на пары, удалённые после ответа, в нём остаются
+ADD_ANSWERS = """
+    INSERT INTO answer_log (user_id, all_words_id, correct, answered_at)
+    VALUES %s
+"""
+ADD_ANSWERS_TEMPLATE = "(%s, %s, %s, to_timestamp(%s))"
+
+# Повторения пар, удалённых после ответа, пропускаются соединением с all_words, иначе вся пачка упала бы на внешнем
+# ключе word_reviews
+SAVE_REVIEWS = """
+    INSERT INTO word_reviews AS r (user_id, all_words_id, due_at, interval_seconds, ease, repetitions)
+    SELECT v.user_id, v.all_words_id, to_timestamp(v.due_at), v.interval_seconds, v.ease, v.repetitions
+    FROM (VALUES %s) AS v(user_id, all_words_id, due_at, interval_seconds, ease, repetitions)
+    JOIN all_words all_w ON all_w.id = v.all_words_id
+    ON CONFLICT (user_id, all_words_id) DO UPDATE
+    SET due_at = EXCLUDED.due_at, interval_seconds = EXCLUDED.interval_seconds, ease = EXCLUDED.ease,
+    repetitions = EXCLUDED.repetitions
+"""
+SAVE_REVIEWS_TEMPLATE = "(%s::bigint, %s::integer, %s::double precision, %s::double precision, %s::real, %s::integer)"
+
+# Ответы пользователей из пачки, сложенные по пользователю (см. main.save_events). Пользователи, которых нет в users,
+# пропускаются соединением, иначе вся пачка упала бы на внешнем ключе user_stats
+ADD_ANSWER_STATS = """
+    INSERT INTO user_stats AS s (user_id, right_answers, wrong_answers)
+    SELECT v.user_id, v.right_answers, v.wrong_answers
+    FROM (VALUES %s) AS v(user_id, right_answers, wrong_answers)
+    JOIN users ON users.id = v.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET right_answers = s.right_answers + EXCLUDED.right_answers,
+    wrong_answers = s.wrong_answers + EXCLUDED.wrong_answers,
+    last_activity = now()
+"""
+ADD_ANSWER_STATS_TEMPLATE = "(%s::bigint, %s::bigint, %s::bigint)"
+
+# Добавленные и удалённые слова из пачки (см. main.save_events)
+ADD_WORD_EVENTS = """
+    INSERT INTO word_events (user_id, action, word, happened_at)
+    VALUES %s
+"""
+ADD_WORD_EVENTS_TEMPLATE = "(%s, %s, left(%s, 60), to_timestamp(%s))"
+
+
+# Запросы, которые main.py выполняет подготовленными (prepared.py). Сюда не входят SHARED_PAIRS (читается серверным
+# курсором) и запросы execute_values: текст VALUES у них зависит от размера пачки
+PREPARED = (
+    'RANDOM_WORDS', 'RANDOM_ENGLISH_WORDS', 'RANDOM_RUSSIAN_WORDS', 'BUILD_CARD_TO_RUSSIAN', 'BUILD_CARD_TO_ENGLISH',
+    'RANDOM_PAIRS', 'VOCABULARY_VERSION', 'USER_PAIRS', 'USER_EXISTS', 'ADD_USER', 'ADD_USER_WORDS',
+    'DELETE_USER_WORDS', 'COUNT_USER_WORDS', 'LOAD_REVIEWS',
+)
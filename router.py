@@ -0,0 +1,124 @@
+"""
+Dispatch of the text messages of the bot to their handlers.
+
+telebot checks the filters of the message handlers one after another for every update, so every command added as
+func=lambda message: message.text == ... makes all messages slower. Router is registered as the only message handler
+and finds the handler with at most two dictionary lookups: first the exact text of the message among the commands
+(a command with a slash is looked up without its arguments and without @bot_name), then the pair (step of the dialogue,
+kind of input) in the table of the dialogue. The cost of dispatch does not depend on the number of commands, see
+benchmarks/bench_router.py.
+
+The time of every route (the dispatch and the handler) is recorded in the histogram bot_route_seconds of the
+handler (see metrics.py) and returned by stats(), and logged as the sampled handler event (see logs.py).
+"""
+import logging
+import time
+
+from logs import handler_event
+from metrics import route_histogram
+
+logger = logging.getLogger(__name__)
+
+# Вид ввода, подходящий к любому типу содержимого сообщения
+ANY = '*'
+
+
+class Router:
+    """
+    :param load_state: Function (message) that returns the dialogue state of the user (state_store.UserState)
+    :param default: Handler (message, state) for the messages no route matches, None - ignore them
+    """
+
+    def __init__(self, load_state, default=None):
+        self.load_state = load_state
+        self.default = default
+        self._commands = {}  # текст команды -> обработчик (message)
+        self._steps = {}  # (шаг диалога, вид ввода) -> обработчик (message, state)
+        self._histograms = {}  # обработчик -> гистограмма времени
+        if default is not None:
+            self._add_histogram(default)
+
+    def _add_histogram(self, handler):
+        if handler not in self._histograms:
+            self._histograms[handler] = route_histogram(handler.__name__)
+
+    def command(self, *texts):
+        """
+        Decorator that registers a handler (message) for the messages with exactly one of the texts, for example
+        Commands.NEXT or '/cards'.
+        """
+        def register(handler):
+            for text in texts:
+                self._commands[text] = handler
+            self._add_histogram(handler)
+            return handler
+        return register
+
+    def step(self, status, kind='text'):
+        """
+        Decorator that registers a handler (message, state) for the messages of the users at the step status of the
+        dialogue (bot_common.Status) with content_type kind; ANY matches every content_type.
+        """
+        def register(handler):
+            self._steps[(status, kind)] = handler
+            self._add_histogram(handler)
+            return handler
+        return register
+
+    @staticmethod
+    def command_key(text):
+        if text and text[0] == '/':
+            # "/cards@fake_bot 10" -> "/cards"
+            return text.split(maxsplit=1)[0].partition('@')[0]
+        return text
+
+    def route(self, message):
+        """
+        Finds the handler of the message.
+
+        :param message: telebot.types.Message
+        :return: (handler, state): state is None for a command; (None, state) if no route matches
+        """
+        handler = self._commands.get(self.command_key(message.text))
+        if handler is not None:
+            return handler, None
+        state = self.load_state(message)
+        handler = self._steps.get((state.status, message.content_type))
+        if handler is None:
+            handler = self._steps.get((state.status, ANY), self.default)
+        return handler, state
+
+    def dispatch(self, message):
+        """
+        Calls the handler of the message. It is registered in telebot as the only message handler.
+
+        :param message: telebot.types.Message
+        """
+        started = time.perf_counter()
+        handler, state = self.route(message)
+        if handler is None:
+            return
+        outcome = 'error'
+        try:
+            if state is None:
+                handler(message)
+            else:
+                handler(message, state)
+            outcome = 'ok'
+        finally:
+            seconds = time.perf_counter() - started
+            self._histograms[handler].observe(seconds)
+            handler_event(logger, handler.__name__, message, seconds, outcome)
+
+    def stats(self):
+        """
+        Returns a dictionary name of the handler -> {'count', 'seconds', 'mean_seconds', 'max_seconds'} for the
+        handlers that have been called.
+        """
+        result = {}
+        for handler, histogram in self._histograms.items():
+            _, seconds, count, max_seconds = histogram.snapshot()
+            if count:
+                result[handler.__name__] = {'count': count, 'seconds': seconds, 'mean_seconds': seconds / count,
+                                            'max_seconds': max_seconds}
+        return result
@@ -0,0 +1,233 @@
+"""
+Spaced repetition of the words the user has already answered.
+
+Every answered word gets a Review with the SM-2 parameters (interval, ease, repetitions) and the time it is due
+again. The reviews of a user are kept in a heap ordered by due_at, so the most overdue word is found in O(log n).
+Words that are not due yet are not shown; then the bot shows a new random card from CardQueue instead.
+
+The answers and the changed reviews are not written here: they are put into events.EventBuffer, which appends them
+to answer_log and word_reviews in batches, not one query per answer. When the reviews of a user are loaded, the ones
+still waiting in the buffer are applied over the rows from the database, so a reply never waits for a write.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+DAY = 24 * 60 * 60
+# Через сколько секунд повторить слово, на которое пользователь ответил неверно
+RELEARN_DELAY = 10 * 60
+# Через сколько секунд снова показать слово, которое показали, но на которое пользователь не ответил
+RETRY_DELAY = 60
+MIN_EASE = 1.3
+
+
+class Review:
+    """
+    Repetition state of one word of one user.
+    """
+    __slots__ = ('word_id', 'russian', 'english', 'due_at', 'interval', 'ease', 'repetitions')
+
+    def __init__(self, word_id, russian, english, due_at=0.0, interval=0.0, ease=2.5, repetitions=0):
+        self.word_id = word_id
+        self.russian = russian
+        self.english = english
+        self.due_at = due_at
+        self.interval = interval
+        self.ease = ease
+        self.repetitions = repetitions
+
+
+def sm2(review, correct, now):
+    """
+    Updates the review after an answer by the SM-2 algorithm. The answers of the bot are only right or wrong, so
+    a right answer counts as quality 4 and a wrong one as quality 1.
+
+    :param review: Review to update
+    :param correct: True if the answer is right
+    :param now: Time of the answer (time.time())
+    """
+    quality = 4 if correct else 1
+    if correct:
+        review.repetitions += 1
+        if review.repetitions == 1:
+            review.interval = DAY
+        elif review.repetitions == 2:
+            review.interval = 6 * DAY
+        else:
+            review.interval *= review.ease
+    else:
+        review.repetitions = 0
+        review.interval = RELEARN_DELAY
+    review.ease = max(MIN_EASE, review.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    review.due_at = now + review.interval
+
+
+class _UserSchedule:
+    """
+    Reviews of one user and the heap of (due_at, word_id). A changed review is pushed again, and the old heap entry
+    is skipped when it comes to the top (its due_at no longer matches the review).
+    """
+    __slots__ = ('reviews', 'heap', 'horizon')
+
+    def __init__(self, reviews, horizon):
+        self.reviews = {review.word_id: review for review in reviews}
+        self.heap = [(review.due_at, review.word_id) for review in reviews]
+        heapq.heapify(self.heap)
+        # Если загружены не все повторения, horizon - время самого позднего загруженного; более поздние остались в БД
+        self.horizon = horizon
+
+    def push(self, review):
+        heapq.heappush(self.heap, (review.due_at, review.word_id))
+        if len(self.heap) > 2 * len(self.reviews) + 64:
+            # Устаревших записей накопилось много - пересобираем кучу
+            self.heap = [(review.due_at, review.word_id) for review in self.reviews.values()]
+            heapq.heapify(self.heap)
+
+    def top(self):
+        while self.heap:
+            due_at, word_id = self.heap[0]
+            review = self.reviews.get(word_id)
+            if review is not None and review.due_at == due_at:
+                return review
+            heapq.heappop(self.heap)
+        return None
+
+
+class Scheduler:
+    """
+    Chooses the word to repeat and records the answers.
+
+    :param load_reviews: Function (user_id, limit) -> list of tuples (all_words ID, Russian word, English word, due_at,
+    interval, ease, repetitions) ordered by due_at
+    :param events: events.EventBuffer that saves the answers and the reviews
+    :param max_users: Maximum number of users whose reviews are kept in memory
+    :param max_reviews: Maximum number of reviews of one user loaded at once
+    :param visible_pairs: Function (user_id) -> container of the all_words IDs the user can see, or None if it is not
+    known (vocabulary.Vocabulary.visible_pairs); the reviews of other pairs, for example of deleted words, are dropped
+    """
+
+    def __init__(self, load_reviews, events, max_users=10000, max_reviews=1000, visible_pairs=None):
+        self.load_reviews = load_reviews
+        self.events = events
+        self.visible_pairs = visible_pairs
+        self.max_users = max_users
+        self.max_reviews = max_reviews
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._stats = {'due': 0, 'not_due': 0, 'answers': 0, 'loads': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _load(self, user_id):
+        # Несохранённые повторения берутся до чтения из БД: если их пачка запишется в это время, они уже будут в БД
+        pending = self.events.pending_reviews(user_id)
+        rows = self.load_reviews(user_id, self.max_reviews) or []
+        horizon = rows[-1][3] if len(rows) >= self.max_reviews else None
+        reviews = {row[0]: Review(*row) for row in rows}
+        # Повторения, которые ещё не записаны в БД, новее прочитанных из неё
+        for word_id, russian, english, *state in pending:
+            review = reviews.get(word_id)
+            if review is not None:
+                review.due_at, review.interval, review.ease, review.repetitions = state
+            elif russian is not None:
+                reviews[word_id] = Review(word_id, russian, english, *state)
+        visible = self.visible_pairs(user_id) if self.visible_pairs is not None else None
+        if visible is None:
+            reviews = list(reviews.values())
+        else:
+            # Слово, удалённое пользователем, не должно возвращаться ни из БД, ни из несохранённых повторений
+            reviews = [review for review in reviews.values() if review.word_id in visible]
+        with self._lock:
+            self._stats['loads'] += 1
+        return _UserSchedule(reviews, horizon)
+
+    def _schedule(self, user_id, reload=False):
+        """
+        Returns the schedule of the user, loading it from the database if it is not in memory. The database is
+        queried without holding the lock, so a load does not delay the other users.
+        """
+        if not reload:
+            with self._lock:
+                schedule = self._users.get(user_id)
+                if schedule is not None:
+                    self._users.move_to_end(user_id)
+                    return schedule
+        schedule = self._load(user_id)
+        with self._lock:
+            if reload:
+                self._users[user_id] = schedule
+            else:
+                schedule = self._users.setdefault(user_id, schedule)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self._stats['evictions'] += 1
+        return schedule
+
+    def next_due(self, user_id, now=None):
+        """
+        Returns the most overdue review of the user, or None if no word is due. The returned word is put back
+        RETRY_DELAY seconds later, so that it is not shown again and again if the user skips it.
+
+        :param user_id: User ID
+        :param now: Current time (time.time())
+        :return: Review or None
+        """
+        now = time.time() if now is None else now
+        schedule = self._schedule(user_id)
+        with self._lock:
+            review = schedule.top()
+            stale = schedule.horizon is not None and (review is None or review.due_at > schedule.horizon)
+        if stale:
+            # Загруженные повторения отодвинулись дальше тех, что остались в БД
+            schedule = self._schedule(user_id, reload=True)
+        with self._lock:
+            review = schedule.top()
+            if review is None or review.due_at > now:
+                self._stats['not_due'] += 1
+                return None
+            self._stats['due'] += 1
+            review.due_at = now + RETRY_DELAY
+            schedule.push(review)
+            return review
+
+    def answer(self, user_id, word_id, russian, english, correct, now=None):
+        """
+        Records the answer of the user to the card of the word and schedules the next repetition of the word.
+
+        :param user_id: User ID
+        :param word_id: ID of the pair in all_words
+        :param russian: Russian word of the pair
+        :param english: English word of the pair
+        :param correct: True if the answer is right
+        :param now: Time of the answer (time.time())
+        """
+        now = time.time() if now is None else now
+        schedule = self._schedule(user_id)
+        with self._lock:
+            review = schedule.reviews.get(word_id)
+            if review is None:
+                review = schedule.reviews[word_id] = Review(word_id, russian, english)
+            sm2(review, correct, now)
+            schedule.push(review)
+            self._stats['answers'] += 1
+            saved = (user_id, word_id, review.due_at, review.interval, review.ease, review.repetitions)
+        self.events.answer(user_id, word_id, correct, saved, now, words=(russian, english))
+
+    def invalidate(self, user_id):
+        """
+        Drops the reviews of the user kept in memory; they are loaded again on the next card. It must be called after
+        the user adds or deletes a word, so that a deleted word is not shown for repetition.
+
+        :param user_id: User ID
+        """
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['users'] = len(self._users)
+            result['reviews'] = sum(len(schedule.reviews) for schedule in self._users.values())
+        return result
+
@@ -0,0 +1,361 @@
+"""
+Outbound message scheduler: the handlers put messages into a queue and never wait for the Bot API.
+
+Telegram limits how fast a bot may send: about 30 messages per second in total and about one message per second to one
+chat; above that it answers 429 Too Many Requests with retry_after. Sender keeps a global token bucket and a token
+bucket per chat and sends a message only when both have a token, so the limits are not hit in the first place. Several
+worker threads send in parallel, but the messages of one chat are sent one after another in the order they were
+queued. The chats with messages waiting are taken by priority: quiz cards (CARD) before ordinary replies (REPLY) and
+before bulk notifications (BULK). If Telegram still answers 429, the message is put back at the head of its chat and
+the chat and the global bucket are paused for retry_after seconds.
+
+A message without a keyboard that is still waiting for its turn is merged with the next message of the same chat (for
+example the feedback on an answer with the next card), so the chat spends one token instead of two. Edits of a message
+(edit()) go through the same queue; an edit that has not been sent yet is replaced by a later edit of the same message.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты сообщений: чем меньше число, тем раньше отправляется
+CARD, REPLY, BULK = range(3)
+
+# Максимальная длина текста сообщения в Telegram
+MAX_TEXT_LENGTH = 4096
+# Разделитель текстов объединённых сообщений
+MERGE_SEPARATOR = '\n\n'
+# Через сколько секунд простоя забываются корзины чатов
+CHAT_IDLE_SECONDS = 60.0
+
+
+class TokenBucket:
+    """
+    Allows rate operations per second on average and up to capacity operations at once.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """
+        :return: Number of seconds until a token is available, 0 if it is available now
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Message:
+    __slots__ = ('priority', 'message_id', 'text', 'reply_markup', 'kwargs', 'queued_at', 'attempts')
+
+    def __init__(self, priority, message_id, text, reply_markup, kwargs, queued_at):
+        self.priority = priority
+        self.message_id = message_id  # None - новое сообщение, иначе номер изменяемого сообщения
+        self.text = text
+        self.reply_markup = reply_markup
+        self.kwargs = kwargs
+        self.queued_at = queued_at
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ('messages', 'bucket', 'paused_until', 'busy', 'entry', 'priority')
+
+    def __init__(self, bucket):
+        self.messages = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.busy = False  # Сообщение чата сейчас отправляется
+        self.entry = None  # Номер действующей записи чата в очереди, None - чата в очереди нет
+        self.priority = BULK
+
+
+class Sender:
+    """
+    :param bot: telebot.TeleBot, its send_message() and edit_message_text() are called by the worker threads
+    :param global_rate: Messages per second for all chats together, None - no limit
+    :param global_burst: Messages that may be sent at once for all chats together
+    :param chat_rate: Messages per second to one chat, None - no limit
+    :param chat_burst: Messages that may be sent at once to one chat
+    :param workers: Number of threads sending messages
+    :param max_messages: Maximum number of waiting messages; new messages above it are dropped
+    :param max_retries: How many times a message is sent again after 429
+    """
+
+    def __init__(self, bot, global_rate=25.0, global_burst=5, chat_rate=1.0, chat_burst=2, workers=4,
+                 max_messages=100000, max_retries=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_messages = max_messages
+        self.max_retries = max_retries
+        now = time.monotonic()
+        self._global = TokenBucket(global_rate, global_burst, now) if global_rate else None
+        self._paused_until = 0.0
+        self._chats = {}
+        self._ready = []  # (приоритет, номер записи, chat_id) - чаты, которые можно отправлять
+        self._delayed = []  # (время, приоритет, номер записи, chat_id) - чаты, ждущие токен или конец паузы
+        self._entries = itertools.count()
+        self._queued = 0
+        self._busy = 0
+        self._closed = False
+        self._purged_at = now
+        self._condition = threading.Condition()
+        self._stats = {'queued': 0, 'sent': 0, 'merged': 0, 'dropped': 0, 'failed': 0, 'retries': 0,
+                       'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        self._threads = [threading.Thread(target=self._run, name=f'sender-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, chat_id, text, reply_markup=None, priority=REPLY, **kwargs):
+        """
+        Queues a message to the chat.
+
+        :param chat_id: Chat ID
+        :param text: Text of the message
+        :param reply_markup: Keyboard of the message
+        :param priority: CARD, REPLY or BULK
+        :param kwargs: Other arguments of bot.send_message()
+        :return: False if the message was dropped because the sender is closed or the queue is full
+        """
+        return self._put(chat_id, None, text, reply_markup, priority, kwargs)
+
+    def edit(self, chat_id, message_id, text, reply_markup=None, priority=CARD, **kwargs):
+        """
+        Queues a change of the text and the keyboard of a message sent earlier.
+
+        :param chat_id: Chat ID
+        :param message_id: ID of the message to change
+        :param text: New text of the message
+        :param reply_markup: New inline keyboard of the message
+        :param priority: CARD, REPLY or BULK
+        :param kwargs: Other arguments of bot.edit_message_text()
+        :return: False if the change was dropped because the sender is closed or the queue is full
+        """
+        return self._put(chat_id, message_id, text, reply_markup, priority, kwargs)
+
+    def _merge(self, last, message_id, text, reply_markup, kwargs):
+        """
+        Merges the new message into the last waiting message of the chat if possible.
+
+        :return: True if merged
+        """
+        if last.kwargs != kwargs:
+            return False
+        if message_id is not None:
+            if last.message_id != message_id:
+                return False
+            # Неотправленное изменение того же сообщения заменяется новым
+            last.text = text
+        elif (last.message_id is not None or last.reply_markup is not None
+              or len(last.text) + len(MERGE_SEPARATOR) + len(text) > MAX_TEXT_LENGTH):
+            return False
+        else:
+            # Сообщение без клавиатуры ещё ждёт очереди - отправляем оба одним сообщением
+            last.text = last.text + MERGE_SEPARATOR + text
+        last.reply_markup = reply_markup
+        return True
+
+    def _put(self, chat_id, message_id, text, reply_markup, priority, kwargs):
+        with self._condition:
+            if self._closed:
+                return False
+            now = time.monotonic()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now) if self.chat_rate else None
+                chat = self._chats[chat_id] = _Chat(bucket)
+            if chat.messages and self._merge(chat.messages[-1], message_id, text, reply_markup, kwargs):
+                last = chat.messages[-1]
+                last.priority = min(last.priority, priority)
+                self._stats['merged'] += 1
+                if not chat.busy and priority < chat.priority:
+                    self._schedule(chat_id, chat)
+                return True
+            if self._queued >= self.max_messages:
+                self._stats['dropped'] += 1
+                return False
+            chat.messages.append(_Message(priority, message_id, text, reply_markup, kwargs, now))
+            self._queued += 1
+            self._stats['queued'] += 1
+            if not chat.busy and (chat.entry is None or priority < chat.priority):
+                self._schedule(chat_id, chat)
+        return True
+
+    def _schedule(self, chat_id, chat, at=None):
+        """
+        Puts the chat into the queue by the most urgent of its messages: the messages of a chat are sent in order, so
+        a card behind a notification lifts the whole chat. The previous record of the chat, if any, stays in the heap
+        and is skipped when it is taken. Called with the condition held.
+        """
+        chat.entry = next(self._entries)
+        chat.priority = min(message.priority for message in chat.messages)
+        if at is None:
+            heapq.heappush(self._ready, (chat.priority, chat.entry, chat_id))
+        else:
+            heapq.heappush(self._delayed, (at, chat.priority, chat.entry, chat_id))
+        self._condition.notify_all()
+
+    def _next(self):
+        """
+        Waits for a message that may be sent now and takes a token for it from both buckets.
+
+        :return: (chat_id, _Message) or None when the sender is closed and the queue is empty
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, priority, entry, chat_id = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, entry, chat_id))
+                if self._closed and not self._queued:
+                    self._condition.notify_all()
+                    return None
+
+                wait = None
+                if self._ready:
+                    wait = self._paused_until - now
+                    if self._global is not None:
+                        wait = max(wait, self._global.delay(now))
+                if wait is not None and wait <= 0:
+                    priority, entry, chat_id = heapq.heappop(self._ready)
+                    chat = self._chats.get(chat_id)
+                    if chat is None or chat.entry != entry:
+                        continue  # Устаревшая запись: чат уже поставлен в очередь заново
+                    chat_wait = chat.paused_until - now
+                    if chat.bucket is not None:
+                        chat_wait = max(chat_wait, chat.bucket.delay(now))
+                    if chat_wait > 0:
+                        heapq.heappush(self._delayed, (now + chat_wait, priority, entry, chat_id))
+                        continue
+                    if chat.bucket is not None:
+                        chat.bucket.take(now)
+                    if self._global is not None:
+                        self._global.take(now)
+                    chat.entry = None
+                    chat.busy = True
+                    self._busy += 1
+                    return chat_id, chat.messages.popleft()
+
+                if self._delayed:
+                    wait = min(wait if wait is not None else float('inf'), self._delayed[0][0] - now)
+                self._purge(now)
+                self._condition.wait(wait)
+
+    def _purge(self, now):
+        """
+        Forgets the chats that have nothing to send and whose buckets are full again.
+        """
+        if now - self._purged_at < CHAT_IDLE_SECONDS:
+            return
+        self._purged_at = now
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.messages and not chat.busy and chat.paused_until <= now
+                and (chat.bucket is None or chat.bucket.full(now))]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _run(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            chat_id, message = task
+            retry_after = None
+            try:
+                if message.message_id is None:
+                    self.bot.send_message(chat_id, message.text, reply_markup=message.reply_markup, **message.kwargs)
+                else:
+                    self.bot.edit_message_text(message.text, chat_id, message.message_id,
+                                               reply_markup=message.reply_markup, **message.kwargs)
+                outcome = 'sent'
+            except Exception as ex:
+                # telebot.apihelper.ApiTelegramException: при 429 Telegram сообщает, сколько секунд ждать
+                if getattr(ex, 'error_code', None) == 429 and message.attempts < self.max_retries:
+                    parameters = (getattr(ex, 'result_json', None) or {}).get('parameters') or {}
+                    retry_after = float(parameters.get('retry_after', 1))
+                    outcome = 'retries'
+                else:
+                    logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+                    outcome = 'failed'
+            self._done(chat_id, message, outcome, retry_after)
+
+    def _done(self, chat_id, message, outcome, retry_after):
+        with self._condition:
+            now = time.monotonic()
+            chat = self._chats[chat_id]
+            chat.busy = False
+            self._busy -= 1
+            self._stats[outcome] += 1
+            if retry_after is not None:
+                # Сообщение возвращается в начало очереди чата, чат и общая корзина ждут retry_after секунд
+                message.attempts += 1
+                chat.messages.appendleft(message)
+                chat.paused_until = now + retry_after
+                self._paused_until = max(self._paused_until, now + retry_after)
+            else:
+                self._queued -= 1
+                if outcome == 'sent':
+                    waited = now - message.queued_at
+                    self._stats['wait_seconds'] += waited
+                    self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+            if chat.messages:
+                self._schedule(chat_id, chat, chat.paused_until if chat.paused_until > now else None)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until all queued messages are sent.
+
+        :return: False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queued:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        Sends the queued messages (waiting at most timeout seconds) and stops the worker threads.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        """
+        Returns the counters of the sender, the number of waiting messages and of known chats.
+        """
+        with self._condition:
+            result = dict(self._stats)
+            result['waiting'] = self._queued
+            result['chats'] = len(self._chats)
+        return result
@@ -0,0 +1,396 @@
+"""
+Storage of the conversation state of the users: the step of the add/delete dialogue, the English word being added,
+the telebot state and the card the user is answering.
+
+MemoryStateStore keeps the states in the memory of the process, like the dictionaries used before.
+PostgresStateStore and SQLiteStateStore keep them in a table, so the states survive a restart and several bot
+processes can share them. Their writes are coalesced: put() only remembers the record, and a background thread writes
+all changed records in one batch every flush_interval seconds.
+
+The backend is chosen in config.py (STATE_BACKEND = 'memory', 'postgres' or 'sqlite'), see create_state_store().
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from psycopg2.extras import execute_values
+from telebot.storage import StateStorageBase
+from telebot.storage.base_storage import StateContext
+
+import config
+from card_queue import ChatCard
+from db_pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Незавершённый диалог добавления/удаления слова сбрасывается через 15 минут, состояние неактивного пользователя
+# удаляется через 30 дней
+FLOW_TTL = getattr(config, 'STATE_FLOW_TTL', 15 * 60)
+STATE_TTL = getattr(config, 'STATE_TTL', 30 * 24 * 60 * 60)
+
+
+class UserState:
+    """
+    Conversation state of one user.
+
+    status: step of the dialogue (0 - answering cards, 1 - entering an English word, 2 - entering its translation,
+    3 - entering a word to delete).
+    english_word: English word entered at step 1.
+    state: name of the telebot state (see bot_common.States).
+    data: data saved with BOT.retrieve_data().
+    card: card_queue.ChatCard the user is answering, or None.
+    updated_at: time of the last change (time.time()).
+    """
+    __slots__ = ('status', 'english_word', 'state', 'data', 'card', 'updated_at')
+
+    def __init__(self, status=0, english_word=None, state=None, data=None, card=None, updated_at=None):
+        self.status = status
+        self.english_word = english_word
+        self.state = state
+        self.data = data if data is not None else {}
+        self.card = card
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    def copy(self):
+        card = self.card.copy() if self.card is not None else None
+        return UserState(self.status, self.english_word, self.state, dict(self.data), card, self.updated_at)
+
+    def dumps(self):
+        """
+        Compact JSON representation for the database: a list instead of an object with field names.
+        """
+        card = self.card.to_list() if self.card is not None else None
+        return json.dumps([self.status, self.english_word, self.state, self.data, card], ensure_ascii=False,
+                          separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, record, updated_at):
+        status, english_word, state, data, *card = json.loads(record)
+        card = ChatCard.from_list(card[0]) if card and card[0] is not None else None
+        return cls(status, english_word, state, data, card, updated_at)
+
+    def expire_flow(self, now):
+        """
+        Resets the add/delete dialogue if the user abandoned it more than FLOW_TTL seconds ago.
+        """
+        if self.status != 0 and now - self.updated_at > FLOW_TTL:
+            self.status = 0
+            self.english_word = None
+
+
+class MemoryStateStore:
+    """
+    States in the memory of the process. They are lost on restart and are not shared between processes.
+    """
+
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._records = {}
+        self._operations = 0
+
+    def get(self, user_id):
+        """
+        Returns a copy of the state of the user, or a new state if there is none.
+
+        :param user_id: User ID
+        :return: UserState
+        """
+        now = time.time()
+        with self._lock:
+            record = self._records.get(user_id)
+            record = record.copy() if record is not None and now - record.updated_at <= self.ttl else UserState()
+        record.expire_flow(now)
+        return record
+
+    def put(self, user_id, record):
+        record.updated_at = time.time()
+        with self._lock:
+            self._records[user_id] = record.copy()
+            self._operations += 1
+            if self._operations % 10000 == 0:
+                self._expire(record.updated_at - self.ttl)
+
+    def update(self, user_id, **fields):
+        """
+        Changes the given fields of the state of the user and saves it.
+
+        :param user_id: User ID
+        :param fields: Fields of UserState to change
+        :return: The new UserState
+        """
+        with self._lock:
+            record = self.get(user_id)
+            for name, value in fields.items():
+                setattr(record, name, value)
+            self.put(user_id, record)
+        return record
+
+    def delete(self, user_id):
+        with self._lock:
+            self._records.pop(user_id, None)
+
+    def _expire(self, before):
+        for user_id in [user_id for user_id, record in self._records.items() if record.updated_at < before]:
+            del self._records[user_id]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _SQLStateStore(MemoryStateStore):
+    """
+    Base class of the table-backed stores. Changed records wait in self._dirty until the background thread writes
+    them, and get() returns them from there, so a process always sees its own writes. While a batch is being written
+    it stays visible in self._in_flight until the write is committed. Other processes see the records after at most
+    flush_interval seconds.
+    """
+
+    def __init__(self, ttl=STATE_TTL, flush_interval=0.05, max_dirty=500):
+        super().__init__(ttl=ttl)
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self._dirty = {}  # user_id -> UserState, или None для удаления
+        self._in_flight = {}  # Пачка, которая сейчас записывается в таблицу
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._last_expire = time.time()
+        self._stats = {'puts': 0, 'flushes': 0, 'rows_written': 0}
+        self._thread = threading.Thread(target=self._run, name='state-store', daemon=True)
+        self._thread.start()
+
+    def get(self, user_id):
+        now = time.time()
+        with self._lock:
+            pending = self._dirty if user_id in self._dirty else self._in_flight
+            if user_id in pending:
+                record = pending[user_id]
+                record = record.copy() if record is not None else UserState()
+                record.expire_flow(now)
+                return record
+        row = self._select(user_id)
+        if row is None or now - row[1] > self.ttl:
+            return UserState()
+        record = UserState.loads(*row)
+        record.expire_flow(now)
+        return record
+
+    def put(self, user_id, record):
+        record.updated_at = time.time()
+        with self._lock:
+            self._dirty[user_id] = record.copy()
+            self._stats['puts'] += 1
+            if len(self._dirty) >= self.max_dirty:
+                self._wakeup.set()
+
+    def update(self, user_id, **fields):
+        # Без общей блокировки: чтение из таблицы не должно задерживать других пользователей. Обновления одного
+        # пользователя и так идут по очереди (см. workers.ShardedWorkerPool)
+        record = self.get(user_id)
+        for name, value in fields.items():
+            setattr(record, name, value)
+        self.put(user_id, record)
+        return record
+
+    def delete(self, user_id):
+        with self._lock:
+            self._dirty[user_id] = None
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_expire > 3600:
+                    self._last_expire = time.time()
+                    self._delete_older_than(self._last_expire - self.ttl)
+            except Exception as ex:
+                logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+    def flush(self):
+        """
+        Writes all changed records to the table in one batch.
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                self._in_flight = dirty
+            if not dirty:
+                return
+            rows = [(user_id, record.dumps(), record.updated_at) for user_id, record in dirty.items()
+                    if record is not None]
+            deleted = [(user_id,) for user_id, record in dirty.items() if record is None]
+            try:
+                self._write(rows, deleted)
+            except Exception:
+                # Возвращаем записи, чтобы не потерять их, если за это время не появились более новые
+                with self._lock:
+                    for user_id, record in dirty.items():
+                        self._dirty.setdefault(user_id, record)
+                    self._in_flight = {}
+                raise
+            with self._lock:
+                # Пачка записана: get() снова читает эти записи из таблицы
+                self._in_flight = {}
+                self._stats['flushes'] += 1
+                self._stats['rows_written'] += len(dirty)
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['dirty'] = len(self._dirty)
+        return result
+
+    def _select(self, user_id):
+        raise NotImplementedError
+
+    def _write(self, rows, deleted):
+        raise NotImplementedError
+
+    def _delete_older_than(self, before):
+        raise NotImplementedError
+
+
+class PostgresStateStore(_SQLStateStore):
+    """
+    States in the user_states table of the bot database (see migrations.py), written through the shared connection
+    pool.
+    """
+
+    def _select(self, user_id):
+        with get_pool().connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT record, updated_at FROM user_states WHERE user_id = %s", (user_id,))
+                    return cur.fetchone()
+
+    def _write(self, rows, deleted):
+        with get_pool().connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    if rows:
+                        execute_values(cur, """
+                            INSERT INTO user_states (user_id, record, updated_at)
+                            VALUES %s
+                            ON CONFLICT (user_id) DO UPDATE
+                            SET record = EXCLUDED.record, updated_at = EXCLUDED.updated_at
+                        """, rows)
+                    if deleted:
+                        cur.execute("DELETE FROM user_states WHERE user_id = ANY(%s)",
+                                    ([user_id for user_id, in deleted],))
+
+    def _delete_older_than(self, before):
+        with get_pool().connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM user_states WHERE updated_at < %s", (before,))
+
+
+class SQLiteStateStore(_SQLStateStore):
+    """
+    States in an SQLite file. Convenient for tests and for running the bot without PostgreSQL.
+
+    :param path: Path to the database file, ':memory:' for a temporary database
+    """
+
+    def __init__(self, path=':memory:', **kwargs):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn_lock = threading.Lock()
+        with self._conn_lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_states(
+                user_id INTEGER PRIMARY KEY,
+                record TEXT NOT NULL,
+                updated_at REAL NOT NULL
+                )
+            """)
+        super().__init__(**kwargs)
+
+    def _select(self, user_id):
+        with self._conn_lock:
+            return self._conn.execute("SELECT record, updated_at FROM user_states WHERE user_id = ?",
+                                      (user_id,)).fetchone()
+
+    def _write(self, rows, deleted):
+        with self._conn_lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO user_states (user_id, record, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE
+                SET record = excluded.record, updated_at = excluded.updated_at
+            """, rows)
+            self._conn.executemany("DELETE FROM user_states WHERE user_id = ?", deleted)
+
+    def _delete_older_than(self, before):
+        with self._conn_lock, self._conn:
+            self._conn.execute("DELETE FROM user_states WHERE updated_at < ?", (before,))
+
+
+def create_state_store():
+    """
+    Creates the store selected by STATE_BACKEND in config.py ('memory' by default).
+    """
+    backend = getattr(config, 'STATE_BACKEND', 'memory')
+    if backend == 'postgres':
+        return PostgresStateStore()
+    if backend == 'sqlite':
+        return SQLiteStateStore(getattr(config, 'STATE_SQLITE_PATH', 'states.sqlite3'))
+    if backend == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"Unknown STATE_BACKEND: {backend!r}")
+
+
+class StoreStateStorage(StateStorageBase):
+    """
+    Adapter that lets telebot keep its states (BOT.set_state, BOT.retrieve_data) in a state store instead of
+    StateMemoryStorage. The states are keyed by the user id, the bot works in private chats only.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def set_state(self, chat_id, user_id, state):
+        if hasattr(state, 'name'):
+            state = state.name
+        self.store.update(user_id, state=state)
+        return True
+
+    def delete_state(self, chat_id, user_id):
+        self.store.update(user_id, state=None, data={})
+        return True
+
+    def get_state(self, chat_id, user_id):
+        return self.store.get(user_id).state
+
+    def get_data(self, chat_id, user_id):
+        return self.store.get(user_id).data
+
+    def reset_data(self, chat_id, user_id):
+        self.store.update(user_id, data={})
+        return True
+
+    def set_data(self, chat_id, user_id, key, value):
+        record = self.store.get(user_id)
+        record.data[key] = value
+        self.store.put(user_id, record)
+        return True
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        self.store.update(user_id, data=data)
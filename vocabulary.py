@@ -0,0 +1,259 @@
+"""
+In-memory copy of the common dictionary, so that the cards of the common words are made without queries.
+
+The common pairs (all_words without links in user_words) are the same for every user. They are loaded once at start
+into SharedVocabulary: three parallel arrays of 32-bit numbers (all_words ID, index of the Russian word, index of the
+English word) and two lists of distinct words, so a word that is in several pairs is stored once. The arrays take
+12 bytes per pair; with the str objects of the words one million pairs take about 130 MiB, see
+benchmarks/bench_vocabulary.py. The words added by a user are few; they are loaded per user into a small LRU cache
+and merged with the common pairs when cards are chosen.
+
+The importer (filling_in_the_database.py) increases the number in the vocabulary_version table after it has added
+pairs. Vocabulary checks it every refresh_interval seconds and reloads the common pairs in the background when it
+has changed. The words of a user are reloaded after invalidate(user_id), which is called when the user adds or
+deletes a word, or after user_ttl seconds, so that a change made through another process is picked up too.
+"""
+import logging
+import random
+from bisect import bisect_left
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SharedVocabulary:
+    """
+    Read-only table of the common pairs. A new version of the dictionary is a new object, so readers never see a
+    half-loaded table.
+    """
+    __slots__ = ('version', 'ids', 'russian', 'english', 'russian_words', 'english_words')
+
+    def __init__(self, version, ids, russian, english, russian_words, english_words):
+        self.version = version
+        self.ids = ids
+        self.russian = russian
+        self.english = english
+        self.russian_words = russian_words
+        self.english_words = english_words
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, word_id):
+        # Пары читаются в порядке ID (queries.SHARED_PAIRS), поэтому поиск - двоичный
+        position = bisect_left(self.ids, word_id)
+        return position < len(self.ids) and self.ids[position] == word_id
+
+    def pair(self, index):
+        """
+        :return: Tuple (all_words ID, Russian word, English word)
+        """
+        return (self.ids[index], self.russian_words[self.russian[index]],
+                self.english_words[self.english[index]])
+
+
+class VocabularyBuilder:
+    """
+    Collects the pairs of the common dictionary while they are read from the database. Every distinct word is stored
+    once, and the pairs refer to it by its index.
+    """
+
+    def __init__(self):
+        self.ids = array('i')
+        self.russian = array('i')
+        self.english = array('i')
+        self._russian_index = {}
+        self._english_index = {}
+
+    @staticmethod
+    def _word_index(index, word):
+        position = index.get(word)
+        if position is None:
+            position = index[word] = len(index)
+        return position
+
+    def add(self, word_id, russian, english):
+        self.ids.append(word_id)
+        self.russian.append(self._word_index(self._russian_index, russian))
+        self.english.append(self._word_index(self._english_index, english))
+
+    def build(self, version):
+        # Словари слово -> индекс нужны только при загрузке, в таблице остаются списки слов
+        return SharedVocabulary(version, self.ids, self.russian, self.english,
+                                list(self._russian_index), list(self._english_index))
+
+
+class _VisiblePairs:
+    """
+    IDs of the common pairs and of the pairs of one user, see Vocabulary.visible_pairs().
+    """
+    __slots__ = ('shared', 'own')
+
+    def __init__(self, shared, own):
+        self.shared = shared
+        self.own = own
+
+    def __contains__(self, word_id):
+        return word_id in self.own or word_id in self.shared
+
+
+class Vocabulary:
+    """
+    Source of random word pairs for card_queue.CardQueue that reads the common dictionary from memory.
+
+    :param load_shared: Function (add) that passes every common pair to add(all_words ID, Russian word, English word)
+    and returns the version of the dictionary, see main.load_shared_vocabulary
+    :param load_version: Function () -> current version of the dictionary in the database
+    :param load_user_pairs: Function (user_id) -> list of tuples (all_words ID, Russian word, English word) of the
+    words added by the user
+    :param fallback: Function (user_id, count) used while the common dictionary is not loaded, for example
+    main.random_pairs_from_db
+    :param on_reload: Function (SharedVocabulary) called after the common dictionary is loaded, for example
+    distractors.Distractors.refresh
+    :param refresh_interval: How often the version is checked, in seconds
+    :param user_ttl: After how many seconds the words of a user are loaded again
+    :param max_users: Maximum number of users whose words are kept in memory
+    """
+
+    def __init__(self, load_shared, load_version, load_user_pairs, fallback=None, on_reload=None,
+                 refresh_interval=30.0, user_ttl=300.0, max_users=10000):
+        self.load_shared = load_shared
+        self.load_version = load_version
+        self.load_user_pairs = load_user_pairs
+        self.fallback = fallback
+        self.on_reload = on_reload
+        self.refresh_interval = refresh_interval
+        self.user_ttl = user_ttl
+        self.max_users = max_users
+
+        self._shared = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> (время загрузки, кортеж пар пользователя)
+        self._closed = threading.Event()
+        self._thread = None
+        self._stats = {'reloads': 0, 'user_loads': 0, 'user_hits': 0, 'fallbacks': 0, 'invalidations': 0}
+
+    def reload(self):
+        """
+        Loads the common dictionary from the database and replaces the table in memory.
+
+        :return: Number of loaded pairs
+        """
+        with self._reload_lock:
+            builder = VocabularyBuilder()
+            version = self.load_shared(builder.add)
+            shared = builder.build(version)
+            if self.on_reload is not None:
+                self.on_reload(shared)
+            with self._lock:
+                self._shared = shared
+                self._stats['reloads'] += 1
+            return len(shared)
+
+    def refresh(self):
+        """
+        Reloads the common dictionary if its version in the database has changed.
+        """
+        shared = self._shared
+        version = self.load_version()
+        if shared is None or (version is not None and version != shared.version):
+            self.reload()
+
+    def _run(self):
+        while not self._closed.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as ex:
+                logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+
+    def start(self):
+        """
+        Loads the common dictionary and starts the thread that checks its version. If the database is not available,
+        the cards are taken from fallback until the thread has loaded the dictionary.
+        """
+        try:
+            self.reload()
+        except Exception as ex:
+            logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+        self._thread = threading.Thread(target=self._run, name='vocabulary', daemon=True)
+        self._thread.start()
+
+    def _user_pairs(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and now - cached[0] < self.user_ttl:
+                self._users.move_to_end(user_id)
+                self._stats['user_hits'] += 1
+                return cached[1]
+        pairs = tuple(self.load_user_pairs(user_id) or ())
+        with self._lock:
+            self._users[user_id] = (now, pairs)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            self._stats['user_loads'] += 1
+        return pairs
+
+    def random_pairs(self, user_id, count):
+        """
+        Returns up to count distinct random pairs visible to the user: the common pairs and the pairs added by the
+        user. The common pairs are taken from memory; the pairs of the user are queried only when they are not in
+        the cache.
+
+        :param user_id: User ID
+        :param count: Number of pairs
+        :return: List of tuples (all_words ID, Russian word, English word)
+        """
+        shared = self._shared
+        if shared is None:
+            with self._lock:
+                self._stats['fallbacks'] += 1
+            return self.fallback(user_id, count) if self.fallback is not None else []
+        own = self._user_pairs(user_id)
+        total = len(shared) + len(own)
+        pairs = []
+        for index in random.sample(range(total), min(count, total)):
+            pairs.append(shared.pair(index) if index < len(shared) else own[index - len(shared)])
+        return pairs
+
+    def visible_pairs(self, user_id):
+        """
+        Returns the IDs of the pairs the user can see: the common pairs and the pairs added by the user, for example
+        to drop the repetitions of a deleted word (scheduler.Scheduler).
+
+        :param user_id: User ID
+        :return: Container of all_words IDs that supports "in", or None while the common dictionary is not loaded
+        """
+        shared = self._shared
+        if shared is None:
+            return None
+        return _VisiblePairs(shared, {pair[0] for pair in self._user_pairs(user_id)})
+
+    def invalidate(self, user_id):
+        """
+        Drops the cached words of the user. It must be called after the user adds or deletes a word.
+        """
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        """
+        Returns the counters: reloads of the common dictionary, loads and cache hits of the words of users, cards
+        taken from fallback, invalidations, and the number of common pairs and cached users.
+        """
+        with self._lock:
+            result = dict(self._stats)
+            shared = self._shared
+            result['pairs'] = len(shared) if shared is not None else 0
+            result['version'] = shared.version if shared is not None else None
+            result['users'] = len(self._users)
+        return result
+
+    def close(self):
+        self._closed.set()
@@ -0,0 +1,114 @@
+"""
+Webhook mode of the bot: Telegram sends every update as a POST request to the built-in HTTP server instead of the bot
+polling getUpdates.
+
+The request handler only parses the update and puts it into a ShardedWorkerPool (workers.py). The updates of one chat
+always go to the same worker and are processed in order, the updates of different chats are processed in parallel.
+If the queue of a worker is full, the server answers 503 with Retry-After, and Telegram delivers the update again
+later, so the memory does not grow under overload.
+
+For a local test, updates can be posted by hand:
+
+    curl -X POST -H 'Content-Type: application/json' -d @update.json http://127.0.0.1:8443/webhook
+"""
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from workers import ShardedWorkerPool, update_chat_id
+
+# Сколько секунд просить Telegram подождать перед повторной отправкой, если очередь переполнена
+RETRY_AFTER = 1
+
+
+class WebhookServer:
+    """
+    HTTP server that receives Telegram updates and dispatches them to the handlers of the bot.
+
+    :param bot: TeleBot with registered handlers. Its own thread pool is switched off, the workers of this server
+    call the handlers directly.
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param path: URL path of the webhook
+    :param secret_token: If given, requests without the same X-Telegram-Bot-Api-Secret-Token header are rejected
+    :param workers: Number of worker threads
+    :param queue_size: Maximum number of waiting updates per worker
+    """
+
+    def __init__(self, bot, host='0.0.0.0', port=8443, path='/webhook', secret_token=None, workers=4, queue_size=100):
+        self.bot = bot
+        self.bot.threaded = False
+        self.path = path
+        self.secret_token = secret_token
+        self.pool = ShardedWorkerPool(workers=workers, queue_size=queue_size, name='webhook')
+        # ShardedTeleBot (workers.py) распределяет обновления по своим потокам, здесь они уже в потоке своего чата
+        self.process = getattr(bot, 'process_updates', bot.process_new_updates)
+
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status = webhook.handle(self.path, self.headers, body)
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', str(RETRY_AFTER))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def handle(self, path, headers, body):
+        """
+        Handles one webhook request and returns the HTTP status for it.
+        """
+        if path != self.path:
+            return 404
+        if self.secret_token is not None:
+            token = headers.get('X-Telegram-Bot-Api-Secret-Token') or ''
+            if not hmac.compare_digest(token, self.secret_token):
+                return 403
+        try:
+            update = types.Update.de_json(json.loads(body.decode('utf-8')))
+        except (ValueError, KeyError, TypeError):
+            return 400
+        if not self.pool.submit(update_chat_id(update), self.process, [update]):
+            return 503
+        return 200
+
+    def start(self):
+        """
+        Starts the server in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name='webhook-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        """
+        Stops accepting updates and waits until the queued ones are processed.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self.pool.stop(timeout=timeout)
+
+    def stats(self):
+        return self.pool.stats()
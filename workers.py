@@ -0,0 +1,197 @@
+import logging
+import queue
+import threading
+import time
+
+from telebot import TeleBot
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update):
+    """
+    Returns the id of the chat the update belongs to, so that the updates of one chat can be processed in order.
+    Updates without a chat (for example inline queries) are keyed by the id of the user, and if there is no user
+    either - by the update id.
+
+    :param update: telebot.types.Update
+    :return: Chat ID
+    """
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, name, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for name in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'my_chat_member',
+                 'chat_member', 'chat_join_request'):
+        event = getattr(update, name, None)
+        if event is not None and getattr(event, 'from_user', None) is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+class ShardedWorkerPool:
+    """
+    Fixed set of worker threads with a bounded queue each. Tasks with the same key always go to the same worker, so
+    they run one after another in the order they were submitted, while tasks with different keys run in parallel.
+
+    :param workers: Number of worker threads
+    :param queue_size: Maximum number of waiting tasks per worker
+    :param name: Prefix of the thread names
+    """
+
+    def __init__(self, workers=4, queue_size=100, name='worker'):
+        self.workers = workers
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._run, args=(q,), name=f'{name}-{i}', daemon=True)
+                         for i, q in enumerate(self._queues)]
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                tasks.task_done()
+                return
+            func, args = task
+            try:
+                func(*args)
+                outcome = 'completed'
+            except Exception as ex:
+                logger.error("An exception of type %s occurred. Arguments: %r", type(ex).__name__, ex.args)
+                outcome = 'failed'
+            finally:
+                tasks.task_done()
+            with self._lock:
+                self._stats[outcome] += 1
+
+    def shard(self, key):
+        return hash(key) % self.workers
+
+    def submit(self, key, func, *args, timeout=None):
+        """
+        Puts the task into the queue of the worker for key.
+
+        :param key: Tasks with equal keys are run in order by the same worker
+        :param func: Function to run
+        :param args: Arguments of the function
+        :param timeout: How long to wait for a free place in the queue; None - do not wait
+        :return: True if the task was queued, False if the queue of the worker is full
+        """
+        tasks = self._queues[self.shard(key)]
+        try:
+            if timeout is None:
+                tasks.put_nowait((func, args))
+            else:
+                tasks.put((func, args), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            self._stats['submitted'] += 1
+        return True
+
+    def join(self):
+        """
+        Waits until all queued tasks are done.
+        """
+        for tasks in self._queues:
+            tasks.join()
+
+    def stop(self, timeout=None):
+        """
+        Lets the workers finish the queued tasks and stops them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for tasks in self._queues:
+            tasks.put(None)
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        """
+        Returns the counters of the pool and the current length of every queue.
+        """
+        with self._lock:
+            result = dict(self._stats)
+        result['queued'] = [tasks.qsize() for tasks in self._queues]
+        return result
+
+
+class ShardedTeleBot(TeleBot):
+    """
+    TeleBot that processes the updates of long polling on a ShardedWorkerPool instead of its own thread pool. The
+    thread pool of TeleBot runs the handlers of two quick messages of one user at the same time and in any order, so
+    the second message can read the state of the dialogue before the first one has changed it. Here the updates of one
+    chat are processed one after another in the order Telegram sent them, and the updates of different chats in
+    parallel. The pool is created on the first update, so workers and queue_size can be changed before polling.
+
+    If the queue of a worker is full, the polling thread waits for a free place and does not fetch new updates:
+    Telegram keeps them until the bot catches up.
+
+    :param token: Token of the bot
+    :param workers: Number of worker threads
+    :param queue_size: Maximum number of waiting updates per worker
+    :param submit_timeout: How long to wait for a free place in a queue before logging a warning and waiting again
+    :param kwargs: Other arguments of TeleBot
+    """
+
+    def __init__(self, token, workers=4, queue_size=100, submit_timeout=30.0, **kwargs):
+        kwargs['threaded'] = False  # Обработчики вызываются в потоках пула, а не в пуле telebot
+        super().__init__(token, **kwargs)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.submit_timeout = submit_timeout
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ShardedWorkerPool(workers=self.workers, queue_size=self.queue_size, name='update')
+        return self._pool
+
+    def process_updates(self, updates):
+        """
+        Processes the updates in the calling thread, as TeleBot without threads does. The webhook server (webhook.py)
+        calls it from its own workers.
+        """
+        super().process_new_updates(updates)
+
+    def process_new_updates(self, updates):
+        """
+        Puts every update into the queue of the worker of its chat.
+        """
+        for update in updates:
+            # Номер обновления продвигается сразу, иначе следующий getUpdates вернёт обновления, которые ещё в очереди
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            key = update_chat_id(update)
+            while not self.pool.submit(key, self.process_updates, [update], timeout=self.submit_timeout):
+                logger.warning("The queue of the worker of chat %s is full for %.0f s, polling waits", key,
+                               self.submit_timeout)
+
+    def stop_workers(self, timeout=None):
+        """
+        Lets the workers finish the queued updates and stops them.
+        """
+        if self._pool is not None:
+            self._pool.stop(timeout=timeout)
+
+    def stats(self):
+        """
+        Returns the counters of the pool of updates (see ShardedWorkerPool.stats).
+        """
+        if self._pool is None:
+            return {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        return self._pool.stats()